@@ -0,0 +1,198 @@
+"""
+Admission control for conference rooms and the voice pipeline.
+
+Joins beyond a room's ``max_participants`` are rejected or wait in a per-room
+queue until someone leaves (``ROOM_FULL_POLICY``). The queue lives in the
+worker that hosts the room: the affinity router (chat.affinity) sends all of
+a room's sockets to one worker, so the participant who leaves and the joiners
+waiting for the place meet in the same process. The place is handed to the
+longest-waiting joiner as a reservation, which fresh joins count as taken.
+
+Participants count against capacity while they are online and their
+``last_activity`` is refreshed by the heartbeat of the worker holding their
+socket; rows left online by a worker that crashed are expired after
+``PARTICIPANT_STALE_AFTER`` seconds. New voice messages are
+shed with an ``overloaded`` reply while the worker already has too many
+utterances in flight or too many live requests waiting for an upstream slot,
+so rooms already talking keep their latency.
+"""
+import asyncio
+from collections import deque
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from voice_backend.db_writer import database_write
+from voice_translator.metrics import metrics
+from voice_translator.upstream import get_upstream_gate
+
+from .models import Participant
+
+
+class RoomFull(Exception):
+    pass
+
+
+class AdmissionControl:
+    def __init__(self):
+        self._waiting = {}
+        self._reserved = {}
+        self._members = {}
+        self.pipelines = 0
+
+    # Rooms with participants on this worker
+    def joined(self, room_id, channel_name, participant_id=None):
+        self._members.setdefault(room_id, {})[channel_name] = participant_id
+
+    def left(self, room_id, channel_name):
+        members = self._members.get(room_id)
+        if members is not None:
+            members.pop(channel_name, None)
+            if not members:
+                del self._members[room_id]
+
+    def rooms(self):
+        """{room_id: participants connected to this worker}"""
+        return {room_id: len(members) for room_id, members in self._members.items()}
+
+    def participant_ids(self):
+        return [pk for members in self._members.values() for pk in members.values() if pk is not None]
+
+    # Room capacity
+    def wait_for_slot(self, room_id):
+        """Queue for a place in a full room; returns (future, position in queue)"""
+        waiters = self._waiting.setdefault(room_id, deque())
+        future = asyncio.get_running_loop().create_future()
+        waiters.append(future)
+        return future, len(waiters)
+
+    def cancel_wait(self, room_id, future):
+        waiters = self._waiting.get(room_id)
+        if waiters and future in waiters:
+            waiters.remove(future)
+        if not waiters:
+            self._waiting.pop(room_id, None)
+        if future in self._reserved.get(room_id, ()):
+            # Handed a place it will not take: pass it on
+            self.release(room_id, future)
+            successor = self.slot_freed(room_id)
+            if successor is not None:
+                self.hand_over(successor)
+
+    def has_waiters(self, room_id):
+        return bool(self._waiting.get(room_id))
+
+    def slot_freed(self, room_id):
+        """A participant of a full room is leaving: reserve the place for the longest-waiting
+        joiner. Returns the joiner's future, to pass to hand_over() once the place is free,
+        or None if nobody is waiting."""
+        waiters = self._waiting.get(room_id)
+        successor = None
+        while waiters:
+            future = waiters.popleft()
+            if not future.done():
+                self._reserved.setdefault(room_id, set()).add(future)
+                successor = future
+                break
+        if not waiters:
+            self._waiting.pop(room_id, None)
+        return successor
+
+    def hand_over(self, future):
+        """Wake a joiner whose place was reserved by slot_freed()"""
+        if not future.done():
+            future.set_result(True)
+
+    def reserved(self, room_id):
+        """Places reserved for queued joiners that have not joined yet"""
+        return len(self._reserved.get(room_id, ()))
+
+    def release(self, room_id, future):
+        """A queued joiner has used (or given up) its reserved place"""
+        holders = self._reserved.get(room_id)
+        if holders is not None:
+            holders.discard(future)
+            if not holders:
+                del self._reserved[room_id]
+
+    def queued_joins(self):
+        return sum(len(waiters) for waiters in self._waiting.values())
+
+    # Pipeline load
+    @contextmanager
+    def pipeline(self):
+        """Count an utterance as in flight for the duration of the block"""
+        self.pipelines += 1
+        try:
+            yield
+        finally:
+            self.pipelines -= 1
+
+    def overload_reason(self, replacing=0):
+        """Why a new voice message should be shed right now, or None; `replacing`
+        pipelines were just cancelled to make way for it and are still counted"""
+        if self.pipelines - replacing >= getattr(settings, 'PIPELINE_MAX_IN_FLIGHT', 32):
+            return 'pipeline'
+        if get_upstream_gate().stats()['live_waiting'] >= getattr(settings, 'UPSTREAM_MAX_WAITING', 16):
+            return 'upstream'
+        return None
+
+    def shed(self, reason):
+        metrics.increment('voice_messages_shed', reason=reason)
+        return {
+            'type': 'overloaded',
+            'reason': reason,
+            'message': 'The translation service is busy; please repeat that in a moment.',
+            'retry_after_ms': getattr(settings, 'OVERLOAD_RETRY_AFTER_MS', 2000)
+        }
+
+
+admission = AdmissionControl()
+
+
+def online_cutoff():
+    """Participants whose last_activity is older than this no longer hold a place"""
+    return timezone.now() - timedelta(seconds=getattr(settings, 'PARTICIPANT_STALE_AFTER', 180))
+
+
+@database_write
+def touch_participants(participant_ids):
+    Participant.objects.filter(pk__in=participant_ids).update(last_activity=timezone.now())
+
+
+@database_write
+def expire_stale_participants():
+    """Mark offline the participants no worker has refreshed, e.g. after a crash"""
+    return Participant.objects.filter(is_online=True, last_activity__lt=online_cutoff()).update(
+        is_online=False, is_speaking=False
+    )
+
+
+class PresenceHeartbeat:
+    """Keeps the participants connected to this worker fresh and expires everyone else's stale rows"""
+
+    def __init__(self, interval=60):
+        self.interval = interval
+        self._task = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                participant_ids = admission.participant_ids()
+                if participant_ids:
+                    await touch_participants(participant_ids)
+                expired = await expire_stale_participants()
+                if expired:
+                    print(f"[ADMISSION] Marked {expired} stale participant(s) offline")
+            except Exception as e:
+                print(f"[ERROR] Presence heartbeat failed: {e}")
+            await asyncio.sleep(self.interval)
+
+
+presence_heartbeat = PresenceHeartbeat(getattr(settings, 'PARTICIPANT_HEARTBEAT_INTERVAL', 60))
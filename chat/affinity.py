@@ -0,0 +1,207 @@
+"""
+Room-affinity front router for several Daphne workers on one host.
+
+Every ``/ws/conference/<room_id>/`` connection is proxied to the worker that
+owns the room on a consistent-hash ring, so all of a room's sockets live in
+one process and most group fan-out stays local to it. Other requests are
+spread by client address. Workers are health-checked and the ring is rebuilt
+when one goes down or comes back; consistent hashing keeps every other room
+where it was. Sockets already open stay on their worker, and the shared
+channel layer keeps a room working while it is split during a rebalance.
+
+Workers are addressed as ``host:port`` or ``unix:/path/to/daphne.sock``.
+"""
+import asyncio
+import bisect
+import hashlib
+import re
+from urllib.parse import urlsplit
+
+# Mirrors the conference route in chat.routing, plus the room history API,
+# which is served from the ring buffer of the worker that owns the room
+ROOM_PATHS = [
+    re.compile(r'^/ws/conference/(?P<room_id>\w+)/$'),
+    re.compile(r'^/chat/rooms/(?P<room_id>\w+)/history/$'),
+]
+
+MAX_HEAD_SIZE = 64 * 1024
+PIPE_CHUNK_SIZE = 64 * 1024
+
+# Set by the router only; a client's own copies would be trusted by Daphne (--proxy-headers)
+PROXY_HEADERS = (b'x-forwarded-for', b'x-forwarded-port', b'x-forwarded-proto')
+
+
+def strip_proxy_headers(headers):
+    """Drop PROXY_HEADERS from a raw header block (everything after the request line)"""
+    lines = headers.split(b'\r\n')
+    kept = [line for line in lines if line.partition(b':')[0].strip().lower() not in PROXY_HEADERS]
+    return b'\r\n'.join(kept)
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """Consistent-hash ring with virtual nodes"""
+
+    def __init__(self, nodes=(), replicas=100):
+        self.replicas = replicas
+        self._keys = []
+        self._nodes = {}
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node):
+        for i in range(self.replicas):
+            point = _hash(f'{node}#{i}')
+            if point not in self._nodes:
+                bisect.insort(self._keys, point)
+                self._nodes[point] = node
+
+    def remove(self, node):
+        for i in range(self.replicas):
+            point = _hash(f'{node}#{i}')
+            if self._nodes.get(point) == node:
+                del self._nodes[point]
+                self._keys.remove(point)
+
+    @property
+    def nodes(self):
+        return set(self._nodes.values())
+
+    def get(self, key, exclude=()):
+        """The node owning `key`, skipping any in `exclude`"""
+        if not self._keys:
+            return None
+        start = bisect.bisect(self._keys, _hash(key))
+        for offset in range(len(self._keys)):
+            node = self._nodes[self._keys[(start + offset) % len(self._keys)]]
+            if node not in exclude:
+                return node
+        return None
+
+
+def room_for_path(target):
+    """Room id of a conference WebSocket or room history request target, or None"""
+    path = urlsplit(target).path
+    for pattern in ROOM_PATHS:
+        match = pattern.match(path)
+        if match:
+            return match.group('room_id')
+    return None
+
+
+async def open_worker_connection(worker, timeout):
+    if worker.startswith('unix:'):
+        connect = asyncio.open_unix_connection(worker[len('unix:'):])
+    else:
+        host, _, port = worker.rpartition(':')
+        connect = asyncio.open_connection(host, int(port))
+    return await asyncio.wait_for(connect, timeout=timeout)
+
+
+class AffinityRouter:
+    def __init__(self, workers, replicas=100, health_interval=2.0, connect_timeout=2.0):
+        self.workers = list(workers)
+        self.health_interval = health_interval
+        self.connect_timeout = connect_timeout
+        self.ring = HashRing(self.workers, replicas=replicas)
+        self.stats = {worker: {'connections': 0, 'active': 0, 'failures': 0} for worker in self.workers}
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self._handle_client, host, port, limit=MAX_HEAD_SIZE)
+        health = asyncio.ensure_future(self._health_loop())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            health.cancel()
+
+    def mark_down(self, worker):
+        if worker in self.ring.nodes:
+            print(f"[AFFINITY] Worker {worker} is down, rebalancing its rooms")
+            self.ring.remove(worker)
+
+    def mark_up(self, worker):
+        if worker not in self.ring.nodes:
+            print(f"[AFFINITY] Worker {worker} is up, rebalancing rooms onto it")
+            self.ring.add(worker)
+
+    async def _health_loop(self):
+        while True:
+            for worker in self.workers:
+                try:
+                    _, writer = await open_worker_connection(worker, self.connect_timeout)
+                    writer.close()
+                except (OSError, asyncio.TimeoutError):
+                    self.mark_down(worker)
+                else:
+                    self.mark_up(worker)
+            await asyncio.sleep(self.health_interval)
+
+    async def _connect(self, key):
+        """Connect to the worker owning `key`, failing over along the ring"""
+        tried = set()
+        while True:
+            worker = self.ring.get(key, exclude=tried)
+            if worker is None:
+                raise ConnectionError('No healthy workers')
+            try:
+                reader, writer = await open_worker_connection(worker, self.connect_timeout)
+                return worker, reader, writer
+            except (OSError, asyncio.TimeoutError):
+                self.stats[worker]['failures'] += 1
+                tried.add(worker)
+                self.mark_down(worker)
+
+    async def _handle_client(self, client_reader, client_writer):
+        peer = client_writer.get_extra_info('peername')
+        client_host = peer[0] if isinstance(peer, tuple) else 'local'
+        worker_writer = None
+        worker = None
+        try:
+            head = await client_reader.readuntil(b'\r\n\r\n')
+            request_line, _, headers = head.partition(b'\r\n')
+            parts = request_line.decode('latin-1').split(' ')
+            if len(parts) != 3:
+                return
+
+            room_id = room_for_path(parts[1])
+            key = f'room:{room_id}' if room_id else f'client:{client_host}'
+            worker, worker_reader, worker_writer = await self._connect(key)
+            self.stats[worker]['connections'] += 1
+            self.stats[worker]['active'] += 1
+
+            # Let Daphne (--proxy-headers) see the real client address
+            forwarded = f'X-Forwarded-For: {client_host}\r\n'.encode('latin-1')
+            worker_writer.write(request_line + b'\r\n' + forwarded + strip_proxy_headers(headers))
+
+            await asyncio.gather(
+                self._pipe(client_reader, worker_writer),
+                self._pipe(worker_reader, client_writer)
+            )
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            if worker is not None and worker_writer is not None:
+                self.stats[worker]['active'] -= 1
+                worker_writer.close()
+            client_writer.close()
+
+    async def _pipe(self, reader, writer):
+        try:
+            while True:
+                data = await reader.read(PIPE_CHUNK_SIZE)
+                if not data:
+                    break
+                writer.write(data)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            if writer.can_write_eof():
+                try:
+                    writer.write_eof()
+                except OSError:
+                    pass
@@ -1,6 +1,12 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class ChatConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chat'
+
+    def ready(self):
+        if getattr(settings, 'SESSION_RECORDING_DIR', None):
+            from .recording import start_recording
+            start_recording()
@@ -0,0 +1,99 @@
+"""
+Catch-up translation for participants who join late or switch language.
+
+The last few utterances of the room that have no stored translation in the
+participant's language are translated in the background, a batch per run of
+consecutive utterances in one source language, and streamed to the
+participant as ``history_translation`` events in chronological order.
+Translations already stored for the language are reused as-is and were sent
+with the history page. Upstream calls go through the upstream gate at
+background priority, so catch-up never delays a live translation.
+"""
+from django.conf import settings
+
+from voice_backend.db_writer import database_read, database_write
+from voice_translator.languages import languages
+from voice_translator.metrics import metrics
+from voice_translator.upstream import PRIORITY_BACKGROUND
+
+from .history import recent_entries, room_history
+from .models import TranslatedAudio
+
+
+def pending_batches(entries, language, batch_size):
+    """Group untranslated entries (oldest first) into batches sharing a source language"""
+    batches = []
+    for entry in entries:
+        if entry['original_language'] == language or language in entry['translations']:
+            continue
+        if (batches and batches[-1][0]['original_language'] == entry['original_language']
+                and len(batches[-1]) < batch_size):
+            batches[-1].append(entry)
+        else:
+            batches.append([entry])
+    return batches
+
+
+@database_write
+def save_catch_up(participant, language, entries, texts):
+    # One row per message and listener: a later language switch replaces the earlier translation
+    TranslatedAudio.objects.bulk_create([
+        TranslatedAudio(
+            voice_message_id=entry['pk'],
+            target_participant=participant,
+            target_language=language,
+            translated_text=text,
+            translation_status='completed'
+        )
+        for entry, text in zip(entries, texts)
+    ], update_conflicts=True, unique_fields=['voice_message', 'target_participant'],
+        update_fields=['target_language', 'translated_text', 'translation_status'])
+
+
+async def catch_up(consumer, participant):
+    """Translate recent room history into the participant's language and stream it to them"""
+    language = languages.normalize(participant.preferred_language)
+    limit = getattr(settings, 'CATCHUP_TRANSLATION_LIMIT', 20)
+    batch_size = getattr(settings, 'CATCHUP_BATCH_SIZE', 8)
+
+    try:
+        entries = await database_read(recent_entries)(consumer.room_id, None, limit)
+    except Exception as e:
+        print(f"[ERROR] Catch-up could not load history for {participant.name}: {e}")
+        return
+
+    batches = pending_batches(reversed(entries), language, batch_size)
+    if not batches:
+        return
+
+    print(f"[DEBUG] Catch-up for {participant.name}: {sum(map(len, batches))} utterances into {language}")
+    metrics.increment('catchup_jobs', language=language)
+
+    for batch in batches:
+        source_language = batch[0]['original_language']
+        try:
+            texts = await consumer.voice_service.translate_batch_gpt(
+                [entry['original_text'] for entry in batch], source_language, language,
+                priority=PRIORITY_BACKGROUND
+            )
+        except Exception as e:
+            print(f"[ERROR] Catch-up translation failed for {participant.name}: {e}")
+            metrics.increment('catchup_failures', language=language)
+            continue
+
+        await save_catch_up(participant, language, batch, texts)
+        metrics.increment('catchup_translations', len(batch), language=language)
+
+        for entry, text in zip(batch, texts):
+            room_history.add_translation(consumer.room_id, entry['message_id'], language, text)
+            await consumer.send_payload({
+                'type': 'history_translation',
+                'voice_message_id': entry['message_id'],
+                'speaker_id': entry['speaker_id'],
+                'speaker_name': entry['speaker_name'],
+                'original_text': entry['original_text'],
+                'original_language': entry['original_language'],
+                'translated_text': text,
+                'target_language': language,
+                'timestamp': entry['timestamp'].isoformat()
+            })
@@ -1,13 +1,50 @@
 import json
 import asyncio
 import base64
-import tempfile
-import os
+import io
+import re
+import time
+import uuid
 from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.db import database_sync_to_async
+from django.conf import settings
 from django.core.files.base import ContentFile
+from django.db import transaction
+from voice_backend.backpressure import write_buffer_extension
+from voice_backend.db_writer import database_read, database_write
 from .models import ConferenceRoom, Participant, VoiceMessage, TranslatedAudio
 from voice_translator.services import VoiceTranslationService
+from voice_translator.audio import PCM_FORMATS
+from voice_translator.deadline import Deadline
+from voice_translator.languages import languages
+from voice_translator.metrics import metrics
+from .admission import RoomFull, admission, online_cutoff
+from .catchup import catch_up
+from .recording import record_connection, utterance_scope
+from .outbound import PRIORITY_CONTROL, PRIORITY_STATUS, PRIORITY_TRANSLATION, OutboundQueue
+from .history import get_history_page, make_entry, room_history
+from .events import (
+    PROTOCOL_JSON, PROTOCOL_MSGPACK, SHORT_KEYS, SHORT_TYPES,
+    binary_frame, decode_message, encode_payload, envelope
+)
+
+
+# Client-chosen utterance ids are echoed to every listener
+UTTERANCE_ID = re.compile(r'[A-Za-z0-9_-]{1,64}')
+
+
+def utterance_budget_ms(requested):
+    """The latency budget for an utterance: UTTERANCE_BUDGET_MS, or a tighter one the client asked for"""
+    budget_ms = getattr(settings, 'UTTERANCE_BUDGET_MS', 8000)
+    if requested is None:
+        return budget_ms
+    try:
+        requested = float(requested)
+    except (TypeError, ValueError):
+        raise Exception('Invalid budget_ms')
+    # Also rejects NaN
+    if not requested > 0:
+        raise Exception('budget_ms must be positive')
+    return min(budget_ms, requested)
 
 
 class ConferenceConsumer(AsyncWebsocketConsumer):
@@ -15,6 +52,11 @@ class ConferenceConsumer(AsyncWebsocketConsumer):
         self.room_id = self.scope['url_route']['kwargs']['room_id']
         self.room_group_name = f'conference_{self.room_id}'
         self.participant = None
+        self.protocol = PROTOCOL_JSON
+        self.catch_up_task = None
+        self.voice_tasks = {}
+        self.speaking = False
+        self.join_task = None
         self.voice_service = VoiceTranslationService()
 
         # Join room group
@@ -25,17 +67,52 @@ class ConferenceConsumer(AsyncWebsocketConsumer):
 
         await self.accept()
 
+        # Inbound frames and upstream responses, when this room is being recorded
+        self.recording = record_connection(self.room_id)
+
+        # All frames to this client go through a bounded queue and one writer task,
+        # which holds back while the socket's write buffer is full (Daphne only)
+        write_buffer = write_buffer_extension(self.scope)
+        self.outbound = OutboundQueue(
+            self.send,
+            self.close,
+            name=self.channel_name,
+            max_size=getattr(settings, 'OUTBOUND_QUEUE_SIZE', 256),
+            policy=getattr(settings, 'OUTBOUND_OVERFLOW_POLICY', 'drop'),
+            buffered=write_buffer['size'] if write_buffer else None,
+            high_water=getattr(settings, 'OUTBOUND_HIGH_WATER_BYTES', 256 * 1024)
+        )
+        self.writer_task = asyncio.ensure_future(self.outbound.run())
+
     async def disconnect(self, close_code):
+        if self.catch_up_task:
+            self.catch_up_task.cancel()
+        for task in list(self.voice_tasks.values()):
+            task.cancel()
+        if self.join_task:
+            self.join_task.cancel()
+        if getattr(self, 'writer_task', None):
+            self.writer_task.cancel()
+            self.outbound.detach()
+
         # Remove participant and notify others
         if self.participant:
-            await self.set_participant_offline()
+            admission.left(self.room_id, self.channel_name)
+            # Reserve the place for a queued joiner before it shows as free, so a
+            # fresh join cannot take it, and wake the joiner once it is free
+            successor = admission.slot_freed(self.room_id) if admission.has_waiters(self.room_id) else None
+            try:
+                await self.set_participant_offline()
+            finally:
+                if successor is not None:
+                    admission.hand_over(successor)
             await self.channel_layer.group_send(
                 self.room_group_name,
-                {
+                envelope('participant_left', {
                     'type': 'participant_left',
                     'participant_id': self.participant.participant_id,
                     'participant_name': self.participant.name
-                }
+                }, participant_id=str(self.participant.participant_id))
             )
 
         # Leave room group
@@ -44,232 +121,437 @@ class ConferenceConsumer(AsyncWebsocketConsumer):
             self.channel_name
         )
 
-    async def receive(self, text_data):
+        if getattr(self, 'recording', None):
+            self.recording.closed(close_code)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        if self.recording:
+            self.recording.received(text_data, bytes_data)
         try:
-            data = json.loads(text_data)
+            # Binary frames come from clients that negotiated msgpack
+            if bytes_data is not None:
+                data = decode_message(bytes_data)
+            else:
+                data = json.loads(text_data)
             message_type = data.get('type')
 
             if message_type == 'join_conference':
                 await self.handle_join_conference(data)
             elif message_type == 'voice_message':
                 await self.handle_voice_message(data)
+            elif message_type == 'history_request':
+                await self.handle_history_request(data)
+            elif message_type == 'change_language':
+                await self.handle_change_language(data)
             elif message_type == 'ping':
-                await self.send(text_data=json.dumps({'type': 'pong'}))
+                await self.send_payload({'type': 'pong'})
 
         except Exception as e:
-            await self.send(text_data=json.dumps({
+            await self.send_payload({
                 'type': 'error',
                 'message': str(e)
-            }))
+            })
 
-    async def handle_join_conference(self, data):
+    async def handle_join_conference(self, data, slot=None):
         try:
             participant_name = data.get('participant_name')
-            language = data.get('language', 'en')
+            language = 'en'
+            if data.get('language'):
+                language = languages.require(data['language'])
+
+            # Switch to compact binary frames if the client asked for them
+            if data.get('protocol') == PROTOCOL_MSGPACK and self.protocol != PROTOCOL_MSGPACK:
+                await self.send_payload({
+                    'type': 'protocol',
+                    'protocol': PROTOCOL_MSGPACK,
+                    'keys': SHORT_KEYS,
+                    'types': SHORT_TYPES
+                })
+                self.protocol = PROTOCOL_MSGPACK
 
             # Create or get conference room
             room = await self.get_or_create_room()
             
-            # Create or get participant
-            self.participant = await self.create_participant(
-                room, participant_name, language
-            )
+            # Create or get participant, if the room has space; places handed to
+            # queued joiners count as taken, except the one this join holds
+            held = admission.reserved(self.room_id) - (1 if slot is not None else 0)
+            try:
+                self.participant = await self.create_participant(
+                    room, participant_name, language, held
+                )
+            except RoomFull:
+                await self.handle_room_full(room, data)
+                return
+            finally:
+                if slot is not None:
+                    admission.release(self.room_id, slot)
+            admission.joined(self.room_id, self.channel_name, self.participant.pk)
 
             # Send current participants list
             participants = await self.get_participants_list(room)
-            await self.send(text_data=json.dumps({
+            await self.send_payload({
                 'type': 'participants_list',
                 'participants': participants
-            }))
+            }, PRIORITY_STATUS, key='participants_list')
 
             # Notify others about new participant
             await self.channel_layer.group_send(
                 self.room_group_name,
-                {
+                envelope('participant_joined', {
                     'type': 'participant_joined',
                     'participant': {
                         'id': self.participant.participant_id,
                         'name': self.participant.name,
                         'language': self.participant.preferred_language
                     }
-                }
+                }, participant_id=str(self.participant.participant_id))
             )
 
-            await self.send(text_data=json.dumps({
+            await self.send_payload({
                 'type': 'joined_successfully',
                 'participant_id': self.participant.participant_id,
                 'room_name': room.room_name
-            }))
+            })
+
+            # Bring the newcomer up to speed on what was said before they joined
+            self.start_catch_up()
 
         except Exception as e:
-            await self.send(text_data=json.dumps({
+            await self.send_payload({
                 'type': 'error',
                 'message': f'Failed to join conference: {str(e)}'
-            }))
+            })
+
+    async def handle_room_full(self, room, data):
+        """Reject the join, or queue it until someone leaves (ROOM_FULL_POLICY)"""
+        policy = getattr(settings, 'ROOM_FULL_POLICY', 'queue')
+        metrics.increment('room_full', policy=policy)
+        if policy != 'queue':
+            await self.send_payload({
+                'type': 'room_full',
+                'message': f'{room.room_name} is full ({room.max_participants} participants)',
+                'max_participants': room.max_participants
+            })
+            return
+
+        slot, position = admission.wait_for_slot(self.room_id)
+        await self.send_payload({
+            'type': 'join_queued',
+            'position': position,
+            'message': f'{room.room_name} is full; you will join when a place frees up'
+        })
+        # Wait in the background so a disconnect can still be handled
+        self.join_task = asyncio.ensure_future(self.join_when_free(slot, room, data))
+
+    async def join_when_free(self, slot, room, data):
+        try:
+            await asyncio.wait_for(slot, timeout=getattr(settings, 'ROOM_JOIN_QUEUE_TIMEOUT', 120))
+        except asyncio.TimeoutError:
+            admission.cancel_wait(self.room_id, slot)
+            await self.send_payload({
+                'type': 'room_full',
+                'message': f'{room.room_name} is still full, please try again later',
+                'max_participants': room.max_participants
+            })
+            return
+        except asyncio.CancelledError:
+            admission.cancel_wait(self.room_id, slot)
+            raise
+        try:
+            await self.handle_join_conference(data, slot)
+        finally:
+            admission.release(self.room_id, slot)
 
     async def handle_voice_message(self, data):
         try:
             if not self.participant:
                 raise Exception('Not joined to conference')
 
-            # Decode base64 audio
-            audio_data = base64.b64decode(data.get('audio_data', ''))
-            speaker_language = data.get('speaker_language', self.participant.preferred_language)
+            # msgpack clients send raw bytes; JSON clients send base64
+            audio_data = data.get('audio_data', '')
+            if not isinstance(audio_data, bytes):
+                audio_data = base64.b64decode(audio_data)
+            # Only a hint for transcription; an unknown one falls back to the participant's language
+            hinted = languages.get(data.get('speaker_language'))
+            speaker_language = hinted.code if hinted else languages.normalize(self.participant.preferred_language)
+
+            # Clients may send headerless PCM frames instead of a container
+            pcm_format = None
+            if data.get('audio_format') in PCM_FORMATS:
+                pcm_format = {
+                    'format': data['audio_format'],
+                    'sample_rate': data.get('sample_rate', 48000),
+                    'channels': data.get('channels', 1)
+                }
 
             if not audio_data:
                 raise Exception('No audio data provided')
 
-            print(f"[DEBUG] Processing voice message from {self.participant.name}, audio size: {len(audio_data)} bytes")
+            # Each utterance has a latency budget; clients may ask for a tighter one
+            deadline = Deadline(utterance_budget_ms(data.get('budget_ms')))
+            # A newer revision of an utterance (same utterance_id, e.g. the final
+            # clip after a partial) supersedes the one still in flight
+            utterance_id = data.get('utterance_id') or uuid.uuid4().hex
+            if not isinstance(utterance_id, str) or not UTTERANCE_ID.fullmatch(utterance_id):
+                raise Exception('Invalid utterance_id')
 
-            # Create temporary audio file
-            with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as temp_file:
-                temp_file.write(audio_data)
-                temp_file_path = temp_file.name
+        except Exception as e:
+            print(f"[ERROR] Voice message processing failed: {e}")
+            await self.send_payload({
+                'type': 'error',
+                'message': f'Voice processing failed: {str(e)}'
+            })
+            return
+
+        previous = self.voice_tasks.get(utterance_id)
+        superseding = previous is not None and not previous.done()
+        if superseding:
+            # Superseded whether or not the new revision is admitted
+            previous.cancel()
+            metrics.increment('utterance_superseded')
+            print(f"[DEBUG] Superseded in-flight utterance {utterance_id} from {self.participant.name}")
+
+        # Shed new work while the worker is saturated, revisions included
+        overload = admission.overload_reason(replacing=1 if superseding else 0)
+        if overload:
+            print(f"[DEBUG] Shedding voice message from {self.participant.name}: {overload} overloaded")
+            await self.send_payload(admission.shed(overload))
+            return
+
+        # Process in the background so the socket keeps receiving while STT
+        # and translation run, which is what makes supersession possible
+        with utterance_scope(audio_data):
+            task = asyncio.ensure_future(self.run_pipeline(
+                audio_data, speaker_language, pcm_format, deadline, bool(data.get('partial')), utterance_id
+            ))
+        self.voice_tasks[utterance_id] = task
+        task.add_done_callback(lambda done: self.pipeline_done(utterance_id, done))
+
+    def pipeline_done(self, utterance_id, task):
+        """Runs however the pipeline ended, even if it was cancelled before it started"""
+        if self.voice_tasks.get(utterance_id) is task:
+            del self.voice_tasks[utterance_id]
+        # A superseding revision is already registered, so the status stays on
+        if not self.voice_tasks and self.speaking:
+            asyncio.ensure_future(self.announce_speaking(False))
+
+    async def announce_speaking(self, is_speaking):
+        """Store and broadcast this participant's speaking status when it changes.
+        Overlapping utterances keep it on until the last one has finished."""
+        if is_speaking == self.speaking or (not is_speaking and self.voice_tasks):
+            return
+        self.speaking = is_speaking
+        await self.set_speaking_status(is_speaking)
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            envelope('speaking_status', {
+                'type': 'speaking_status',
+                'participant_id': self.participant.participant_id,
+                'is_speaking': is_speaking
+            }, participant_id=str(self.participant.participant_id))
+        )
 
-            try:
-                # Set speaking status
-                await self.set_speaking_status(True)
-                
-                # Notify others that participant is speaking
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        'type': 'speaking_status',
-                        'participant_id': self.participant.participant_id,
-                        'is_speaking': True
-                    }
-                )
+    async def run_pipeline(self, *args):
+        with admission.pipeline():
+            await self.process_voice_message(*args)
+
+    async def process_voice_message(self, audio_data, speaker_language, pcm_format, deadline, partial=False,
+                                    utterance_id=None):
+        try:
+            print(f"[DEBUG] Processing voice message from {self.participant.name}, audio size: {len(audio_data)} bytes")
 
-                print(f"[DEBUG] Starting transcription for {self.participant.name}")
+            # Set speaking status and notify others; pipeline_done turns it off
+            await self.announce_speaking(True)
 
-                # Process voice message through the translation pipeline
-                with open(temp_file_path, 'rb') as audio_file:
-                    # Get all participants and their languages
-                    participants = await self.get_room_participants()
+            print(f"[DEBUG] Starting transcription for {self.participant.name}")
+
+            # Process voice message through the translation pipeline
+            # Keep the clip in memory; no temp file round trip on the event loop
+            with io.BytesIO(audio_data) as audio_file:
+                # Get all participants and their languages
+                participants = await self.get_room_participants()
+                
+                # Transcribe the audio first
+                try:
+                    transcription_result = await deadline.run(
+                        self.voice_service.transcribe_audio_whisper(audio_file, pcm_format, deadline),
+                        'transcription'
+                    )
+                    original_text = transcription_result.get('text', '')
+                    # Whisper names languages ('english') or cannot tell; participants store codes
+                    detected_language = languages.normalize(transcription_result.get('language'), speaker_language)
                     
-                    # Transcribe the audio first
-                    try:
-                        transcription_result = await self.voice_service.transcribe_audio_whisper(audio_file)
-                        original_text = transcription_result.get('text', '')
-                        detected_language = transcription_result.get('language', speaker_language)
-                        
-                        print(f"[DEBUG] Transcription successful: '{original_text}' (detected: {detected_language})")
+                    print(f"[DEBUG] Transcription successful: '{original_text}' (detected: {detected_language})")
+                    
+                    if not original_text.strip():
+                        raise Exception("No speech detected in audio")
                         
-                        if not original_text.strip():
-                            raise Exception("No speech detected in audio")
-                            
-                    except Exception as transcribe_error:
-                        print(f"[ERROR] Transcription failed: {transcribe_error}")
-                        # Send error message to user
-                        await self.send(text_data=json.dumps({
-                            'type': 'error',
-                            'message': f'Speech recognition failed: {str(transcribe_error)}'
-                        }))
-                        return
-
-                    # Save original voice message
+                except Exception as transcribe_error:
+                    print(f"[ERROR] Transcription failed: {transcribe_error}")
+                    # Send error message to user
+                    await self.send_payload({
+                        'type': 'error',
+                        'message': f'Speech recognition failed: {str(transcribe_error)}'
+                    })
+                    return
+
+                # Partial results are shown but not stored; the final clip is
+                voice_message = None
+                if not partial:
                     voice_message = await self.save_voice_message(
                         original_text, detected_language, audio_data
                     )
 
-                    print(f"[DEBUG] Processing translations for {len(participants)} participants")
-
-                    # Translate for each participant
-                    translation_count = 0
-                    for participant in participants:
-                        if participant.participant_id != self.participant.participant_id:
-                            target_language = participant.preferred_language
-                            
-                            try:
-                                if detected_language != target_language:
-                                    # Translate text
-                                    translated_text = await self.voice_service.translate_text_gpt(
-                                        original_text, detected_language, target_language
-                                    )
-                                    print(f"[DEBUG] Translated to {target_language}: '{translated_text}'")
-                                else:
-                                    translated_text = original_text
-                                    print(f"[DEBUG] No translation needed for {target_language}")
-
-                                # Send translation to specific participant
-                                await self.channel_layer.group_send(
-                                    self.room_group_name,
-                                    {
-                                        'type': 'voice_translation',
-                                        'target_participant_id': participant.participant_id,
-                                        'speaker_name': self.participant.name,
-                                        'speaker_id': self.participant.participant_id,
-                                        'original_text': original_text,
-                                        'translated_text': translated_text,
-                                        'original_language': detected_language,
-                                        'target_language': target_language,
-                                        'voice_message_id': voice_message.message_id
-                                    }
-                                )
-                                translation_count += 1
-                                
-                            except Exception as translate_error:
-                                print(f"[ERROR] Translation failed for {participant.name}: {translate_error}")
-                                # Send translation error to specific participant
-                                await self.channel_layer.group_send(
-                                    self.room_group_name,
-                                    {
-                                        'type': 'voice_translation',
-                                        'target_participant_id': participant.participant_id,
-                                        'speaker_name': self.participant.name,
-                                        'speaker_id': self.participant.participant_id,
-                                        'original_text': original_text,
-                                        'translated_text': f"[Translation Error: {str(translate_error)}]",
-                                        'original_language': detected_language,
-                                        'target_language': target_language,
-                                        'voice_message_id': voice_message.message_id,
-                                        'error': True
-                                    }
-                                )
-
-                    print(f"[DEBUG] Sent {translation_count} translations")
-
-                # Set speaking status to false
-                await self.set_speaking_status(False)
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        'type': 'speaking_status',
-                        'participant_id': self.participant.participant_id,
-                        'is_speaking': False
-                    }
+                listeners = [p for p in participants if p.participant_id != self.participant.participant_id]
+                print(f"[DEBUG] Processing translations for {len(listeners)} participants")
+
+                # Translate once per target language, concurrently, within what is left of the budget
+                async def translate(target_language):
+                    if detected_language == target_language:
+                        print(f"[DEBUG] No translation needed for {target_language}")
+                        metrics.increment('translation_skipped', reason='same_language')
+                        return original_text
+                    translated_text = await self.voice_service.translate_text_gpt(
+                        original_text, detected_language, target_language, deadline=deadline
+                    )
+                    print(f"[DEBUG] Translated to {target_language}: '{translated_text}'")
+                    return translated_text
+
+                results = await deadline.run_each(
+                    {language: translate(language) for language in {languages.normalize(p.preferred_language) for p in listeners}},
+                    'translation'
                 )
 
-            finally:
-                # Clean up temporary file
-                if os.path.exists(temp_file_path):
-                    os.unlink(temp_file_path)
+                # Receivers drop events that reach them after the fan-out grace period
+                expires_at = deadline.expires_at + getattr(settings, 'UTTERANCE_FANOUT_GRACE_MS', 2000) / 1000.0
+
+                translation_count = 0
+                translations = {}
+                deliveries = []
+                for participant in listeners:
+                    target_language = languages.normalize(participant.preferred_language)
+                    result = results[target_language]
+                    payload = {
+                        'type': 'voice_translation',
+                        'speaker_name': self.participant.name,
+                        'speaker_id': self.participant.participant_id,
+                        'original_text': original_text,
+                        'original_language': detected_language,
+                        'target_language': target_language,
+                        'voice_message_id': voice_message.message_id if voice_message else None,
+                        'utterance_id': utterance_id,
+                        'partial': partial
+                    }
+
+                    if isinstance(result, Exception):
+                        print(f"[ERROR] Translation failed for {participant.name}: {result}")
+                        # Degraded mode: a cached translation, or the original flagged as untranslated
+                        fallback_text, untranslated = self.voice_service.fallback_translation(
+                            original_text, detected_language, target_language
+                        )
+                        if untranslated:
+                            deliveries.append((participant, target_language, str(result), 'failed'))
+                        else:
+                            translations[target_language] = fallback_text
+                            deliveries.append((participant, target_language, fallback_text, 'completed'))
+                        payload.update({
+                            'translated_text': fallback_text,
+                            'degraded': True,
+                            'untranslated': untranslated
+                        })
+                    else:
+                        translations[target_language] = result
+                        deliveries.append((participant, target_language, result, 'completed'))
+                        payload['translated_text'] = result
+                        translation_count += 1
+
+                    # Send translation to specific participant
+                    await self.channel_layer.group_send(
+                        self.room_group_name,
+                        envelope('voice_translation', payload,
+                                 target_participant_id=str(participant.participant_id), expires_at=expires_at)
+                    )
+
+                print(f"[DEBUG] Sent {translation_count} translations")
+
+                # Keep the results so history requests never translate again
+                if voice_message:
+                    await self.save_translations(voice_message, deliveries)
+                    room_history.record(self.room_id, make_entry(
+                        voice_message, self.participant.name, self.participant.participant_id, translations
+                    ))
 
         except Exception as e:
             print(f"[ERROR] Voice message processing failed: {e}")
-            await self.send(text_data=json.dumps({
+            await self.send_payload({
                 'type': 'error',
                 'message': f'Voice processing failed: {str(e)}'
-            }))
+            })
+
+    async def handle_change_language(self, data):
+        if not self.participant:
+            raise Exception('Not joined to conference')
+
+        if not data.get('language'):
+            raise Exception('No language provided')
+        language = languages.require(data['language'])
+
+        await self.set_preferred_language(language)
+        await self.send_payload({
+            'type': 'language_changed',
+            'language': language
+        })
+        self.start_catch_up()
+
+    def start_catch_up(self):
+        """Run catch-up translation in the background, replacing any earlier run"""
+        if self.catch_up_task:
+            self.catch_up_task.cancel()
+        self.catch_up_task = asyncio.ensure_future(catch_up(self, self.participant))
+
+    async def handle_history_request(self, data):
+        """Send one page of the room transcript in this participant's language"""
+        language = self.participant.preferred_language if self.participant else data.get('language')
+        page = await database_read(get_history_page)(
+            self.room_id, data.get('cursor'), data.get('limit'), language
+        )
+        await self.send_payload({
+            'type': 'history',
+            **page
+        })
+
+    async def send_payload(self, payload, priority=PRIORITY_CONTROL, key=None):
+        """Queue a payload for this client in its negotiated protocol"""
+        self.outbound.put(encode_payload(payload, self.protocol), priority, key)
+
+    async def forward(self, event, priority=PRIORITY_CONTROL, key=None):
+        """Queue a pre-encoded envelope (see chat.events) without re-serializing it"""
+        frame = binary_frame(event) if self.protocol == PROTOCOL_MSGPACK else event['text']
+        self.outbound.put(frame, priority, key)
 
     # WebSocket message handlers
+    # Presence and speaking events are idempotent: only the latest per participant matters
     async def participant_joined(self, event):
-        await self.send(text_data=json.dumps(event))
+        await self.forward(event, PRIORITY_STATUS, key=('presence', event.get('participant_id')))
 
     async def participant_left(self, event):
-        await self.send(text_data=json.dumps(event))
+        await self.forward(event, PRIORITY_STATUS, key=('presence', event.get('participant_id')))
 
     async def speaking_status(self, event):
-        await self.send(text_data=json.dumps(event))
+        await self.forward(event, PRIORITY_STATUS, key=('speaking', event.get('participant_id')))
 
     async def voice_translation(self, event):
         # Only send to the target participant
         if (hasattr(self, 'participant') and self.participant and 
-            event.get('target_participant_id') == self.participant.participant_id):
-            await self.send(text_data=json.dumps(event))
+            event.get('target_participant_id') == str(self.participant.participant_id)):
+            # Past the utterance's deadline the translation is no longer worth showing
+            if event.get('expires_at') and time.time() > event['expires_at']:
+                metrics.increment('deadline_exceeded', stage='fanout')
+                return
+            await self.forward(event, PRIORITY_TRANSLATION)
 
     # Database operations
-    @database_sync_to_async
+    @database_write
     def get_or_create_room(self):
         room, created = ConferenceRoom.objects.get_or_create(
             room_id=self.room_id,
@@ -280,16 +562,32 @@ class ConferenceConsumer(AsyncWebsocketConsumer):
         )
         return room
 
-    @database_sync_to_async
-    def create_participant(self, room, name, language):
-        # Check if participant with same name exists in room
-        try:
-            participant = Participant.objects.get(name=name, room=room)
-            participant.is_online = True
-            participant.preferred_language = language
-            participant.save()
-            return participant
-        except Participant.DoesNotExist:
+    @database_write
+    def create_participant(self, room, name, language, reserved=0):
+        """Join `room` unless its online participants plus `reserved` places fill it.
+
+        The room row is locked for the count and the insert, so concurrent joins
+        cannot both take the last place. SQLite ignores the lock but lets only
+        one transaction write, and a join whose count is stale by then fails
+        with "database is locked" rather than overfilling the room.
+        """
+        with transaction.atomic():
+            room = ConferenceRoom.objects.select_for_update().get(pk=room.pk)
+            cutoff = online_cutoff()
+            # Check if participant with same name exists in room
+            participant = Participant.objects.filter(name=name, room=room).first()
+
+            # Reconnecting while still marked online does not take a new place
+            if participant is None or not participant.is_online or participant.last_activity < cutoff:
+                online = room.participants.filter(is_online=True, last_activity__gte=cutoff).count()
+                if online + reserved >= room.max_participants:
+                    raise RoomFull()
+
+            if participant is not None:
+                participant.is_online = True
+                participant.preferred_language = language
+                participant.save()
+                return participant
             return Participant.objects.create(
                 name=name,
                 room=room,
@@ -297,7 +595,7 @@ class ConferenceConsumer(AsyncWebsocketConsumer):
                 is_online=True
             )
 
-    @database_sync_to_async
+    @database_read
     def get_participants_list(self, room):
         participants = room.participants.filter(is_online=True)
         return [
@@ -310,13 +608,13 @@ class ConferenceConsumer(AsyncWebsocketConsumer):
             for p in participants
         ]
 
-    @database_sync_to_async
+    @database_read
     def get_room_participants(self):
         if not self.participant:
             return []
         return list(self.participant.room.participants.filter(is_online=True))
 
-    @database_sync_to_async
+    @database_write
     def save_voice_message(self, original_text, detected_language, audio_data):
         # Save audio file
         audio_file = ContentFile(audio_data, name=f'voice_{self.participant.participant_id}.wav')
@@ -329,13 +627,31 @@ class ConferenceConsumer(AsyncWebsocketConsumer):
             detected_language=detected_language
         )
 
-    @database_sync_to_async
+    @database_write
+    def save_translations(self, voice_message, deliveries):
+        TranslatedAudio.objects.bulk_create([
+            TranslatedAudio(
+                voice_message=voice_message,
+                target_participant=participant,
+                target_language=target_language,
+                translated_text=translated_text,
+                translation_status=translation_status
+            )
+            for participant, target_language, translated_text, translation_status in deliveries
+        ], ignore_conflicts=True)
+
+    @database_write
+    def set_preferred_language(self, language):
+        self.participant.preferred_language = language
+        self.participant.save()
+
+    @database_write
     def set_speaking_status(self, is_speaking):
         if self.participant:
             self.participant.is_speaking = is_speaking
             self.participant.save()
 
-    @database_sync_to_async
+    @database_write
     def set_participant_offline(self):
         if self.participant:
             self.participant.is_online = False
@@ -2,7 +2,9 @@ import json
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.contrib.auth.models import User
+from voice_backend.db_writer import database_write
 from .models import ChatRoom, Message, UserPresence
+from voice_translator.languages import languages
 from voice_translator.models import Language
 from voice_translator.services import TranslationService
 
@@ -165,7 +167,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
             }))
 
     async def handle_language_change(self, data):
-        language_code = data.get('language', 'en')
+        language_code = languages.require(data.get('language') or 'en')
         
         if self.user and self.user.is_authenticated:
             await self.update_user_language(language_code)
@@ -217,7 +219,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
             await self.send(text_data=json.dumps(event))
 
     # Database operations
-    @database_sync_to_async
+    @database_write
     def save_message(self, content, message_type, source_language):
         try:
             room = ChatRoom.objects.get(id=self.room_id)
@@ -237,7 +239,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
         except Exception:
             return None
 
-    @database_sync_to_async
+    @database_write
     def update_user_presence(self, is_online):
         try:
             room = ChatRoom.objects.get(id=self.room_id)
@@ -252,7 +254,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
         except Exception:
             pass
 
-    @database_sync_to_async
+    @database_write
     def update_user_language(self, language_code):
         try:
             language_obj = Language.objects.get(code=language_code)
@@ -0,0 +1,163 @@
+"""
+Pre-encoded events for conference fan-out, in both wire protocols.
+
+The sender serializes the client-facing payload to JSON once and ships the
+result inside a channel-layer envelope; every receiving consumer forwards it
+verbatim instead of re-serializing the event per socket. The msgpack frame
+is only built when a msgpack socket needs it, once per event per process. Routing fields (the handler
+``type``, ``target_participant_id``) live on the envelope only and never reach
+the client.
+
+Clients choose a protocol in ``join_conference``: ``json`` text frames (the
+default) or ``msgpack`` binary frames with the short field names below.
+"""
+import json
+from collections import OrderedDict
+
+import msgpack
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+
+PROTOCOL_JSON = 'json'
+PROTOCOL_MSGPACK = 'msgpack'
+
+# Field names and event types used on msgpack connections. The table is sent to
+# the client when msgpack is negotiated, so only this copy needs maintaining.
+SHORT_KEYS = {
+    'type': 't',
+    'participant': 'p',
+    'participants': 'ps',
+    'participant_id': 'pi',
+    'participant_name': 'pn',
+    'id': 'i',
+    'name': 'n',
+    'language': 'l',
+    'is_speaking': 'sp',
+    'speaker_name': 'sn',
+    'speaker_id': 'si',
+    'speaker_language': 'sl',
+    'original_text': 'ot',
+    'translated_text': 'tt',
+    'original_language': 'ol',
+    'target_language': 'tl',
+    'voice_message_id': 'vm',
+    'audio_data': 'a',
+    'room_name': 'rn',
+    'message': 'mg',
+    'error': 'e',
+    'messages': 'ms',
+    'cursor': 'c',
+    'next_cursor': 'nc',
+    'limit': 'lm',
+    'timestamp': 'ts',
+    'degraded': 'dg',
+    'untranslated': 'ut',
+    'partial': 'pa',
+    'utterance_id': 'ui',
+    'budget_ms': 'bm',
+    'position': 'qp',
+    'reason': 'rs',
+    'retry_after_ms': 'ra',
+    'max_participants': 'mp',
+}
+SHORT_TYPES = {
+    'participant_joined': 'pj',
+    'participant_left': 'pl',
+    'participants_list': 'pls',
+    'speaking_status': 'ss',
+    'voice_translation': 'vt',
+    'voice_message': 'vmsg',
+    'joined_successfully': 'js',
+    'error': 'err',
+    'ping': 'pi',
+    'pong': 'po',
+    'history_request': 'hr',
+    'history': 'h',
+    'history_translation': 'ht',
+    'change_language': 'cl',
+    'language_changed': 'lc',
+    'room_full': 'rf',
+    'join_queued': 'jq',
+    'overloaded': 'ov',
+}
+LONG_KEYS = {short: long for long, short in SHORT_KEYS.items()}
+LONG_TYPES = {short: long for long, short in SHORT_TYPES.items()}
+
+
+def compact(value):
+    """Rename fields and event types to their short forms, recursively"""
+    if isinstance(value, dict):
+        # A listener in the speaker's language gets the same text twice
+        if 'original_text' in value and value.get('original_text') == value.get('translated_text'):
+            value = {k: v for k, v in value.items() if k != 'original_text'}
+        return {
+            SHORT_KEYS.get(key, key): SHORT_TYPES.get(item, item) if key == 'type' else compact(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, list):
+        return [compact(item) for item in value]
+    return value
+
+
+def expand(value):
+    """Inverse of compact(); long names pass through unchanged"""
+    if isinstance(value, dict):
+        expanded = {}
+        for key, item in value.items():
+            key = LONG_KEYS.get(key, key)
+            expanded[key] = LONG_TYPES.get(item, item) if key == 'type' else expand(item)
+        return expanded
+    if isinstance(value, list):
+        return [expand(item) for item in value]
+    return value
+
+
+def encode_payload(payload, protocol=PROTOCOL_JSON):
+    """Serialize a client-facing payload: JSON text, or compact msgpack bytes.
+    Values neither format knows (e.g. UUID ids of unsaved-then-created rows) are sent as strings."""
+    if protocol == PROTOCOL_MSGPACK:
+        return msgpack.packb(compact(payload), use_bin_type=True, default=str)
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(payload, default=str).decode('utf-8')
+    return json.dumps(payload, separators=(',', ':'), default=str)
+
+
+def decode_message(data):
+    """Parse a binary (msgpack) client message into its long-form dict"""
+    return expand(msgpack.unpackb(data, raw=False))
+
+
+def envelope(handler, payload, **routing):
+    """Channel-layer message for `handler` carrying the payload pre-encoded as JSON"""
+    return {
+        'type': handler,
+        'text': encode_payload(payload),
+        **routing
+    }
+
+
+# Recent msgpack frames by JSON text; each consumer gets its own copy of a
+# group message, so the cache is what makes the encoding happen once
+BINARY_CACHE_SIZE = 256
+_binary_frames = OrderedDict()
+
+
+def binary_frame(event):
+    """The msgpack frame for an envelope, encoded from its JSON text on first use"""
+    frame = event.get('binary')
+    if frame is not None:
+        return frame
+    text = event['text']
+    frame = _binary_frames.get(text)
+    if frame is None:
+        payload = orjson.loads(text) if ORJSON_AVAILABLE else json.loads(text)
+        frame = _binary_frames[text] = encode_payload(payload, PROTOCOL_MSGPACK)
+        if len(_binary_frames) > BINARY_CACHE_SIZE:
+            _binary_frames.popitem(last=False)
+    event['binary'] = frame
+    return frame
@@ -0,0 +1,214 @@
+"""
+Room transcript history.
+
+Each finished utterance is recorded with every translation produced for it,
+so history pages are served from stored text and never trigger translation.
+The most recent utterances of each room are kept in an in-memory ring buffer
+on the worker that hosts the room (see chat.affinity). The buffer only holds
+what this worker saved since it started, in completion order, so a page is
+served from it only when the primary keys in the page's range in the
+database match it exactly; otherwise the page comes from the (room, timestamp) index.
+
+Pages are ordered newest first. A cursor names the last utterance of the
+previous page as ``<epoch microseconds>-<pk>``.
+"""
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db.models import Q
+
+from voice_translator.languages import languages
+
+from .models import VoiceMessage
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+MAX_PAGE_SIZE = 100
+
+
+class InvalidHistoryQuery(ValueError):
+    pass
+
+
+class InvalidCursor(InvalidHistoryQuery):
+    pass
+
+
+def make_cursor(timestamp, pk):
+    delta = timestamp - EPOCH
+    micros = (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+    return f'{micros}-{pk}'
+
+
+def parse_cursor(cursor):
+    """Return the (timestamp, pk) position named by a cursor"""
+    try:
+        micros, pk = cursor.split('-', 1)
+        return EPOCH + timedelta(microseconds=int(micros)), int(pk)
+    except (AttributeError, ValueError, OverflowError):
+        raise InvalidCursor(f'Invalid history cursor: {cursor!r}')
+
+
+def make_entry(voice_message, speaker_name, speaker_id, translations):
+    """History entry for a saved VoiceMessage; `translations` maps language -> text"""
+    return {
+        'pk': voice_message.pk,
+        'timestamp': voice_message.timestamp,
+        'message_id': voice_message.message_id,
+        'speaker_id': speaker_id,
+        'speaker_name': speaker_name,
+        'original_text': voice_message.original_text,
+        # Older rows may hold Whisper's language names
+        'original_language': languages.normalize(voice_message.detected_language),
+        'translations': dict(translations),
+    }
+
+
+def render_entry(entry, language=None):
+    """Client-facing form of an entry, translated into `language` when a translation exists"""
+    if language is None or language == entry['original_language']:
+        translated_text = entry['original_text']
+    else:
+        translated_text = entry['translations'].get(language)
+    return {
+        'voice_message_id': entry['message_id'],
+        'speaker_id': entry['speaker_id'],
+        'speaker_name': entry['speaker_name'],
+        'original_text': entry['original_text'],
+        'original_language': entry['original_language'],
+        'translated_text': translated_text,
+        'target_language': language,
+        'timestamp': entry['timestamp'].isoformat(),
+        'cursor': make_cursor(entry['timestamp'], entry['pk']),
+    }
+
+
+class RoomHistory:
+    """Per-room ring buffers of recent utterances, least recently used rooms evicted first"""
+
+    def __init__(self, size=200, max_rooms=256):
+        self.size = size
+        self.max_rooms = max_rooms
+        self._lock = threading.Lock()
+        self._rooms = OrderedDict()
+
+    def record(self, room_id, entry):
+        with self._lock:
+            buffer = self._rooms.get(room_id)
+            if buffer is None:
+                buffer = self._rooms[room_id] = deque(maxlen=self.size)
+                while len(self._rooms) > self.max_rooms:
+                    self._rooms.popitem(last=False)
+            self._rooms.move_to_end(room_id)
+            buffer.append(entry)
+
+    def recent(self, room_id, before=None, limit=50):
+        """Buffered entries older than the `before` position, newest first"""
+        with self._lock:
+            buffer = self._rooms.get(room_id)
+            if not buffer:
+                return []
+            entries = list(buffer)
+
+        # Entries are appended as translations finish, not in timestamp order
+        entries.sort(key=position, reverse=True)
+        if before is not None:
+            entries = [entry for entry in entries if position(entry) < before]
+        return entries[:limit]
+
+    def add_translation(self, room_id, message_id, language, text):
+        """Attach a translation produced after the fact to a buffered entry"""
+        with self._lock:
+            for entry in self._rooms.get(room_id, ()):
+                if entry['message_id'] == message_id:
+                    entry['translations'][language] = text
+                    return
+
+    def clear(self, room_id=None):
+        with self._lock:
+            if room_id is None:
+                self._rooms.clear()
+            else:
+                self._rooms.pop(room_id, None)
+
+
+room_history = RoomHistory(
+    size=getattr(settings, 'ROOM_HISTORY_BUFFER_SIZE', 200),
+    max_rooms=getattr(settings, 'ROOM_HISTORY_MAX_ROOMS', 256)
+)
+
+
+def position(entry):
+    return entry['timestamp'], entry['pk']
+
+
+def in_range(messages, before=None, oldest=None):
+    """Messages at or after the `oldest` position and strictly before `before`"""
+    if before is not None:
+        timestamp, pk = before
+        messages = messages.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, pk__lt=pk))
+    if oldest is not None:
+        timestamp, pk = oldest
+        messages = messages.filter(Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, pk__gte=pk))
+    return messages
+
+
+def query_history(room_id, before=None, limit=50):
+    """Entries from the database older than the `before` position, newest first"""
+    messages = in_range(
+        VoiceMessage.objects
+        .filter(room__room_id=room_id)
+        .select_related('speaker')
+        .prefetch_related('translations')
+        .order_by('-timestamp', '-pk'),
+        before
+    )
+
+    entries = []
+    for message in messages[:limit]:
+        translations = {
+            languages.normalize(t.target_language): t.translated_text
+            for t in message.translations.all()
+            if t.translation_status == 'completed'
+        }
+        entries.append(make_entry(message, message.speaker.name, message.speaker.participant_id, translations))
+    return entries
+
+
+def recent_entries(room_id, before=None, limit=50):
+    """Entries older than `before`, newest first: from the ring buffer when it provably
+    holds every utterance in the page's range, else from the database"""
+    entries = room_history.recent(room_id, before, limit)
+    if len(entries) == limit:
+        # Rows saved by another worker, before a restart, or by a pipeline that
+        # failed after saving are missing from the buffer; deleted rows linger in it
+        stored = in_range(VoiceMessage.objects.filter(room__room_id=room_id), before, position(entries[-1]))
+        if set(stored.values_list('pk', flat=True)) == {entry['pk'] for entry in entries}:
+            return entries
+    return query_history(room_id, before, limit)
+
+
+def parse_limit(limit):
+    page_size = getattr(settings, 'ROOM_HISTORY_PAGE_SIZE', 50)
+    if limit in (None, ''):
+        return page_size
+    try:
+        return max(1, min(int(limit), MAX_PAGE_SIZE))
+    except (TypeError, ValueError):
+        raise InvalidHistoryQuery(f'Invalid history limit: {limit!r}')
+
+
+def get_history_page(room_id, cursor=None, limit=None, language=None):
+    """One page of a room's transcript, in `language` (any spelling the registry knows)"""
+    limit = parse_limit(limit)
+    before = parse_cursor(cursor) if cursor else None
+    # Entries are keyed by ISO code; no language or 'unknown' gives the original text
+    language = languages.normalize(language)
+
+    entries = recent_entries(room_id, before, limit)
+    messages = [render_entry(entry, language) for entry in entries]
+    return {
+        'messages': messages,
+        'next_cursor': messages[-1]['cursor'] if len(messages) == limit else None,
+    }
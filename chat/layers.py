@@ -0,0 +1,497 @@
+"""
+Channel layer for running several Daphne processes on one host.
+
+A small broker process (``manage.py run_channel_broker``) listens on a
+Unix-domain socket and owns group membership and the queues of shared
+(non process-specific) channels. Each worker process keeps one connection to
+it. Messages for a process-specific channel (``specific.<client>!<id>``) are
+pushed straight to the owning process and queued there, so a consumer's
+receive() never waits on a broker round trip. A group_send is fanned out by
+the broker as one frame per owning process, not one per member channel.
+
+Frames are a 4-byte big-endian length followed by a msgpack map. Message
+bodies are packed once by the sender and forwarded by the broker as opaque
+bytes. A malformed frame is answered with an error and dropped; the
+connection stays up.
+
+Capacity of a process-specific channel is enforced by the owning process,
+which drops what does not fit, as for group_send. The sender only gets
+ChannelFull when the broker cannot buffer more for that process; a send to
+a process that has gone away is dropped silently.
+"""
+import asyncio
+import os
+import random
+import string
+import struct
+import time
+import uuid
+from collections import defaultdict, deque
+
+import msgpack
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+DEFAULT_SOCKET_PATH = '/tmp/voice_backend_channels.sock'
+
+FRAME_HEADER = struct.Struct('>I')
+# A process that stops reading its socket must not make the broker buffer forever
+MAX_CLIENT_BUFFER = 16 * 1024 * 1024
+
+# Fields each broker operation needs, and their types
+OPERATIONS = {
+    'hello': {'owner': str},
+    'send': {'channel': str, 'payload': bytes},
+    'receive': {'channel': str},
+    'group_add': {'group': str, 'channel': str},
+    'group_discard': {'group': str, 'channel': str},
+    'group_send': {'group': str, 'payload': bytes},
+    'flush': {},
+    'stats': {},
+}
+
+
+class BadFrame(ValueError):
+    pass
+
+
+def check_frame(frame):
+    """Raise BadFrame unless `frame` is a broker request with the fields its op needs"""
+    if not isinstance(frame, dict):
+        raise BadFrame('frame is not a map')
+    fields = OPERATIONS.get(frame.get('op'))
+    if fields is None:
+        raise BadFrame(f"unknown op {frame.get('op')!r}")
+    for name, kind in fields.items():
+        if not isinstance(frame.get(name), kind):
+            raise BadFrame(f"{frame['op']} needs {kind.__name__} {name}")
+
+
+def pack(data):
+    return msgpack.packb(data, use_bin_type=True)
+
+
+def unpack(data):
+    return msgpack.unpackb(data, raw=False)
+
+
+def encode_frame(data):
+    body = pack(data)
+    return FRAME_HEADER.pack(len(body)) + body
+
+
+async def read_frame(reader):
+    header = await reader.readexactly(FRAME_HEADER.size)
+    (length,) = FRAME_HEADER.unpack(header)
+    return unpack(await reader.readexactly(length))
+
+
+def check_push(frame):
+    """Raise BadFrame unless `frame` is a delivery or a response from the broker"""
+    if not isinstance(frame, dict):
+        raise BadFrame('frame is not a map')
+    if 'deliver' in frame:
+        channels = frame['deliver']
+        if not isinstance(channels, list) or not all(isinstance(c, str) for c in channels):
+            raise BadFrame('deliver needs a list of channels')
+        if not isinstance(frame.get('payload'), bytes):
+            raise BadFrame('deliver needs bytes payload')
+    elif not isinstance(frame.get('id'), int) or 'error' not in frame or 'result' not in frame:
+        raise BadFrame('response needs id, result and error')
+
+
+def owner_of(channel):
+    """The process-specific prefix of a channel name (up to and including '!'), or None"""
+    index = channel.find('!')
+    return channel[:index + 1] if index >= 0 else None
+
+
+class BrokerConnection:
+    def __init__(self, writer):
+        self.writer = writer
+        self.owner = None
+        self.dropped = 0
+
+    def write(self, data):
+        transport = self.writer.transport
+        if transport.is_closing():
+            return False
+        if transport.get_write_buffer_size() > MAX_CLIENT_BUFFER:
+            self.dropped += 1
+            return False
+        self.writer.write(encode_frame(data))
+        return True
+
+
+class ChannelBroker:
+    """Unix-socket broker holding groups and shared channel queues for one host"""
+
+    def __init__(self, path=DEFAULT_SOCKET_PATH, expiry=60, group_expiry=86400,
+                 capacity=100, channel_capacity=None):
+        self.path = path
+        self.expiry = expiry
+        self.group_expiry = group_expiry
+        # Reuse the layer's glob-pattern capacity handling
+        self._capacities = BaseChannelLayer(capacity=capacity)
+        self._capacities.channel_capacity = self._capacities.compile_capacities(channel_capacity or {})
+        self.owners = {}
+        self.queues = defaultdict(deque)
+        self.waiters = defaultdict(deque)
+        self.groups = defaultdict(dict)
+        self.stats = {'frames': 0, 'delivered': 0, 'full': 0, 'expired': 0, 'bad_frames': 0}
+
+    async def serve(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        server = await asyncio.start_unix_server(self._handle_client, path=self.path)
+        os.chmod(self.path, 0o600)
+        async with server:
+            await server.serve_forever()
+
+    async def _handle_client(self, reader, writer):
+        connection = BrokerConnection(writer)
+        try:
+            while True:
+                frame = None
+                try:
+                    frame = await read_frame(reader)
+                    self.stats['frames'] += 1
+                    check_frame(frame)
+                except ValueError as e:
+                    # The length prefix keeps the stream in step, so only this frame is lost
+                    self.stats['bad_frames'] += 1
+                    print(f"[ERROR] Channel broker dropped a bad frame from {connection.owner}: {e}")
+                    request_id = frame.get('id') if isinstance(frame, dict) else None
+                    self._reply(connection, request_id, error=f'bad frame: {e}')
+                    continue
+                self._dispatch(connection, frame)
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            self._forget(connection)
+            writer.close()
+
+    def _forget(self, connection):
+        if connection.owner and self.owners.get(connection.owner) is connection:
+            del self.owners[connection.owner]
+            for members in self.groups.values():
+                for channel in [c for c in members if c.startswith(connection.owner)]:
+                    del members[channel]
+        for waiting in self.waiters.values():
+            for waiter in [w for w in waiting if w[0] is connection]:
+                waiting.remove(waiter)
+
+    def _reply(self, connection, request_id, result=None, error=None):
+        if request_id is not None:
+            connection.write({'id': request_id, 'result': result, 'error': error})
+
+    def _dispatch(self, connection, frame):
+        op = frame['op']
+        request_id = frame.get('id')
+
+        if op == 'hello':
+            connection.owner = frame['owner']
+            self.owners[connection.owner] = connection
+            self._reply(connection, request_id)
+        elif op == 'send':
+            if self._deliver(frame['channel'], frame['payload']):
+                self._reply(connection, request_id)
+            else:
+                self._reply(connection, request_id, error='full')
+        elif op == 'receive':
+            self._receive(connection, request_id, frame['channel'])
+        elif op == 'group_add':
+            self.groups[frame['group']][frame['channel']] = time.time() + self.group_expiry
+            self._reply(connection, request_id)
+        elif op == 'group_discard':
+            members = self.groups.get(frame['group'])
+            if members is not None:
+                members.pop(frame['channel'], None)
+                if not members:
+                    del self.groups[frame['group']]
+            self._reply(connection, request_id)
+        elif op == 'group_send':
+            self._group_send(frame['group'], frame['payload'])
+            self._reply(connection, request_id)
+        elif op == 'flush':
+            self.queues.clear()
+            self.groups.clear()
+            self._reply(connection, request_id)
+        elif op == 'stats':
+            self._reply(connection, request_id, result={
+                **self.stats,
+                'processes': len(self.owners),
+                'groups': len(self.groups),
+                'queued': sum(len(q) for q in self.queues.values()),
+            })
+
+    def _push(self, owner, channels, payload):
+        """Forward to the owning process; False only if that process is not keeping up"""
+        connection = self.owners.get(owner)
+        if connection is None:
+            # A process that went away takes its channels with it
+            return True
+        if not connection.write({'deliver': channels, 'payload': payload}):
+            self.stats['full'] += 1
+            return False
+        self.stats['delivered'] += len(channels)
+        return True
+
+    def _deliver(self, channel, payload):
+        owner = owner_of(channel)
+        if owner is not None:
+            return self._push(owner, [channel], payload)
+
+        waiting = self.waiters.get(channel)
+        while waiting:
+            connection, request_id = waiting.popleft()
+            if connection.write({'id': request_id, 'result': payload, 'error': None}):
+                self.stats['delivered'] += 1
+                return True
+
+        queue = self.queues[channel]
+        if len(queue) >= self._capacities.get_capacity(channel):
+            self.stats['full'] += 1
+            return False
+        queue.append((time.time() + self.expiry, payload))
+        return True
+
+    def _receive(self, connection, request_id, channel):
+        queue = self.queues.get(channel)
+        now = time.time()
+        while queue:
+            expires_at, payload = queue.popleft()
+            if expires_at >= now:
+                self._reply(connection, request_id, result=payload)
+                self.stats['delivered'] += 1
+                return
+            self.stats['expired'] += 1
+        self.waiters[channel].append((connection, request_id))
+
+    def _group_send(self, group, payload):
+        members = self.groups.get(group)
+        if not members:
+            return
+
+        now = time.time()
+        by_owner = defaultdict(list)
+        for channel, expires_at in list(members.items()):
+            if expires_at < now:
+                del members[channel]
+                continue
+            owner = owner_of(channel)
+            if owner is None:
+                self._deliver(channel, payload)
+            else:
+                by_owner[owner].append(channel)
+
+        for owner, channels in by_owner.items():
+            self._push(owner, channels, payload)
+
+
+class UnixSocketChannelLayer(BaseChannelLayer):
+    """Channel layer client talking to a ChannelBroker over a Unix-domain socket"""
+
+    extensions = ['groups', 'flush']
+
+    def __init__(self, path=DEFAULT_SOCKET_PATH, expiry=60, group_expiry=86400,
+                 capacity=100, channel_capacity=None, **kwargs):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity, **kwargs)
+        self.channel_capacity = self.compile_capacities(channel_capacity or {})
+        self.path = path
+        self.group_expiry = group_expiry
+        self.client_prefix = ''.join(random.choices(string.ascii_letters, k=8))
+        self.owner = f'specific.{self.client_prefix}!'
+        self.dropped = 0
+        # Local queues for this process's channels, fed by broker pushes
+        self._queues = {}
+        self._next_sweep = 0
+        self._waiters = {}
+        # Memberships of local channels, replayed if the broker connection is re-established
+        self._groups = defaultdict(set)
+        self._reader = None
+        self._writer = None
+        self._reader_task = None
+        self._loop = None
+        self._connect_lock = None
+        self._responses = {}
+        self._next_id = 0
+
+    # Connection management
+
+    async def _ensure_connected(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Streams are bound to their loop; start over on a new one
+            self._loop = loop
+            self._connect_lock = asyncio.Lock()
+            self._writer = None
+        if self._writer is not None and not self._writer.is_closing():
+            return
+
+        async with self._connect_lock:
+            if self._writer is not None and not self._writer.is_closing():
+                return
+            self._reader, self._writer = await asyncio.open_unix_connection(self.path)
+            self._reader_task = asyncio.ensure_future(self._read_loop(self._reader))
+            await self._request({'op': 'hello', 'owner': self.owner}, connect=False)
+            for group, channels in self._groups.items():
+                for channel in channels:
+                    await self._request({'op': 'group_add', 'group': group, 'channel': channel}, connect=False)
+
+    async def _read_loop(self, reader):
+        try:
+            while True:
+                try:
+                    frame = await read_frame(reader)
+                    check_push(frame)
+                except ValueError as e:
+                    print(f"[ERROR] Dropped a bad frame from the channel broker: {e}")
+                    continue
+                if 'deliver' in frame:
+                    self._deliver_local(frame['deliver'], frame['payload'])
+                else:
+                    future = self._responses.pop(frame['id'], None)
+                    if future is not None and not future.done():
+                        future.set_result(frame)
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            error = ConnectionError('Lost connection to channel broker')
+            for future in self._responses.values():
+                if not future.done():
+                    future.set_exception(error)
+            self._responses.clear()
+            if self._writer is not None:
+                self._writer.close()
+
+    async def _request(self, frame, connect=True):
+        if connect:
+            await self._ensure_connected()
+        self._next_id += 1
+        frame['id'] = self._next_id
+        future = asyncio.get_running_loop().create_future()
+        self._responses[self._next_id] = future
+        self._writer.write(encode_frame(frame))
+        try:
+            response = await future
+        finally:
+            self._responses.pop(frame['id'], None)
+        if response['error'] == 'full':
+            raise ChannelFull(frame.get('channel'))
+        if response['error']:
+            raise ConnectionError(response['error'])
+        return response['result']
+
+    def _queue_for(self, channel):
+        queue = self._queues.get(channel)
+        if queue is None:
+            queue = self._queues[channel] = deque()
+        return queue
+
+    def _sweep(self, now):
+        """Drop expired messages, and the queues of channels nobody is receiving from"""
+        for channel, queue in list(self._queues.items()):
+            while queue and queue[0][0] < now:
+                queue.popleft()
+            if not queue and channel not in self._waiters:
+                del self._queues[channel]
+
+    def _deliver_local(self, channels, payload):
+        now = time.time()
+        if now >= self._next_sweep:
+            # A consumer that has gone leaves a queue behind if anything was still sent to it
+            self._next_sweep = now + self.expiry
+            self._sweep(now)
+        expires_at = now + self.expiry
+        for channel in channels:
+            queue = self._queue_for(channel)
+            if len(queue) >= self.get_capacity(channel):
+                # Same as a full channel in group_send: the message is dropped
+                self.dropped += 1
+                continue
+            queue.append((expires_at, payload))
+            waiter = self._waiters.pop(channel, None)
+            if waiter is not None and not waiter.done():
+                waiter.set_result(None)
+
+    # Channel layer API
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        self.require_valid_channel_name(channel)
+        assert '__asgi_channel__' not in message
+
+        payload = pack(message)
+        if channel.startswith(self.owner):
+            queue = self._queue_for(channel)
+            if len(queue) >= self.get_capacity(channel):
+                raise ChannelFull(channel)
+            self._deliver_local([channel], payload)
+            return
+        await self._request({'op': 'send', 'channel': channel, 'payload': payload})
+
+    async def receive(self, channel):
+        self.require_valid_channel_name(channel)
+
+        if not channel.startswith(self.owner):
+            return unpack(await self._request({'op': 'receive', 'channel': channel}))
+
+        await self._ensure_connected()
+        queue = self._queue_for(channel)
+        while True:
+            now = time.time()
+            while queue:
+                expires_at, payload = queue.popleft()
+                if expires_at >= now:
+                    if not queue:
+                        del self._queues[channel]
+                    return unpack(payload)
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters[channel] = waiter
+            try:
+                await waiter
+            finally:
+                if self._waiters.get(channel) is waiter:
+                    del self._waiters[channel]
+            queue = self._queue_for(channel)
+
+    async def new_channel(self, prefix='specific'):
+        return f'{prefix}.{self.client_prefix}!{uuid.uuid4().hex}'
+
+    async def flush(self):
+        self._queues.clear()
+        self._groups.clear()
+        await self._request({'op': 'flush'})
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    # Groups extension
+
+    async def group_add(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        if channel.startswith(self.owner):
+            self._groups[group].add(channel)
+        await self._request({'op': 'group_add', 'group': group, 'channel': channel})
+
+    async def group_discard(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        members = self._groups.get(group)
+        if members is not None:
+            members.discard(channel)
+            if not members:
+                del self._groups[group]
+        await self._request({'op': 'group_discard', 'group': group, 'channel': channel})
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        self.require_valid_group_name(group)
+        await self._request({'op': 'group_send', 'group': group, 'payload': pack(message)})
+
+    async def broker_stats(self):
+        return await self._request({'op': 'stats'})
@@ -0,0 +1,70 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from chat.retention import apply_retention
+
+
+class Command(BaseCommand):
+    help = 'Delete expired voice messages, idle participants, empty rooms and orphaned media, then compact the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help='Rows per delete transaction (default RETENTION_BATCH_SIZE)')
+        parser.add_argument('--pause', type=float, default=0.0, help='Seconds to sleep between batches')
+        parser.add_argument('--dry-run', action='store_true', help='Only count what would be deleted')
+        parser.add_argument('--skip-orphans', action='store_true', help='Do not scan MEDIA_ROOT for orphaned files')
+        parser.add_argument('--skip-vacuum', action='store_true')
+        parser.add_argument('--full-vacuum', action='store_true',
+                            help='Rewrite the whole database (needed once to enable incremental vacuum)')
+        parser.add_argument('--interval', type=float,
+                            help='Keep running, applying retention every INTERVAL seconds')
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.monotonic()
+            report = apply_retention(
+                batch_size=options['batch_size'],
+                pause=options['pause'],
+                dry_run=options['dry_run'],
+                orphans=not options['skip_orphans'],
+                vacuum=not options['skip_vacuum'],
+                full_vacuum=options['full_vacuum']
+            )
+            self.write_report(report, options['dry_run'], time.monotonic() - started)
+
+            if not options['interval']:
+                return
+            # Only the first run may need the full rewrite
+            options['full_vacuum'] = False
+            try:
+                time.sleep(options['interval'])
+            except KeyboardInterrupt:
+                return
+
+    def write_report(self, report, dry_run, elapsed):
+        verb = 'would delete' if dry_run else 'deleted'
+        for name, rows in report['deleted'].items():
+            self.stdout.write(f"{name:<16} {verb} {rows}")
+        if 'orphans' in report:
+            self.stdout.write(f"{'orphaned media':<16} {verb} {report['orphans']}")
+        self.stdout.write(f"{'media':<16} {report['files']} files, {format_bytes(report['media_bytes'])}")
+        if 'compaction' in report:
+            self.stdout.write(f"{'database':<16} {report['compaction']}")
+
+        before, after = report['size_before'], report['size_after']
+        if before is not None:
+            self.stdout.write(
+                f"{'database size':<16} {format_bytes(before)} -> {format_bytes(after)} "
+                f"({format_bytes(before - after)} reclaimed)"
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f"Reclaimed {format_bytes(report['media_bytes'] + max(0, (before or 0) - (after or 0)))} "
+            f"in {elapsed:.1f}s"
+        ))
+
+
+def format_bytes(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(size) < 1024 or unit == 'GB':
+            return f'{size:.0f} {unit}' if unit == 'B' else f'{size:.1f} {unit}'
+        size /= 1024
@@ -0,0 +1,119 @@
+import asyncio
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from channels.layers import InMemoryChannelLayer
+
+from chat.layers import ChannelBroker, UnixSocketChannelLayer
+
+
+class Command(BaseCommand):
+    help = 'Compare send/receive latency and group fan-out throughput of the channel layer backends'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=2000)
+        parser.add_argument('--group-size', type=int, default=20)
+        parser.add_argument('--socket', help='Use an already running broker instead of starting one')
+        parser.add_argument('--redis', help='Also benchmark channels_redis at this URL, e.g. redis://localhost:6379')
+
+    def handle(self, *args, **options):
+        # InMemory cannot span processes, so it both sends and receives on one
+        # instance; the other backends send from a second client, as another
+        # worker process would
+        memory = InMemoryChannelLayer(capacity=options['messages'] * 2)
+        layers = [('InMemory', lambda: memory)]
+
+        socket_path = options['socket']
+        if not socket_path:
+            socket_path = os.path.join(tempfile.mkdtemp(), 'bench.sock')
+            self.start_broker(socket_path, options['messages'] * 2)
+        layers.append(('UnixSocket', lambda: UnixSocketChannelLayer(
+            path=socket_path, capacity=options['messages'] * 2
+        )))
+
+        if options['redis']:
+            try:
+                from channels_redis.core import RedisChannelLayer
+            except ImportError:
+                self.stdout.write(self.style.WARNING('channels_redis not installed, skipping Redis'))
+            else:
+                layers.append(('Redis', lambda: RedisChannelLayer(
+                    hosts=[options['redis']], capacity=options['messages'] * 2
+                )))
+
+        self.stdout.write(f"{'backend':<12} {'p50 rtt ms':>11} {'p99 rtt ms':>11} {'send/s':>10} {'fan-out msg/s':>14}")
+        for name, factory in layers:
+            result = asyncio.run(self.run_backend(factory(), factory(), options['messages'], options['group_size']))
+            self.stdout.write(
+                f"{name:<12} {result['p50']:>11.3f} {result['p99']:>11.3f} "
+                f"{result['send_rate']:>10.0f} {result['fanout_rate']:>14.0f}"
+            )
+
+    def start_broker(self, path, capacity):
+        ready = threading.Event()
+
+        def run():
+            loop = asyncio.new_event_loop()
+            broker = ChannelBroker(path=path, capacity=capacity)
+            loop.create_task(broker.serve())
+            loop.call_soon(ready.set)
+            loop.run_forever()
+
+        threading.Thread(target=run, daemon=True).start()
+        ready.wait()
+        while not os.path.exists(path):
+            time.sleep(0.01)
+
+    async def run_backend(self, sender, receiver, messages, group_size):
+        channel = await receiver.new_channel()
+        # Connect both clients before timing anything
+        await receiver.group_add('bench-warmup', channel)
+        await sender.group_send('bench-warmup', {'type': 'bench.message'})
+        await receiver.receive(channel)
+        await receiver.group_discard('bench-warmup', channel)
+
+        # Round trip: send to another client's channel and receive it there
+        latencies = []
+        for i in range(messages):
+            started = time.perf_counter()
+            await sender.send(channel, {'type': 'bench.message', 'n': i})
+            await receiver.receive(channel)
+            latencies.append((time.perf_counter() - started) * 1000.0)
+
+        # Pipelined sends, then drain
+        started = time.perf_counter()
+        for i in range(messages):
+            await sender.send(channel, {'type': 'bench.message', 'n': i})
+        send_rate = messages / (time.perf_counter() - started)
+        for _ in range(messages):
+            await receiver.receive(channel)
+
+        # Group fan-out to group_size member channels
+        members = [await receiver.new_channel() for _ in range(group_size)]
+        for member in members:
+            await receiver.group_add('bench', member)
+        rounds = max(1, messages // group_size)
+        started = time.perf_counter()
+        for i in range(rounds):
+            await sender.group_send('bench', {'type': 'bench.message', 'n': i, 'text': 'x' * 200})
+            for member in members:
+                await receiver.receive(member)
+        fanout_rate = rounds * group_size / (time.perf_counter() - started)
+
+        for member in members:
+            await receiver.group_discard('bench', member)
+        for layer in {id(sender): sender, id(receiver): receiver}.values():
+            if hasattr(layer, 'close'):
+                await layer.close()
+
+        latencies.sort()
+        return {
+            'p50': statistics.median(latencies),
+            'p99': latencies[int(len(latencies) * 0.99) - 1],
+            'send_rate': send_rate,
+            'fanout_rate': fanout_rate,
+        }
@@ -0,0 +1,143 @@
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+from channels.db import database_sync_to_async
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from chat.models import ConferenceRoom, Participant, VoiceMessage
+from voice_backend.db_writer import DatabaseWriter
+
+STOCK_OPTIONS = {}
+WAL_OPTIONS = {
+    'init_command': (
+        'PRAGMA journal_mode=WAL;PRAGMA synchronous=NORMAL;PRAGMA temp_store=MEMORY;'
+        'PRAGMA cache_size=-20000;PRAGMA mmap_size=134217728'
+    ),
+    'transaction_mode': 'IMMEDIATE',
+    'timeout': 20,
+}
+
+
+class Command(BaseCommand):
+    help = 'Compare consumer write throughput on stock SQLite with WAL plus the single writer thread'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--consumers', default='1,10,50')
+        parser.add_argument('--writes', type=int, default=40, help='writes per simulated consumer')
+
+    def handle(self, *args, **options):
+        # (name, connection options, how writes run, how reads run)
+        setups = [
+            ('stock, sync_to_async', STOCK_OPTIONS, 'thread_sensitive', 'thread_sensitive'),
+            ('stock, thread pool', STOCK_OPTIONS, 'pool', 'pool'),
+            ('wal, sync_to_async', WAL_OPTIONS, 'thread_sensitive', 'thread_sensitive'),
+            ('wal, single writer', WAL_OPTIONS, 'writer', 'pool'),
+        ]
+        database = connections.settings['default']
+        original = dict(database)
+
+        self.stdout.write(
+            f"{'setup':<22} {'consumers':>9} {'writes/s':>9} {'p50 ms':>8} {'p99 ms':>8} "
+            f"{'reads/s':>8} {'errors':>7} {'batch':>6}"
+        )
+        try:
+            with tempfile.TemporaryDirectory() as directory:
+                for index, (name, db_options, write_mode, read_mode) in enumerate(setups):
+                    for consumers in [int(count) for count in options['consumers'].split(',')]:
+                        # A fresh database file per run, created under the setup's own pragmas
+                        connections.close_all()
+                        database.update(NAME=os.path.join(directory, f'bench-{index}-{consumers}.sqlite3'),
+                                        OPTIONS=dict(db_options), CONN_MAX_AGE=600)
+                        call_command('migrate', verbosity=0)
+                        connections.close_all()
+
+                        result = asyncio.run(self.run(consumers, options['writes'], write_mode, read_mode))
+                        self.stdout.write(
+                            f"{name:<22} {consumers:>9} {result['writes_per_s']:>9.0f} "
+                            f"{result['p50_ms']:>8.2f} {result['p99_ms']:>8.2f} "
+                            f"{result['reads_per_s']:>8.0f} {result['errors']:>7} {result['batch']:>6.1f}"
+                        )
+        finally:
+            connections.close_all()
+            database.clear()
+            database.update(original)
+
+    async def run(self, consumers, writes, write_mode, read_mode):
+        room = await database_sync_to_async(ConferenceRoom.objects.create)(room_id='bench', room_name='Benchmark')
+        participants = [
+            await database_sync_to_async(Participant.objects.create)(name=f'Participant {i}', room=room)
+            for i in range(consumers)
+        ]
+
+        # A writer per run, so its connection opens the run's database file
+        writer = DatabaseWriter()
+        write = self.runner(write_mode, writer)
+        read = self.runner(read_mode, writer)
+        latencies = []
+        counts = {'reads': 0, 'errors': 0}
+
+        async def consumer(participant):
+            # What a talking participant costs: speaking on, the utterance row,
+            # speaking off, and the room's participant list for every join
+            for i in range(writes):
+                step = i % 4
+                started = time.perf_counter()
+                try:
+                    if step == 3:
+                        await read(online_participants, room)
+                        counts['reads'] += 1
+                        continue
+                    if step == 1:
+                        await write(save_message, room, participant, i)
+                    else:
+                        await write(set_speaking, participant, step == 0)
+                    latencies.append((time.perf_counter() - started) * 1000.0)
+                except Exception:
+                    counts['errors'] += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(consumer(participant) for participant in participants))
+        elapsed = time.perf_counter() - started
+        await database_sync_to_async(connections.close_all)()
+
+        latencies.sort()
+        return {
+            'writes_per_s': len(latencies) / elapsed,
+            'p50_ms': statistics.median(latencies) if latencies else 0.0,
+            'p99_ms': latencies[int(len(latencies) * 0.99)] if latencies else 0.0,
+            'reads_per_s': counts['reads'] / elapsed,
+            'errors': counts['errors'],
+            # Mean writes committed per transaction
+            'batch': writer.stats['writes'] / writer.stats['batches'] if writer.stats['batches'] else 1.0,
+        }
+
+    @staticmethod
+    def runner(mode, writer):
+        if mode == 'writer':
+            return lambda func, *args: writer.submit(func, *args)
+        thread_sensitive = mode == 'thread_sensitive'
+        return lambda func, *args: database_sync_to_async(func, thread_sensitive=thread_sensitive)(*args)
+
+
+def set_speaking(participant, is_speaking):
+    participant.is_speaking = is_speaking
+    participant.save()
+
+
+def save_message(room, participant, index):
+    return VoiceMessage.objects.create(
+        room=room,
+        speaker=participant,
+        original_audio_file='voice_messages/benchmark.wav',
+        original_text=f'Utterance {index} from {participant.name}',
+        detected_language='en'
+    )
+
+
+def online_participants(room):
+    return list(room.participants.filter(is_online=True))
@@ -0,0 +1,84 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+
+from chat import events
+
+
+class Command(BaseCommand):
+    help = 'Compare per-recipient event serialization with the pre-encoded envelope'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--room-sizes', default='2,5,10,20,50')
+        parser.add_argument('--rounds', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        participants = [
+            {'id': f'participant-{i:04d}', 'name': f'Participant {i}', 'language': 'es', 'is_speaking': False}
+            for i in range(50)
+        ]
+        sample_events = {
+            'voice_translation': {
+                'type': 'voice_translation',
+                'speaker_name': 'Participant 1',
+                'speaker_id': 'participant-0001',
+                'original_text': 'Thanks everyone for joining, let us go through the quarterly numbers first. ' * 3,
+                'translated_text': 'Gracias a todos por unirse, repasemos primero las cifras trimestrales. ' * 3,
+                'original_language': 'en',
+                'target_language': 'es',
+                'voice_message_id': '6f1c2f7e-2b7a-4f3e-9a51-3c1f0f5d9a10',
+            },
+            'participant_joined': {
+                'type': 'participant_joined',
+                'participant': {'id': 'participant-0003', 'name': 'Participant 3', 'language': 'fr'},
+            },
+            # Not fanned out today, but shows how the saving scales with payload size
+            'participants_list': {'type': 'participants_list', 'participants': participants},
+        }
+
+        self.stdout.write(
+            f"{'event':<20} {'room':>5} {'per-socket json us':>19} {'once json us':>13} "
+            f"{'once orjson us':>15} {'saving/recipient us':>20}"
+        )
+        for name, payload in sample_events.items():
+            for room_size in [int(size) for size in options['room_sizes'].split(',')]:
+                legacy = self.measure(options['rounds'], lambda: self.legacy(payload, room_size))
+                once_json = self.measure(options['rounds'], lambda: self.pre_encoded(json_encode, payload, room_size))
+                once_fast = None
+                if events.ORJSON_AVAILABLE:
+                    once_fast = self.measure(
+                        options['rounds'], lambda: self.pre_encoded(events.encode_payload, payload, room_size)
+                    )
+                best = once_fast if once_fast is not None else once_json
+                self.stdout.write(
+                    f"{name:<20} {room_size:>5} {legacy:>19.1f} {once_json:>13.1f} "
+                    f"{(once_fast if once_fast is not None else float('nan')):>15.1f} "
+                    f"{(legacy - best) / room_size:>20.2f}"
+                )
+
+    @staticmethod
+    def measure(rounds, func):
+        """Mean microseconds per call"""
+        func()
+        started = time.perf_counter()
+        for _ in range(rounds):
+            func()
+        return (time.perf_counter() - started) / rounds * 1e6
+
+    @staticmethod
+    def legacy(payload, room_size):
+        # Old behaviour: every receiving consumer serializes the whole event
+        event = {'type': payload['type'], 'target_participant_id': 'participant-0002', **payload}
+        for _ in range(room_size):
+            json.dumps(event)
+
+    @staticmethod
+    def pre_encoded(encode, payload, room_size):
+        message = {'type': payload['type'], 'text': encode(payload)}
+        for _ in range(room_size):
+            message['text']
+
+
+def json_encode(payload):
+    return json.dumps(payload, separators=(',', ':'))
@@ -0,0 +1,66 @@
+import asyncio
+import random
+
+from django.core.management.base import BaseCommand
+
+from voice_translator.hedging import Hedger, upstream_started
+from voice_translator.metrics import Histogram
+
+
+class Command(BaseCommand):
+    help = 'Simulate an upstream with occasional slow responses, with and without hedging'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=400)
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--fast-ms', default='40,80', help='Range of normal response times')
+        parser.add_argument('--slow-ms', type=float, default=1000.0)
+        parser.add_argument('--slow-rate', type=float, default=0.02)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        low, high = [float(ms) for ms in options['fast_ms'].split(',')]
+        self.stdout.write(
+            f"{options['requests']} requests, {options['slow_rate']:.0%} at {options['slow_ms']:.0f} ms, "
+            f"the rest {low:.0f}-{high:.0f} ms"
+        )
+        self.stdout.write(f"{'':<10} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'upstream calls':>15}")
+        for name, hedger in [('unhedged', None), ('hedged', Hedger())]:
+            latencies, calls = asyncio.run(self.simulate(hedger, options, low, high))
+            self.stdout.write(
+                f"{name:<10} {latencies.percentile(50):>8.0f} {latencies.percentile(95):>8.0f} "
+                f"{latencies.percentile(99):>8.0f} {calls:>15}"
+            )
+
+    async def simulate(self, hedger, options, low, high):
+        # Same seed for both runs, so they see the same slow responses
+        rng = random.Random(options['seed'])
+        latencies = Histogram(window=options['requests'])
+        calls = 0
+
+        async def upstream():
+            nonlocal calls
+            calls += 1
+            # No gate here: every attempt gets its upstream slot at once
+            upstream_started()
+            slow = rng.random() < options['slow_rate']
+            await asyncio.sleep((options['slow_ms'] if slow else rng.uniform(low, high)) / 1000.0)
+            return slow
+
+        async def request():
+            started = loop.time()
+            if hedger is None:
+                await upstream()
+            else:
+                await hedger.run('simulated', upstream)
+            latencies.observe((loop.time() - started) * 1000.0)
+
+        loop = asyncio.get_running_loop()
+        remaining = iter(range(options['requests']))
+
+        async def client():
+            for _ in remaining:
+                await request()
+
+        await asyncio.gather(*[client() for _ in range(options['concurrency'])])
+        return latencies, calls
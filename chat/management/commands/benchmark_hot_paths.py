@@ -0,0 +1,226 @@
+import base64
+import io
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+import timeit
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chat import events
+from voice_translator.audio import PYDUB_AVAILABLE, TARGET_SAMPLE_RATE, convert_for_whisper, pcm16_to_wav
+
+# What clients upload per second of speech: 48 kHz mono 16-bit WAV from the
+# PCM recorder, or Opus at 32 kbit/s from MediaRecorder (random bytes stand in
+# for the compressed stream; base64 and JSON do not care)
+CLIENT_RATE = 48000
+PAYLOADS = {
+    'wav': lambda seconds: pcm16_to_wav(tone(seconds, CLIENT_RATE), CLIENT_RATE),
+    'opus': lambda seconds: random.Random(seconds).randbytes(int(seconds * 32000 / 8)),
+}
+
+SPEECH = 'Thanks everyone for joining, let us go through the quarterly numbers first. '
+TRANSLATION = 'Gracias a todos por unirse, repasemos primero las cifras trimestrales. '
+LANGUAGES = ['es', 'fr', 'de', 'it', 'pt', 'ja', 'zh', 'ko']
+
+
+def tone(seconds, rate):
+    """16-bit mono PCM of a tone with a pause every second, so resamplers see speech-like input"""
+    import numpy as np
+
+    t = np.arange(int(seconds * rate)) / rate
+    voiced = (t % 1.0) < 0.75
+    return (6000 * np.sin(2 * np.pi * 220 * t) * voiced).astype('<i2').tobytes()
+
+
+def voice_message(audio_data):
+    return json.dumps({
+        'type': 'voice_message',
+        'audio_data': base64.b64encode(audio_data).decode('ascii'),
+        'speaker_language': 'en',
+        'utterance_id': '6f1c2f7e2b7a4f3e9a513c1f0f5d9a10',
+    })
+
+
+def translation_payload(seconds, listener):
+    # Roughly 2.5 words a second of speech
+    repeats = max(1, int(seconds * 2.5 / 12))
+    return {
+        'type': 'voice_translation',
+        'speaker_name': 'Participant 1',
+        'speaker_id': 'participant-0001',
+        'original_text': SPEECH * repeats,
+        'translated_text': TRANSLATION * repeats,
+        'original_language': 'en',
+        'target_language': LANGUAGES[listener % len(LANGUAGES)],
+        'voice_message_id': '6f1c2f7e-2b7a-4f3e-9a51-3c1f0f5d9a10',
+        'utterance_id': '6f1c2f7e2b7a4f3e9a513c1f0f5d9a10',
+        'partial': False,
+    }
+
+
+class Command(BaseCommand):
+    help = 'Time the per-utterance primitives (base64, JSON, pydub, multipart, fan-out) and compare with a baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clip-seconds', default='1,5,15,30,60')
+        parser.add_argument('--room-sizes', default='2,5,10,25,50')
+        parser.add_argument('--only', help='Comma-separated substrings; run the cases whose name contains one')
+        parser.add_argument('--repeat', type=int, default=5, help='Timing runs per case; the median is reported')
+        parser.add_argument('--save', help='Write the results to this JSON file, e.g. as a new baseline')
+        parser.add_argument('--baseline', help='Compare with results saved by --save')
+        parser.add_argument('--threshold', type=float, default=10.0,
+                            help='Percent slowdown counted as a regression')
+        parser.add_argument('--check', action='store_true', help='Exit with an error on any regression')
+
+    def handle(self, *args, **options):
+        clip_seconds = [float(value) for value in options['clip_seconds'].split(',')]
+        room_sizes = [int(value) for value in options['room_sizes'].split(',')]
+        only = [name for name in (options['only'] or '').split(',') if name]
+
+        if not PYDUB_AVAILABLE:
+            self.stdout.write(self.style.WARNING('pydub not installed, skipping the pydub cases'))
+
+        results = {}
+        self.stdout.write(f"{'case':<36} {'median':>11} {'min':>11} {'MB/s':>8}")
+        for name, func, size in self.cases(clip_seconds, room_sizes):
+            if only and not any(part in name for part in only):
+                continue
+            result = self.measure(func, options['repeat'], size)
+            results[name] = result
+            throughput = f"{result['mb_per_s']:.0f}" if result['mb_per_s'] else '-'
+            self.stdout.write(
+                f"{name:<36} {format_time(result['median_us']):>11} {format_time(result['min_us']):>11} "
+                f"{throughput:>8}"
+            )
+
+        report = {
+            'python': sys.version.split()[0],
+            'machine': platform.machine(),
+            'processor': platform.processor() or None,
+            'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'cases': results,
+        }
+        if options['save']:
+            with open(options['save'], 'w') as report_file:
+                json.dump(report, report_file, indent=2)
+            self.stdout.write(f"Results saved to {options['save']}")
+
+        if options['baseline']:
+            with open(options['baseline']) as baseline_file:
+                baseline = json.load(baseline_file)
+            regressions = self.write_comparison(results, baseline, options['threshold'])
+            if regressions and options['check']:
+                raise CommandError(f"{len(regressions)} case(s) slower than the baseline: {', '.join(regressions)}")
+
+    def cases(self, clip_seconds, room_sizes):
+        """(name, callable, bytes processed per call or None) for every case and parameter"""
+        for seconds in clip_seconds:
+            label = f'{seconds:g}s'
+            for kind, make in PAYLOADS.items():
+                audio = make(seconds)
+                encoded = base64.b64encode(audio)
+                message = voice_message(audio)
+                yield f'base64_decode[{kind},{label}]', lambda data=encoded: base64.b64decode(data), len(encoded)
+                yield f'json_loads[{kind},{label}]', lambda text=message: json.loads(text), len(message)
+                if events.ORJSON_AVAILABLE:
+                    import orjson
+                    yield f'orjson_loads[{kind},{label}]', lambda text=message: orjson.loads(text), len(message)
+
+            wav = PAYLOADS['wav'](seconds)
+            yield from self.pydub_cases(wav, label)
+            yield f'native_convert[wav,{label}]', lambda data=wav: convert_for_whisper(data), len(wav)
+            yield from self.multipart_cases(pcm16_to_wav(tone(seconds, TARGET_SAMPLE_RATE), TARGET_SAMPLE_RATE), label)
+
+        for room_size in room_sizes:
+            # One event per listener, each in its own target language
+            for seconds in sorted({min(clip_seconds), max(clip_seconds)}):
+                payloads = [translation_payload(seconds, listener) for listener in range(room_size - 1)]
+                label = f'{room_size},{seconds:g}s'
+                yield f'fanout_json_dumps[{label}]', lambda items=payloads: [json.dumps(p) for p in items], None
+                yield f'fanout_envelope[{label}]', lambda items=payloads: [
+                    events.envelope('voice_translation', p, target_participant_id='participant-0002')
+                    for p in items
+                ], None
+
+    def pydub_cases(self, wav, label):
+        if not PYDUB_AVAILABLE:
+            return
+        from pydub import AudioSegment
+
+        segment = AudioSegment.from_file(io.BytesIO(wav), format='wav')
+        resampled = segment.set_frame_rate(TARGET_SAMPLE_RATE).set_channels(1)
+
+        def export(audio=resampled):
+            buffer = io.BytesIO()
+            audio.export(buffer, format='wav')
+            return buffer.getvalue()
+
+        yield f'pydub_decode[wav,{label}]', lambda: AudioSegment.from_file(io.BytesIO(wav), format='wav'), len(wav)
+        yield f'pydub_resample[wav,{label}]', \
+            lambda: segment.set_frame_rate(TARGET_SAMPLE_RATE).set_channels(1), len(wav)
+        yield f'pydub_export[wav,{label}]', export, len(resampled.raw_data)
+
+    def multipart_cases(self, upload, label):
+        import httpx
+
+        def build(data=upload):
+            # What the client does before the first byte goes out
+            request = httpx.Request('POST', 'https://api.groq.com/openai/v1/audio/transcriptions', files={
+                'file': ('audio.wav', data, 'audio/wav'),
+                'model': (None, 'whisper-large-v3-turbo'),
+                'response_format': (None, 'json'),
+                'language': (None, 'auto'),
+            })
+            return request.read()
+
+        yield f'multipart_body[wav16k,{label}]', build, len(upload)
+
+    @staticmethod
+    def measure(func, repeat, size):
+        """Median and best time per call over `repeat` runs of enough calls to take ~0.2 s"""
+        timer = timeit.Timer(func)
+        number, elapsed = timer.autorange()
+        number = max(1, int(number * 0.2 / max(elapsed, 1e-9)))
+        runs = [total / number * 1e6 for total in timer.repeat(repeat=repeat, number=number)]
+        median = statistics.median(runs)
+        return {
+            'median_us': round(median, 3),
+            'min_us': round(min(runs), 3),
+            'calls': number,
+            'bytes': size,
+            'mb_per_s': round(size / median, 1) if size else None,
+        }
+
+    def write_comparison(self, results, baseline, threshold_pct):
+        # Best-of-runs is the least noisy estimate on a shared machine
+        self.stdout.write('')
+        self.stdout.write(f"{'vs baseline (best run)':<36} {'baseline':>11} {'current':>11} {'change':>8}")
+        regressions = []
+        for name, result in results.items():
+            before = baseline.get('cases', {}).get(name)
+            if before is None:
+                continue
+            change = (result['min_us'] - before['min_us']) / before['min_us'] * 100.0
+            line = (f"{name:<36} {format_time(before['min_us']):>11} "
+                    f"{format_time(result['min_us']):>11} {change:>+7.1f}%")
+            if change > threshold_pct:
+                regressions.append(name)
+                self.stdout.write(self.style.ERROR(line + '  slower'))
+            elif change < -threshold_pct:
+                self.stdout.write(self.style.SUCCESS(line + '  faster'))
+            else:
+                self.stdout.write(line)
+        missing = set(baseline.get('cases', {})) - set(results)
+        if missing:
+            self.stdout.write(f"{len(missing)} baseline case(s) not run this time")
+        return regressions
+
+
+def format_time(us):
+    if us >= 1000.0:
+        return f'{us / 1000.0:.2f} ms'
+    return f'{us:.1f} us'
@@ -0,0 +1,86 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# Runs in a fresh interpreter so every import is cold
+WORKER_SCRIPT = '''
+import asyncio, json, sys, time
+started = time.perf_counter()
+import django
+django.setup()
+setup_done = time.perf_counter()
+from voice_backend.asgi import application
+imported = time.perf_counter()
+from voice_backend.lifespan import startup
+steps = asyncio.run(startup(skip=[s for s in sys.argv[1].split(',') if s], background_preload=False))
+ready = time.perf_counter()
+print(json.dumps({
+    'django.setup': (setup_done - started) * 1000.0,
+    'asgi import': (imported - setup_done) * 1000.0,
+    'startup hook': (ready - imported) * 1000.0,
+    'steps': steps,
+}))
+'''
+
+
+class Command(BaseCommand):
+    help = 'Measure how long a cold worker takes from launch until it is ready to serve'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5)
+        parser.add_argument('--skip', default='', help='Comma-separated startup steps to skip, e.g. upstream')
+        parser.add_argument('--top', type=int, default=10, help='Slowest top-level imports to list')
+
+    def handle(self, *args, **options):
+        env = dict(os.environ)
+        env.setdefault('DJANGO_SETTINGS_MODULE', 'voice_backend.settings')
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, [str(settings.BASE_DIR), env.get('PYTHONPATH')]))
+
+        phases = {}
+        for _ in range(options['runs']):
+            started = time.perf_counter()
+            output = subprocess.run(
+                [sys.executable, '-c', WORKER_SCRIPT, options['skip']],
+                cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, check=True
+            ).stdout
+            total = (time.perf_counter() - started) * 1000.0
+            result = json.loads(output.strip().splitlines()[-1])
+            steps = result.pop('steps')
+            for name, ms in list(result.items()) + [(f'  {step}', ms) for step, ms in steps.items()]:
+                phases.setdefault(name, []).append(ms)
+            phases.setdefault('total (incl. interpreter)', []).append(total)
+
+        self.stdout.write(f"{'phase':<28} {'median ms':>10} {'min ms':>8} {'max ms':>8}")
+        for name, values in phases.items():
+            self.stdout.write(
+                f"{name:<28} {statistics.median(values):>10.1f} {min(values):>8.1f} {max(values):>8.1f}"
+            )
+
+        if options['top']:
+            self.stdout.write('')
+            self.stdout.write(f"{'slowest top-level imports':<40} {'ms':>8}")
+            for module, ms in self.slowest_imports(env, options['top']):
+                self.stdout.write(f"{module:<40} {ms:>8.1f}")
+
+    @staticmethod
+    def slowest_imports(env, top):
+        stderr = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c',
+             'import django; django.setup(); import voice_backend.asgi'],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True
+        ).stderr
+        imports = []
+        for line in stderr.splitlines():
+            # "import time: self [us] | cumulative | imported package", nesting shown by indentation
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+            _, cumulative, module = line.split('|')
+            if not module[1:].startswith(' '):
+                imports.append((module.strip(), int(cumulative) / 1000.0))
+        return sorted(imports, key=lambda item: item[1], reverse=True)[:top]
@@ -0,0 +1,120 @@
+import asyncio
+import json
+import os
+import tempfile
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import override_settings
+
+from chat import recording
+from chat.replay import RecordedSession, SessionReplay, compare
+
+# One worker, as in production behind the affinity router
+REPLAY_CHANNEL_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+
+
+class Command(BaseCommand):
+    help = 'Replay a recorded conference session against this worker and report latency and throughput'
+
+    def add_arguments(self, parser):
+        parser.add_argument('archive', help='A .session.gz file written with SESSION_RECORDING_DIR set')
+        parser.add_argument('--speed', type=float, default=1.0,
+                            help='Playback speed; 4 plays the session four times as fast')
+        parser.add_argument('--upstream-latency', type=float, default=1.0,
+                            help='Multiplier on the recorded upstream latencies (0 answers at once)')
+        parser.add_argument('--drain', type=float, default=30.0,
+                            help='Seconds a leaving connection waits for utterances still in flight')
+        parser.add_argument('--save', help='Write the report to this JSON file, e.g. as a new baseline')
+        parser.add_argument('--baseline', help='Compare with a report saved by --save')
+        parser.add_argument('--threshold', type=float, default=10.0,
+                            help='Percent change in the worse direction counted as a regression')
+        parser.add_argument('--check', action='store_true', help='Exit with an error on any regression')
+        parser.add_argument('--inspect', action='store_true', help='Only describe the archive')
+
+    def handle(self, *args, **options):
+        session = RecordedSession(options['archive'])
+        for name, value in session.summary().items():
+            self.stdout.write(f"{name:<12} {value}")
+        if options['inspect']:
+            return
+
+        if options['speed'] <= 0:
+            raise CommandError('--speed must be positive')
+        recording.stop_recording()
+        report = self.replay(session, options)
+        self.stdout.write('')
+        self.write_report(report)
+
+        if options['save']:
+            with open(options['save'], 'w') as report_file:
+                json.dump(report, report_file, indent=2)
+            self.stdout.write(f"Report saved to {options['save']}")
+
+        if options['baseline']:
+            with open(options['baseline']) as baseline_file:
+                baseline = json.load(baseline_file)
+            regressions = self.write_comparison(compare(report, baseline, options['threshold']))
+            if regressions and options['check']:
+                raise CommandError(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+
+    def replay(self, session, options):
+        database = connections.settings['default']
+        original = dict(database)
+        try:
+            with tempfile.TemporaryDirectory() as directory:
+                # A scratch database and media directory, so a replay never touches real data
+                connections.close_all()
+                database.update(NAME=os.path.join(directory, 'replay.sqlite3'))
+                call_command('migrate', verbosity=0)
+                with override_settings(MEDIA_ROOT=directory, CHANNEL_LAYERS=REPLAY_CHANNEL_LAYERS):
+                    from voice_backend.asgi import application
+
+                    replay = SessionReplay(
+                        session, application,
+                        speed=options['speed'],
+                        latency_scale=options['upstream_latency'],
+                        drain=options['drain']
+                    )
+                    return asyncio.run(replay.run())
+        finally:
+            connections.close_all()
+            database.clear()
+            database.update(original)
+
+    def write_report(self, report):
+        self.stdout.write(
+            f"replayed {report['frames']} frames on {report['connections']} connections "
+            f"in {report['wall_s']:.1f}s at {report['speed']}x"
+        )
+        self.stdout.write(
+            f"utterances {report['utterances']} (delivered {report['delivered']}), partials {report['partials']}, "
+            f"deliveries {report['deliveries']} ({report['deliveries_per_s']}/s), "
+            f"shed {report['shed']}, errors {report['errors']}"
+        )
+        self.stdout.write(f"{'latency ms':<14} {'count':>6} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}")
+        for name in ('utterance_ms', 'delivery_ms', 'partial_ms'):
+            stats = report[name]
+            self.stdout.write(
+                f"{name:<14} {stats['count']:>6} " + ' '.join(
+                    f"{stats[key]:>8.1f}" if stats[key] is not None else f"{'-':>8}"
+                    for key in ('p50', 'p95', 'p99', 'max')
+                )
+            )
+        self.stdout.write(f"event loop lag ms: {report['event_loop_lag_ms']}")
+        self.stdout.write(f"upstream: {report['upstream']}")
+
+    def write_comparison(self, rows):
+        self.stdout.write('')
+        self.stdout.write(f"{'vs baseline':<24} {'baseline':>10} {'current':>10} {'delta':>8}")
+        regressions = []
+        for name, before, after, delta, regressed in rows:
+            change = f"{delta:+.1f}%" if delta is not None else 'new'
+            line = f"{name:<24} {before:>10.1f} {after:>10.1f} {change:>8}"
+            if regressed:
+                regressions.append(name)
+                self.stdout.write(self.style.ERROR(line + '  regression'))
+            else:
+                self.stdout.write(line)
+        return regressions
@@ -0,0 +1,39 @@
+import asyncio
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.affinity import AffinityRouter
+
+
+class Command(BaseCommand):
+    help = 'Run the front router that pins each conference room to one Daphne worker'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--listen', default='0.0.0.0:8000', help='host:port to accept clients on')
+        parser.add_argument(
+            '--worker', action='append', dest='workers',
+            help='Worker address (host:port or unix:/path); repeat for each worker'
+        )
+        parser.add_argument('--replicas', type=int, default=100, help='Virtual nodes per worker')
+        parser.add_argument('--health-interval', type=float, default=2.0)
+
+    def handle(self, *args, **options):
+        workers = options['workers'] or getattr(settings, 'AFFINITY_WORKERS', [])
+        if not workers:
+            raise CommandError('No workers configured (use --worker or AFFINITY_WORKERS)')
+
+        host, _, port = options['listen'].rpartition(':')
+        router = AffinityRouter(
+            workers,
+            replicas=options['replicas'],
+            health_interval=options['health_interval']
+        )
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Affinity router on {options['listen']} -> {', '.join(workers)}"
+        ))
+        try:
+            asyncio.run(router.serve(host or '0.0.0.0', int(port)))
+        except KeyboardInterrupt:
+            self.stdout.write('Affinity router stopped')
@@ -0,0 +1,29 @@
+import asyncio
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from chat.layers import DEFAULT_SOCKET_PATH, ChannelBroker
+
+
+class Command(BaseCommand):
+    help = 'Run the Unix-socket channel broker shared by all Daphne processes on this host'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', help='Socket path (defaults to the channel layer CONFIG)')
+
+    def handle(self, *args, **options):
+        config = settings.CHANNEL_LAYERS['default'].get('CONFIG', {})
+        broker = ChannelBroker(
+            path=options['path'] or config.get('path', DEFAULT_SOCKET_PATH),
+            expiry=config.get('expiry', 60),
+            group_expiry=config.get('group_expiry', 86400),
+            capacity=config.get('capacity', 100),
+            channel_capacity=config.get('channel_capacity')
+        )
+
+        self.stdout.write(self.style.SUCCESS(f'Channel broker listening on {broker.path}'))
+        try:
+            asyncio.run(broker.serve())
+        except KeyboardInterrupt:
+            self.stdout.write('Channel broker stopped')
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.5 on 2026-10-19 01:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0002_conferenceroom_remove_userpresence_room_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='voicemessage',
+            index=models.Index(fields=['room', 'timestamp'], name='chat_voicemsg_room_ts_idx'),
+        ),
+    ]
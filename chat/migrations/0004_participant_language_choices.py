@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-19 01:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0003_voicemessage_room_timestamp_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='participant',
+            name='preferred_language',
+            field=models.CharField(choices=[('en', 'English'), ('es', 'Spanish'), ('fr', 'French'), ('de', 'German'), ('it', 'Italian'), ('pt', 'Portuguese'), ('ru', 'Russian'), ('zh', 'Chinese'), ('ja', 'Japanese'), ('ko', 'Korean'), ('ar', 'Arabic'), ('hi', 'Hindi')], default='en', max_length=10),
+        ),
+    ]
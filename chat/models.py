@@ -1,6 +1,8 @@
 from django.db import models
 import uuid
 
+from voice_translator.languages import languages
+
 
 class ConferenceRoom(models.Model):
     room_id = models.CharField(max_length=50, unique=True, default=uuid.uuid4)
@@ -17,18 +19,7 @@ class ConferenceRoom(models.Model):
 
 
 class Participant(models.Model):
-    LANGUAGE_CHOICES = [
-        ('en', 'English'),
-        ('es', 'Spanish'),
-        ('fr', 'French'),
-        ('de', 'German'),
-        ('ru', 'Russian'),
-        ('zh', 'Chinese'),
-        ('ja', 'Japanese'),
-        ('ko', 'Korean'),
-        ('ar', 'Arabic'),
-        ('hi', 'Hindi'),
-    ]
+    LANGUAGE_CHOICES = languages.choices()
 
     participant_id = models.CharField(max_length=50, unique=True, default=uuid.uuid4)
     name = models.CharField(max_length=100)
@@ -59,6 +50,9 @@ class VoiceMessage(models.Model):
 
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['room', 'timestamp'], name='chat_voicemsg_room_ts_idx'),
+        ]
 
     def __str__(self):
         return f"Message from {self.speaker.name} at {self.timestamp}"
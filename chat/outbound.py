@@ -0,0 +1,192 @@
+"""
+Per-connection outbound queue for ConferenceConsumer.
+
+Handlers never await the socket directly: frames go into a bounded queue and
+a writer task sends them in the order they were queued, so a presence update
+always reaches the client before the translations that refer to it.
+
+- Idempotent events (speaking status, presence, participant list) carry a
+  coalescing key; a newer event with the same key replaces the queued one, so
+  a burst collapses to the latest state.
+- When the queue is full the oldest frame of the least important class
+  (presence before replies before translations) is dropped (``drop``), or the
+  socket is closed (``disconnect``) and the client restores what it missed
+  from room history when it reconnects.
+- A send that fails closes the socket.
+
+A send returns as soon as the server has buffered the frame, so on its own
+the queue only sees bursts produced inside this process. Given `buffered`, a
+callable returning the bytes still waiting in the socket's write buffer
+(Daphne's ``write_buffer`` extension, see voice_backend/backpressure.py),
+the writer stops sending while that is above `high_water` and resumes once it
+has drained to half of it; a client on a slow link then backs up here, where
+the policies above apply and the lag shows in the metrics.
+
+Open queues are listed for the readiness check and socket stats until the
+writer task ends or the consumer calls detach().
+"""
+import asyncio
+import time
+import weakref
+from collections import deque
+
+from voice_translator.metrics import Histogram, metrics
+
+PRIORITY_TRANSLATION = 0
+PRIORITY_CONTROL = 1
+PRIORITY_STATUS = 2
+
+POLICY_DROP = 'drop'
+POLICY_DISCONNECT = 'disconnect'
+
+# Close code for clients whose queue overflowed; they should reconnect
+CLOSE_SLOW_CONSUMER = 4008
+
+# How often a writer held back by a full socket buffer checks it again
+DRAIN_POLL_INTERVAL = 0.05
+
+_queues = weakref.WeakSet()
+
+
+class OutboundQueue:
+    def __init__(self, send, close, name='', max_size=256, policy=POLICY_DROP,
+                 buffered=None, high_water=256 * 1024):
+        self._send = send
+        self._close = close
+        self.name = name
+        self.max_size = max_size
+        self.policy = policy
+        self._buffered = buffered
+        self.high_water = high_water
+        self._frames = deque()
+        self._coalescing = {}
+        self._ready = asyncio.Event()
+        self._closing = False
+        self.lag = Histogram(window=256)
+        self.stats = {'sent': 0, 'coalesced': 0, 'dropped': 0, 'stalls': 0}
+        _queues.add(self)
+
+    def __len__(self):
+        return len(self._frames)
+
+    def put(self, frame, priority=PRIORITY_CONTROL, key=None):
+        """Queue a text or binary frame; `key` marks it as replaceable by a later frame with the same key"""
+        if self._closing:
+            return
+        if key is not None and key in self._coalescing:
+            self._coalescing[key][0] = frame
+            self.stats['coalesced'] += 1
+            metrics.increment('ws_outbound_coalesced')
+            return
+
+        if len(self._frames) >= self.max_size:
+            if self.policy == POLICY_DISCONNECT:
+                self._disconnect('queue full')
+                return
+            # Drop the oldest frame of the least important class, which may be this one
+            victim = max([priority] + [entry[3] for entry in self._frames])
+            self.stats['dropped'] += 1
+            metrics.increment('ws_outbound_dropped', priority=victim)
+            index = next((i for i, entry in enumerate(self._frames) if entry[3] == victim), None)
+            if index is None:
+                return
+            dropped = self._frames[index]
+            del self._frames[index]
+            if dropped[2] is not None:
+                self._coalescing.pop(dropped[2], None)
+
+        entry = [frame, time.monotonic(), key, priority]
+        self._frames.append(entry)
+        if key is not None:
+            self._coalescing[key] = entry
+        self._ready.set()
+
+    def _pop(self):
+        if not self._frames:
+            return None
+        entry = self._frames.popleft()
+        if entry[2] is not None:
+            self._coalescing.pop(entry[2], None)
+        return entry
+
+    def _disconnect(self, reason):
+        if self._closing:
+            return
+        self._closing = True
+        print(f"[OUTBOUND] Closing socket {self.name}: {reason}")
+        metrics.increment('ws_slow_client_disconnects', reason=reason)
+        asyncio.ensure_future(self._close(CLOSE_SLOW_CONSUMER))
+
+    def detach(self):
+        """Stop counting this socket as open"""
+        _queues.discard(self)
+
+    async def _drain(self):
+        """Wait while the socket's write buffer is over the high-water mark"""
+        if self._buffered is None or self._buffered() <= self.high_water:
+            return
+        self.stats['stalls'] += 1
+        metrics.increment('ws_outbound_stalls')
+        while not self._closing and self._buffered() > self.high_water // 2:
+            await asyncio.sleep(DRAIN_POLL_INTERVAL)
+
+    async def run(self):
+        """Writer task: send queued frames in order until cancelled or a send fails"""
+        try:
+            await self._write()
+        finally:
+            self.detach()
+
+    async def _write(self):
+        while not self._closing:
+            await self._drain()
+            entry = self._pop()
+            if entry is None:
+                self._ready.clear()
+                await self._ready.wait()
+                continue
+
+            frame, queued_at, _, _ = entry
+            lag_ms = (time.monotonic() - queued_at) * 1000.0
+            try:
+                if isinstance(frame, bytes):
+                    await self._send(bytes_data=frame)
+                else:
+                    await self._send(text_data=frame)
+            except Exception as e:
+                print(f"[ERROR] Send to {self.name} failed: {e}")
+                metrics.increment('ws_send_errors')
+                self._closing = True
+                try:
+                    await self._close()
+                except Exception:
+                    pass
+                return
+            self.stats['sent'] += 1
+            self.lag.observe(lag_ms)
+            metrics.observe('ws_send_lag_ms', lag_ms)
+
+    def snapshot(self):
+        return {
+            'socket': self.name,
+            'depth': len(self),
+            'lag_ms_p50': self.lag.percentile(50),
+            'lag_ms_p99': self.lag.percentile(99),
+            'lag_ms_max': self.lag.max,
+            **self.stats,
+        }
+
+
+def outbound_snapshot():
+    """Per-socket queue depth and lag for every open connection in this process"""
+    return [queue.snapshot() for queue in list(_queues)]
+
+
+def outbound_load():
+    """Open sockets and frames waiting to be sent, without the per-socket percentiles"""
+    depths = [len(queue) for queue in list(_queues)]
+    return {
+        'sockets': len(depths),
+        'queued_frames': sum(depths),
+        'max_depth': max(depths, default=0),
+    }
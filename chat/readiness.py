@@ -0,0 +1,87 @@
+"""
+Readiness of this worker for new conferences.
+
+The load balancer polls ``/chat/ready/`` and stops sending new connections
+while it answers 503. A worker is not ready while it is still starting up,
+when its event loop is lagging, when it holds READINESS_MAX_SOCKETS sockets,
+or when its voice pipeline or upstream queue is within READINESS_LOAD_FACTOR
+of the point where admission control starts shedding utterances. Rooms
+already on the worker keep working; readiness only steers new ones away.
+"""
+import asyncio
+
+from django.conf import settings
+
+from voice_backend.lifespan import startup_report
+from voice_translator.circuit import OPEN, circuits_snapshot
+from voice_translator.metrics import Histogram, metrics
+from voice_translator.upstream import get_upstream_gate
+
+from .admission import admission
+from .outbound import outbound_load
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes from a fixed sleep"""
+
+    def __init__(self, interval_ms=250, window=40):
+        self.interval = interval_ms / 1000.0
+        self.lag = Histogram(window=window)
+        self._task = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            lag_ms = max(0.0, (loop.time() - started - self.interval) * 1000.0)
+            self.lag.observe(lag_ms)
+            metrics.observe('event_loop_lag_ms', lag_ms)
+
+
+loop_monitor = LoopLagMonitor(getattr(settings, 'LOOP_LAG_INTERVAL_MS', 250))
+
+
+def readiness():
+    """(ready, report) for this worker; call on the event loop"""
+    loop_monitor.start()
+    factor = getattr(settings, 'READINESS_LOAD_FACTOR', 0.8)
+    sockets = outbound_load()
+    rooms = admission.rooms()
+    gate = get_upstream_gate().stats()
+    circuits = circuits_snapshot()
+    lag_ms = loop_monitor.lag.percentile(95)
+
+    reasons = []
+    if not startup_report['complete']:
+        reasons.append('starting')
+    if lag_ms is not None and lag_ms > getattr(settings, 'READINESS_MAX_LOOP_LAG_MS', 200):
+        reasons.append('event_loop_lag')
+    if sockets['sockets'] >= getattr(settings, 'READINESS_MAX_SOCKETS', 500):
+        reasons.append('sockets')
+    if admission.pipelines >= factor * getattr(settings, 'PIPELINE_MAX_IN_FLIGHT', 32):
+        reasons.append('pipeline')
+    if gate['live_waiting'] >= factor * getattr(settings, 'UPSTREAM_MAX_WAITING', 16):
+        reasons.append('upstream')
+    open_circuits = [endpoint for endpoint, state in circuits.items() if state['state'] == OPEN]
+    # Every worker shares the upstream, so an open circuit only counts when asked to
+    if open_circuits and getattr(settings, 'READINESS_FAIL_ON_OPEN_CIRCUIT', False):
+        reasons.append('circuit_open')
+
+    return not reasons, {
+        'ready': not reasons,
+        'reasons': reasons,
+        'sockets': sockets,
+        'rooms': len(rooms),
+        'participants': sum(rooms.values()),
+        'pipelines_in_flight': admission.pipelines,
+        'queued_joins': admission.queued_joins(),
+        'upstream': gate,
+        'circuits': circuits,
+        'event_loop_lag_ms': {'p95': lag_ms, 'max': loop_monitor.lag.percentile(100)},
+        'startup': startup_report,
+    }
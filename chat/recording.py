@@ -0,0 +1,257 @@
+"""
+Session recording for replay (``manage.py replay_session``).
+
+With SESSION_RECORDING_DIR set, each room session (first connection to last
+disconnect) is written to ``<room>-<started>.session.gz``: a gzip stream of
+msgpack records holding every inbound WebSocket frame with its time offset,
+plus every upstream API response made on the room's behalf with its status,
+body and latency. Writing happens on a background thread, which flushes the
+archive whenever it has been idle for a second; sessions still open when the
+worker exits are closed from the lifespan shutdown hook or atexit. An archive
+cut short by a crash reads up to its last flush.
+
+Records, each a map with kind ``k``:
+
+    session  v, room, started (epoch seconds)
+    open     t, c                      connection c connected (t: ms into session)
+    in       t, c, d                   frame from connection c (str or bytes)
+    close    t, c, code
+    up       t, e, u, f, s, h, b, ms   upstream response: endpoint, utterance key,
+                                       request fingerprint, status, content type,
+                                       body, latency; x instead of s for errors
+
+Upstream requests are matched to their utterance through `current_utterance`,
+a digest of the clip's audio, so replay can answer the same clip with the
+same transcription whatever order the requests arrive in.
+"""
+import atexit
+import contextlib
+import contextvars
+import gzip
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+import zlib
+
+import msgpack
+from django.conf import settings
+
+ARCHIVE_VERSION = 1
+
+# The recorder of the room a consumer belongs to, inherited by its pipeline tasks
+current_recorder = contextvars.ContextVar('current_recorder', default=None)
+# Audio digest of the utterance an upstream request is made for
+current_utterance = contextvars.ContextVar('current_utterance', default=None)
+
+# Whether consumers tag their pipelines with `current_utterance` (recording or replaying)
+tracking = False
+_recording_dir = None
+_recorders = {}
+_writers = set()
+_atexit_registered = False
+
+# How long stop_recording() waits for each archive to be written out
+STOP_TIMEOUT = 5.0
+
+
+def start_recording(directory=None):
+    """Record room sessions to `directory` (default SESSION_RECORDING_DIR)"""
+    global tracking, _recording_dir, _atexit_registered
+    from voice_translator.upstream import set_upstream_transport
+
+    _recording_dir = directory or settings.SESSION_RECORDING_DIR
+    os.makedirs(_recording_dir, exist_ok=True)
+    tracking = True
+    set_upstream_transport(recording_transport)
+    if not _atexit_registered:
+        atexit.register(stop_recording)
+        _atexit_registered = True
+    print(f"[RECORDING] Recording conference sessions to {_recording_dir}")
+
+
+def stop_recording():
+    """Close every open session and wait for the archives to be written out"""
+    global _recording_dir
+    _recording_dir = None
+    for recorder in list(_recorders.values()):
+        recorder.finish()
+    for writer in list(_writers):
+        writer.join(STOP_TIMEOUT)
+
+
+def recording_transport(limits):
+    import httpx
+    from .upstream_tap import RecordingTransport
+    return RecordingTransport(httpx.AsyncHTTPTransport(limits=limits))
+
+
+def utterance_key(audio_data):
+    return hashlib.blake2b(audio_data, digest_size=8).hexdigest()
+
+
+@contextlib.contextmanager
+def utterance_scope(audio_data):
+    """Tag upstream requests from tasks started inside the block with this clip"""
+    if not tracking:
+        yield
+        return
+    token = current_utterance.set(utterance_key(audio_data))
+    try:
+        yield
+    finally:
+        current_utterance.reset(token)
+
+
+def fingerprint(content):
+    """Stable key for a JSON completion request: its messages, not the model the router picked"""
+    try:
+        messages = json.loads(content).get('messages')
+    except (ValueError, AttributeError):
+        return None
+    if messages is None:
+        return None
+    return hashlib.blake2b(
+        json.dumps(messages, sort_keys=True, ensure_ascii=False).encode('utf-8'), digest_size=8
+    ).hexdigest()
+
+
+def endpoint_of(url_path):
+    """'/openai/v1/audio/transcriptions' -> 'audio/transcriptions'"""
+    return '/'.join(url_path.rstrip('/').split('/')[-2:])
+
+
+class ArchiveWriter:
+    """Appends records to a gzip'd msgpack stream from a background thread"""
+
+    def __init__(self, path):
+        self.path = path
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name='session-recorder', daemon=True)
+        _writers.add(self)
+        self._thread.start()
+
+    def write(self, record):
+        self._queue.put(record)
+
+    def close(self):
+        self._queue.put(None)
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            print(f"[ERROR] Recording to {self.path} still being written after {timeout}s")
+
+    def _run(self):
+        try:
+            with gzip.open(self.path, 'wb', compresslevel=6) as archive:
+                pending = False
+                while True:
+                    try:
+                        record = self._queue.get(timeout=1.0)
+                    except queue.Empty:
+                        if pending:
+                            archive.flush(zlib.Z_SYNC_FLUSH)
+                            pending = False
+                        continue
+                    if record is None:
+                        return
+                    try:
+                        archive.write(msgpack.packb(record, use_bin_type=True))
+                        pending = True
+                    except Exception as e:
+                        print(f"[ERROR] Could not record to {self.path}: {e}")
+        finally:
+            _writers.discard(self)
+
+
+def read_archive(path):
+    """Yield the records of a session archive; one cut short yields what was flushed"""
+    unpacker = msgpack.Unpacker(raw=False, max_buffer_size=256 * 1024 * 1024)
+    with gzip.open(path, 'rb') as archive:
+        while True:
+            # Small reads, so a cut-off tail only loses what came after the last flush
+            try:
+                chunk = archive.read1(64 * 1024)
+            except (EOFError, zlib.error, gzip.BadGzipFile) as e:
+                print(f"[RECORDING] {path} is truncated, reading up to the cut: {e}")
+                return
+            if not chunk:
+                return
+            unpacker.feed(chunk)
+            yield from unpacker
+
+
+class SessionRecorder:
+    """One room session, from its first connection to its last disconnect"""
+
+    def __init__(self, room_id, directory):
+        self.room_id = room_id
+        self.started = time.monotonic()
+        self.connections = 0
+        self.open_connections = 0
+        self.path = os.path.join(directory, f"{room_id}-{time.strftime('%Y%m%d-%H%M%S')}.session.gz")
+        self.writer = ArchiveWriter(self.path)
+        self.writer.write({'k': 'session', 'v': ARCHIVE_VERSION, 'room': room_id, 'started': time.time()})
+
+    def offset_ms(self):
+        return round((time.monotonic() - self.started) * 1000.0, 1)
+
+    def opened(self):
+        connection = self.connections
+        self.connections += 1
+        self.open_connections += 1
+        self.writer.write({'k': 'open', 't': self.offset_ms(), 'c': connection})
+        return connection
+
+    def received(self, connection, text_data=None, bytes_data=None):
+        self.writer.write({
+            'k': 'in', 't': self.offset_ms(), 'c': connection,
+            'd': bytes_data if bytes_data is not None else text_data
+        })
+
+    def closed(self, connection, code):
+        self.writer.write({'k': 'close', 't': self.offset_ms(), 'c': connection, 'code': code})
+        self.open_connections -= 1
+        if self.open_connections <= 0:
+            self.finish()
+
+    def upstream(self, record):
+        record.update(k='up', t=self.offset_ms())
+        self.writer.write(record)
+
+    def finish(self):
+        if _recorders.get(self.room_id) is self:
+            del _recorders[self.room_id]
+            self.writer.close()
+            print(f"[RECORDING] Saved {self.connections} connections of room {self.room_id} to {self.path}")
+
+
+class ConnectionRecording:
+    """What a consumer holds: its connection number within the room's recorder"""
+
+    def __init__(self, recorder):
+        self.recorder = recorder
+        self.connection = recorder.opened()
+        current_recorder.set(recorder)
+
+    def received(self, text_data=None, bytes_data=None):
+        self.recorder.received(self.connection, text_data, bytes_data)
+
+    def closed(self, code):
+        self.recorder.closed(self.connection, code)
+
+
+def record_connection(room_id):
+    """A ConnectionRecording if this room is being recorded, else None"""
+    if _recording_dir is None:
+        return None
+    rooms = getattr(settings, 'SESSION_RECORDING_ROOMS', None)
+    if rooms and room_id not in rooms:
+        return None
+    recorder = _recorders.get(room_id)
+    if recorder is None:
+        recorder = _recorders[room_id] = SessionRecorder(room_id, _recording_dir)
+    return ConnectionRecording(recorder)
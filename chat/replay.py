@@ -0,0 +1,268 @@
+"""
+Replay of recorded conference sessions (see chat.recording).
+
+Every recorded connection is re-opened against the ASGI application and
+sends its frames at their recorded offsets, divided by `speed`; upstream
+requests are answered by chat.upstream_tap.ReplayTransport with the recorded
+responses and latencies. Voice messages without an utterance_id get one, so
+each voice_translation a listener receives can be traced to the frame that
+caused it.
+"""
+import asyncio
+import json
+import os
+import time
+
+import msgpack
+from channels.testing import WebsocketCommunicator
+
+from voice_translator.metrics import Histogram
+from voice_translator.upstream import set_upstream_transport
+
+from . import recording
+from .admission import admission
+from .events import compact, decode_message
+from .readiness import loop_monitor
+from .upstream_tap import ReplayTransport
+
+# Report fields compared against a baseline: whether a larger value is worse,
+# and the smallest change (in the field's unit) that can count as a regression
+COMPARED = [
+    ('utterance_ms.p50', True, 20.0),
+    ('utterance_ms.p95', True, 20.0),
+    ('utterance_ms.p99', True, 20.0),
+    ('delivery_ms.p50', True, 20.0),
+    ('delivery_ms.p95', True, 20.0),
+    ('delivery_ms.p99', True, 20.0),
+    ('partial_ms.p50', True, 20.0),
+    ('partial_ms.p95', True, 20.0),
+    ('deliveries_per_s', False, 0.0),
+    ('delivered', False, 0),
+    ('shed', True, 0),
+    ('errors', True, 0),
+    ('event_loop_lag_ms.p95', True, 10.0),
+    ('wall_s', True, 0.5),
+]
+
+
+class RecordedSession:
+    """A session archive loaded for replay"""
+
+    def __init__(self, path):
+        self.path = path
+        self.room_id = None
+        self.started = None
+        self.connections = {}
+        self.upstream = []
+        self.duration_ms = 0.0
+
+        for record in recording.read_archive(path):
+            kind = record['k']
+            if kind == 'session':
+                self.room_id = record['room']
+                self.started = record['started']
+                continue
+            self.duration_ms = max(self.duration_ms, record.get('t', 0.0))
+            if kind == 'up':
+                self.upstream.append(record)
+                continue
+            connection = self.connections.setdefault(record['c'], {'open': record['t'], 'close': None, 'frames': []})
+            if kind == 'in':
+                connection['frames'].append((record['t'], record['d']))
+            elif kind == 'close':
+                connection['close'] = record['t']
+
+    def summary(self):
+        frames = [frame for connection in self.connections.values() for frame in connection['frames']]
+        endpoints = {}
+        for record in self.upstream:
+            endpoints[record['e']] = endpoints.get(record['e'], 0) + 1
+        return {
+            'room': self.room_id,
+            'started': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.started)) if self.started else None,
+            'duration_s': round(self.duration_ms / 1000.0, 1),
+            'connections': len(self.connections),
+            'frames': len(frames),
+            'frame_bytes': sum(len(data) for _, data in frames),
+            'upstream': endpoints,
+        }
+
+
+def tag_utterance(data, default_id):
+    """(frame, utterance key) with an utterance_id added to voice messages that lack one;
+    other frames come back unchanged with key None"""
+    binary = isinstance(data, bytes)
+    try:
+        message = decode_message(data) if binary else json.loads(data)
+    except Exception:
+        return data, None
+    if not isinstance(message, dict) or message.get('type') != 'voice_message':
+        return data, None
+
+    key = (message.get('utterance_id') or default_id, bool(message.get('partial')))
+    if not message.get('utterance_id'):
+        message['utterance_id'] = default_id
+        data = msgpack.packb(compact(message), use_bin_type=True) if binary else json.dumps(message)
+    return data, key
+
+
+class SessionReplay:
+    def __init__(self, session, application, speed=1.0, latency_scale=1.0, drain=30.0):
+        self.session = session
+        self.application = application
+        self.speed = speed
+        self.drain = drain
+        self.transport = ReplayTransport(session.upstream, latency_scale)
+        self.path = f'/ws/conference/{session.room_id}/'
+
+        self.sent = {}          # (utterance_id, partial) -> loop time of the latest send
+        self.owner = {}         # (utterance_id, partial) -> connection that sent it
+        self.awaiting = set()   # sends with no delivery yet
+        self.pending = {}       # connection -> its final utterances not delivered yet
+        self.utterance_ms = Histogram(window=100000)
+        self.delivery_ms = Histogram(window=100000)
+        self.partial_ms = Histogram(window=100000)
+        self.counts = {'frames': 0, 'utterances': 0, 'partials': 0, 'deliveries': 0, 'shed': 0,
+                       'errors': 0, 'rejected': 0}
+
+    def elapsed(self):
+        return asyncio.get_running_loop().time() - self.started
+
+    async def wait_until(self, offset_ms):
+        await asyncio.sleep(max(0.0, offset_ms / 1000.0 / self.speed - self.elapsed()))
+
+    async def run(self):
+        set_upstream_transport(lambda limits: self.transport)
+        recording.tracking = True
+        self.started = asyncio.get_running_loop().time()
+        await asyncio.gather(*(
+            self.play(number, connection) for number, connection in sorted(self.session.connections.items())
+        ))
+        return self.report(self.elapsed())
+
+    async def play(self, number, connection):
+        frames = [
+            (offset,) + tag_utterance(data, f'replay-{number}-{index}')
+            for index, (offset, data) in enumerate(connection['frames'])
+        ]
+        self.pending[number] = []
+
+        await self.wait_until(connection['open'])
+        communicator = WebsocketCommunicator(self.application, self.path)
+        connected, _ = await communicator.connect(timeout=30)
+        if not connected:
+            self.counts['rejected'] += 1
+            return
+        reader = asyncio.ensure_future(self.read(number, communicator))
+
+        for offset, data, key in frames:
+            await self.wait_until(offset)
+            if key is not None:
+                self.sent[key] = self.elapsed()
+                self.owner[key] = number
+                self.awaiting.add(key)
+                if key[1]:
+                    self.counts['partials'] += 1
+                else:
+                    self.counts['utterances'] += 1
+                    self.pending[number].append(key)
+            self.counts['frames'] += 1
+            if isinstance(data, bytes):
+                await communicator.send_to(bytes_data=data)
+            else:
+                await communicator.send_to(text_data=data)
+
+        # A connection still open when recording stopped leaves after its last frame
+        last = frames[-1][0] if frames else connection['open']
+        await self.wait_until(connection['close'] if connection['close'] is not None else last)
+        await self.settle(number)
+        reader.cancel()
+        await communicator.disconnect()
+
+    async def settle(self, number):
+        """Stay until every utterance sent so far is delivered, however fast the replay runs.
+        Gives up after `drain` seconds, or once no pipeline has run for half a second
+        (nobody left to deliver to, or the utterance failed)."""
+        give_up = self.elapsed() + self.drain
+        idle = 0
+        while any(self.pending.values()) and idle < 10 and self.elapsed() < give_up:
+            idle = idle + 1 if not admission.pipelines else 0
+            await asyncio.sleep(0.05)
+
+    async def read(self, number, communicator):
+        while True:
+            output = await communicator.receive_output(timeout=None)
+            if output['type'] != 'websocket.send':
+                return
+            message = decode_message(output['bytes']) if output.get('bytes') else json.loads(output['text'])
+            kind = message.get('type')
+            if kind == 'voice_translation':
+                self.delivered(message)
+            elif kind == 'overloaded':
+                # Shedding answers the voice message just sent
+                self.counts['shed'] += 1
+                if self.pending[number]:
+                    self.pending[number].pop()
+            elif kind == 'error':
+                self.counts['errors'] += 1
+                if self.pending[number]:
+                    self.pending[number].pop(0)
+
+    def delivered(self, message):
+        key = (message.get('utterance_id'), bool(message.get('partial')))
+        if key not in self.sent:
+            return
+        latency_ms = (self.elapsed() - self.sent[key]) * 1000.0
+        first = key in self.awaiting
+        self.awaiting.discard(key)
+        if key[1]:
+            if first:
+                self.partial_ms.observe(latency_ms)
+            return
+
+        self.counts['deliveries'] += 1
+        self.delivery_ms.observe(latency_ms)
+        if first:
+            self.utterance_ms.observe(latency_ms)
+            pending = self.pending[self.owner[key]]
+            if key in pending:
+                pending.remove(key)
+
+    def report(self, wall_s):
+        return {
+            'session': os.path.basename(self.session.path),
+            'speed': self.speed,
+            'wall_s': round(wall_s, 2),
+            'connections': len(self.session.connections),
+            **self.counts,
+            'delivered': self.utterance_ms.count,
+            'deliveries_per_s': round(self.counts['deliveries'] / wall_s, 2) if wall_s else None,
+            'utterance_ms': self.utterance_ms.snapshot(),
+            'delivery_ms': self.delivery_ms.snapshot(),
+            'partial_ms': self.partial_ms.snapshot(),
+            'event_loop_lag_ms': {'p95': loop_monitor.lag.percentile(95), 'max': loop_monitor.lag.max},
+            'upstream': dict(self.transport.stats),
+        }
+
+
+def report_value(report, name):
+    value = report
+    for part in name.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def compare(report, baseline, threshold_pct=10.0):
+    """[(field, baseline, current, delta %, regressed)] for the fields in COMPARED"""
+    rows = []
+    for name, larger_is_worse, floor in COMPARED:
+        before, after = report_value(baseline, name), report_value(report, name)
+        if before is None or after is None:
+            continue
+        delta = (after - before) / before * 100.0 if before else (0.0 if after == before else None)
+        worse = after > before if larger_is_worse else after < before
+        regressed = worse and abs(after - before) > floor and (delta is None or abs(delta) > threshold_pct)
+        rows.append((name, before, after, delta, regressed))
+    return rows
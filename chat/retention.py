@@ -0,0 +1,267 @@
+"""
+Retention and compaction for conference data.
+
+- Voice messages older than RETENTION_VOICE_MESSAGE_DAYS are deleted with
+  their translations and audio files.
+- Offline participants idle for RETENTION_PARTICIPANT_DAYS are deleted once
+  none of their voice messages are left.
+- Rooms older than RETENTION_ROOM_DAYS with no participants and no messages
+  left are deleted with their sessions.
+
+Rows go in batches of ``batch_size``, each batch its own short transaction,
+so live consumers only ever wait for one batch. Audio files are removed
+after the batch has committed. Media files no row refers to (left behind by
+failed saves or deleted by hand) are found by walking the upload directories
+and checking them against the database a chunk at a time. On SQLite the
+database is then compacted with an incremental vacuum and ``PRAGMA optimize``.
+
+A dry run deletes nothing, so it counts each policy as if the ones before it
+had run: participants whose last messages are expiring, and rooms emptied by
+those deletions, are included.
+"""
+import os
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import ConferenceRoom, Participant, TranslatedAudio, VoiceMessage
+
+# Directories under MEDIA_ROOT and the file fields that refer to them
+MEDIA_FIELDS = [
+    (VoiceMessage, 'original_audio_file'),
+    (TranslatedAudio, 'translated_audio_file'),
+]
+
+
+def cutoff(days):
+    return None if days is None else timezone.now() - timedelta(days=days)
+
+
+def expired_voice_messages(days):
+    return VoiceMessage.objects.filter(timestamp__lt=cutoff(days))
+
+
+def idle_participants(days):
+    return Participant.objects.filter(
+        is_online=False, last_activity__lt=cutoff(days), voice_messages__isnull=True
+    )
+
+
+def ended_rooms(days):
+    return ConferenceRoom.objects.filter(
+        created_at__lt=cutoff(days), participants__isnull=True, voice_messages__isnull=True
+    )
+
+
+def cascaded(voice_message_days, participant_days, room_days):
+    """The three policies' querysets for a dry run, each as it would match after the ones before it"""
+    messages = VoiceMessage.objects.none()
+    if voice_message_days is not None:
+        messages = expired_voice_messages(voice_message_days)
+    remaining_messages = VoiceMessage.objects.exclude(pk__in=messages)
+
+    participants = Participant.objects.none()
+    if participant_days is not None:
+        participants = Participant.objects.filter(
+            is_online=False, last_activity__lt=cutoff(participant_days)
+        ).exclude(voice_messages__in=remaining_messages)
+
+    rooms = ConferenceRoom.objects.none()
+    if room_days is not None:
+        rooms = ConferenceRoom.objects.filter(created_at__lt=cutoff(room_days)).exclude(
+            participants__in=Participant.objects.exclude(pk__in=participants)
+        ).exclude(voice_messages__in=remaining_messages)
+    return messages, participants, rooms
+
+
+def audio_files(model, pks):
+    """Stored audio file names of the given rows and of the translations that cascade with them"""
+    if model is VoiceMessage:
+        names = list(VoiceMessage.objects.filter(pk__in=pks).values_list('original_audio_file', flat=True))
+        translations = TranslatedAudio.objects.filter(voice_message_id__in=pks)
+    elif model is Participant:
+        names = []
+        translations = TranslatedAudio.objects.filter(target_participant_id__in=pks)
+    else:
+        return []
+    names += translations.values_list('translated_audio_file', flat=True)
+    return [name for name in names if name]
+
+
+def remove_file(name):
+    """Delete a stored file; returns the bytes freed"""
+    try:
+        size = default_storage.size(name)
+        default_storage.delete(name)
+        return size
+    except (OSError, NotImplementedError):
+        return 0
+
+
+def purge(queryset, batch_size=500, pause=0.0, dry_run=False):
+    """Delete the queryset's rows in bounded batches; returns (rows deleted, files removed, bytes freed)"""
+    if dry_run:
+        return queryset.count(), 0, 0
+
+    rows = files = freed = 0
+    while True:
+        with transaction.atomic():
+            pks = list(queryset.values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                break
+            names = audio_files(queryset.model, pks)
+            queryset.model.objects.filter(pk__in=pks).delete()
+        rows += len(pks)
+        for name in names:
+            size = remove_file(name)
+            files += 1 if size else 0
+            freed += size
+        if pause:
+            time.sleep(pause)
+    return rows, files, freed
+
+
+def walk_files(root):
+    """Yield (path, stat) for every file under root without listing the whole tree at once"""
+    try:
+        entries = os.scandir(root)
+    except FileNotFoundError:
+        return
+    with entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from walk_files(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                yield entry.path, entry.stat(follow_symlinks=False)
+
+
+def purge_orphaned_media(grace_seconds=3600, chunk_size=500, dry_run=False):
+    """Remove media files older than grace_seconds that no row refers to; returns (files, bytes)"""
+    try:
+        media_root = default_storage.path('')
+    except NotImplementedError:
+        print("[RETENTION] Default storage is not on the local filesystem; skipping orphan scan")
+        return 0, 0
+
+    newest = time.time() - grace_seconds
+    files = freed = 0
+    for model, field_name in MEDIA_FIELDS:
+        upload_to = model._meta.get_field(field_name).upload_to
+        chunk = []
+        for path, stat in walk_files(os.path.join(media_root, upload_to)):
+            # Recent files may belong to a row that is still being saved
+            if stat.st_mtime > newest:
+                continue
+            name = os.path.relpath(path, media_root).replace(os.sep, '/')
+            chunk.append((name, path, stat.st_size))
+            if len(chunk) >= chunk_size:
+                removed = _remove_unreferenced(model, field_name, chunk, dry_run)
+                files, freed = files + removed[0], freed + removed[1]
+                chunk = []
+        if chunk:
+            removed = _remove_unreferenced(model, field_name, chunk, dry_run)
+            files, freed = files + removed[0], freed + removed[1]
+    return files, freed
+
+
+def _remove_unreferenced(model, field_name, chunk, dry_run):
+    referenced = set(model.objects.filter(
+        **{f'{field_name}__in': [name for name, _, _ in chunk]}
+    ).values_list(field_name, flat=True))
+    files = freed = 0
+    for name, path, size in chunk:
+        if name in referenced:
+            continue
+        if not dry_run:
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+        files += 1
+        freed += size
+    return files, freed
+
+
+def database_size():
+    """Bytes used by the SQLite database file and its WAL, or None for other databases"""
+    if connection.vendor != 'sqlite':
+        return None
+    name = str(connection.settings_dict['NAME'])
+    return sum(os.path.getsize(path) for path in (name, f'{name}-wal') if os.path.exists(path))
+
+
+def compact_database(pages=2000, full=False):
+    """Return free pages to the filesystem and refresh planner statistics.
+
+    Incremental vacuum only works once the database uses
+    ``auto_vacuum=INCREMENTAL``, which takes one full VACUUM to switch to;
+    that rewrites the whole file and blocks writers while it runs, so it only
+    happens when `full` is set.
+    """
+    if connection.vendor != 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        return 'analyze'
+
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA auto_vacuum')
+        incremental = cursor.fetchone()[0] == 2
+        if full:
+            if not incremental:
+                cursor.execute('PRAGMA auto_vacuum=INCREMENTAL')
+            cursor.execute('VACUUM')
+            done = 'full vacuum'
+        elif incremental:
+            # Each result row is one page freed, so the pragma only runs as far as it is read
+            cursor.execute(f'PRAGMA incremental_vacuum({int(pages)})')
+            cursor.fetchall()
+            done = f'incremental vacuum ({int(pages)} pages)'
+        else:
+            done = 'no vacuum (run once with --full-vacuum to enable incremental vacuum)'
+
+        # Re-analyze only the tables whose statistics are stale, sampling a bounded number of rows
+        cursor.execute('PRAGMA analysis_limit=400')
+        cursor.execute('PRAGMA optimize')
+        cursor.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    return done
+
+
+def apply_retention(batch_size=None, pause=0.0, dry_run=False, orphans=True, vacuum=True, full_vacuum=False):
+    """Apply every retention policy and compact the database; returns a report dict"""
+    batch_size = batch_size or getattr(settings, 'RETENTION_BATCH_SIZE', 500)
+    policies = [
+        ('voice_messages', getattr(settings, 'RETENTION_VOICE_MESSAGE_DAYS', 30), expired_voice_messages),
+        ('participants', getattr(settings, 'RETENTION_PARTICIPANT_DAYS', 30), idle_participants),
+        ('rooms', getattr(settings, 'RETENTION_ROOM_DAYS', 30), ended_rooms),
+    ]
+    if dry_run:
+        querysets = cascaded(*[days for _, days, _ in policies])
+    else:
+        querysets = [None if days is None else queryset(days) for _, days, queryset in policies]
+    report = {'size_before': database_size(), 'deleted': {}, 'files': 0, 'media_bytes': 0}
+
+    for (name, days, _), queryset in zip(policies, querysets):
+        if days is None:
+            continue
+        rows, files, freed = purge(queryset, batch_size, pause, dry_run)
+        report['deleted'][name] = rows
+        report['files'] += files
+        report['media_bytes'] += freed
+
+    if orphans:
+        files, freed = purge_orphaned_media(
+            getattr(settings, 'RETENTION_ORPHAN_GRACE_SECONDS', 3600), batch_size, dry_run
+        )
+        report['orphans'] = files
+        report['files'] += files
+        report['media_bytes'] += freed
+
+    if vacuum and not dry_run:
+        report['compaction'] = compact_database(getattr(settings, 'RETENTION_VACUUM_PAGES', 2000), full_vacuum)
+
+    report['size_after'] = database_size()
+    return report
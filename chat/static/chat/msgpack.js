@@ -0,0 +1,210 @@
+/*
+ * Minimal MessagePack codec for the conference page, served from our own
+ * static files rather than a CDN. Exposes window.MessagePack.encode(value)
+ * -> Uint8Array and window.MessagePack.decode(Uint8Array) -> value, the two
+ * calls the page uses from @msgpack/msgpack.
+ *
+ * Covers what the server sends and the page encodes: nil, booleans,
+ * integers, float32/64, UTF-8 strings, binary (Uint8Array), arrays and maps.
+ * Extension types are rejected.
+ */
+(function (global) {
+    'use strict';
+
+    const textEncoder = new TextEncoder();
+    const textDecoder = new TextDecoder('utf-8');
+
+    function Writer() {
+        this.buffer = new Uint8Array(256);
+        this.view = new DataView(this.buffer.buffer);
+        this.length = 0;
+    }
+
+    Writer.prototype.reserve = function (size) {
+        if (this.length + size <= this.buffer.length) return;
+        let capacity = this.buffer.length * 2;
+        while (capacity < this.length + size) capacity *= 2;
+        const grown = new Uint8Array(capacity);
+        grown.set(this.buffer.subarray(0, this.length));
+        this.buffer = grown;
+        this.view = new DataView(grown.buffer);
+    };
+
+    Writer.prototype.byte = function (value) {
+        this.reserve(1);
+        this.buffer[this.length++] = value;
+    };
+
+    Writer.prototype.number = function (setter, size, value) {
+        this.reserve(size);
+        this.view[setter](this.length, value);
+        this.length += size;
+    };
+
+    Writer.prototype.bytes = function (bytes) {
+        this.reserve(bytes.length);
+        this.buffer.set(bytes, this.length);
+        this.length += bytes.length;
+    };
+
+    // Header for a str, bin, array or map of `size` elements
+    Writer.prototype.header = function (size, fix, fixLimit, codes) {
+        if (fix !== null && size < fixLimit) {
+            this.byte(fix | size);
+        } else if (codes[0] !== null && size < 0x100) {
+            this.byte(codes[0]);
+            this.byte(size);
+        } else if (size < 0x10000) {
+            this.byte(codes[1]);
+            this.number('setUint16', 2, size);
+        } else {
+            this.byte(codes[2]);
+            this.number('setUint32', 4, size);
+        }
+    };
+
+    function encodeInteger(writer, value) {
+        if (value >= 0) {
+            if (value < 0x80) return writer.byte(value);
+            if (value < 0x100) { writer.byte(0xcc); return writer.byte(value); }
+            if (value < 0x10000) { writer.byte(0xcd); return writer.number('setUint16', 2, value); }
+            if (value < 0x100000000) { writer.byte(0xce); return writer.number('setUint32', 4, value); }
+            writer.byte(0xcf);
+            return writer.number('setBigUint64', 8, BigInt(value));
+        }
+        if (value >= -0x20) return writer.byte(value & 0xff);
+        if (value >= -0x80) { writer.byte(0xd0); return writer.number('setInt8', 1, value); }
+        if (value >= -0x8000) { writer.byte(0xd1); return writer.number('setInt16', 2, value); }
+        if (value >= -0x80000000) { writer.byte(0xd2); return writer.number('setInt32', 4, value); }
+        writer.byte(0xd3);
+        return writer.number('setBigInt64', 8, BigInt(value));
+    }
+
+    function encodeValue(writer, value) {
+        if (value === null || value === undefined) return writer.byte(0xc0);
+        if (value === false) return writer.byte(0xc2);
+        if (value === true) return writer.byte(0xc3);
+        if (typeof value === 'number') {
+            if (Number.isSafeInteger(value)) return encodeInteger(writer, value);
+            writer.byte(0xcb);
+            return writer.number('setFloat64', 8, value);
+        }
+        if (typeof value === 'string') {
+            const bytes = textEncoder.encode(value);
+            writer.header(bytes.length, 0xa0, 32, [0xd9, 0xda, 0xdb]);
+            return writer.bytes(bytes);
+        }
+        if (value instanceof Uint8Array || value instanceof ArrayBuffer) {
+            const bytes = value instanceof Uint8Array ? value : new Uint8Array(value);
+            writer.header(bytes.length, null, 0, [0xc4, 0xc5, 0xc6]);
+            return writer.bytes(bytes);
+        }
+        if (Array.isArray(value)) {
+            writer.header(value.length, 0x90, 16, [null, 0xdc, 0xdd]);
+            return value.forEach((item) => encodeValue(writer, item));
+        }
+        if (typeof value === 'object') {
+            const entries = Object.entries(value).filter(([, item]) => item !== undefined);
+            writer.header(entries.length, 0x80, 16, [null, 0xde, 0xdf]);
+            return entries.forEach(([key, item]) => {
+                encodeValue(writer, key);
+                encodeValue(writer, item);
+            });
+        }
+        throw new TypeError(`Cannot encode ${typeof value} as MessagePack`);
+    }
+
+    function encode(value) {
+        const writer = new Writer();
+        encodeValue(writer, value);
+        return writer.buffer.slice(0, writer.length);
+    }
+
+    function decode(bytes) {
+        const view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
+        let offset = 0;
+
+        function take(size) {
+            if (offset + size > bytes.length) throw new RangeError('Truncated MessagePack data');
+            const start = offset;
+            offset += size;
+            return start;
+        }
+
+        function number(getter, size) {
+            return view[getter](take(size));
+        }
+
+        function string(size) {
+            const start = take(size);
+            return textDecoder.decode(bytes.subarray(start, start + size));
+        }
+
+        function binary(size) {
+            const start = take(size);
+            return bytes.slice(start, start + size);
+        }
+
+        function array(size) {
+            const items = new Array(size);
+            for (let i = 0; i < size; i++) items[i] = value();
+            return items;
+        }
+
+        function map(size) {
+            const result = {};
+            for (let i = 0; i < size; i++) {
+                const key = value();
+                result[key] = value();
+            }
+            return result;
+        }
+
+        function bigint(getter) {
+            const result = number(getter, 8);
+            return Number.isSafeInteger(Number(result)) ? Number(result) : result;
+        }
+
+        function value() {
+            const code = bytes[take(1)];
+            if (code < 0x80) return code;
+            if (code < 0x90) return map(code & 0x0f);
+            if (code < 0xa0) return array(code & 0x0f);
+            if (code < 0xc0) return string(code & 0x1f);
+            if (code >= 0xe0) return code - 0x100;
+            switch (code) {
+                case 0xc0: return null;
+                case 0xc2: return false;
+                case 0xc3: return true;
+                case 0xc4: return binary(number('getUint8', 1));
+                case 0xc5: return binary(number('getUint16', 2));
+                case 0xc6: return binary(number('getUint32', 4));
+                case 0xca: return number('getFloat32', 4);
+                case 0xcb: return number('getFloat64', 8);
+                case 0xcc: return number('getUint8', 1);
+                case 0xcd: return number('getUint16', 2);
+                case 0xce: return number('getUint32', 4);
+                case 0xcf: return bigint('getBigUint64');
+                case 0xd0: return number('getInt8', 1);
+                case 0xd1: return number('getInt16', 2);
+                case 0xd2: return number('getInt32', 4);
+                case 0xd3: return bigint('getBigInt64');
+                case 0xd9: return string(number('getUint8', 1));
+                case 0xda: return string(number('getUint16', 2));
+                case 0xdb: return string(number('getUint32', 4));
+                case 0xdc: return array(number('getUint16', 2));
+                case 0xdd: return array(number('getUint32', 4));
+                case 0xde: return map(number('getUint16', 2));
+                case 0xdf: return map(number('getUint32', 4));
+                default:
+                    throw new TypeError(`Unsupported MessagePack type 0x${code.toString(16)}`);
+            }
+        }
+
+        const result = value();
+        if (offset !== bytes.length) throw new RangeError('Extra bytes after MessagePack value');
+        return result;
+    }
+
+    global.MessagePack = { encode: encode, decode: decode };
+})(window);
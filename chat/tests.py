@@ -1,3 +1,814 @@
-from django.test import TestCase
+import asyncio
+import gc
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from datetime import timedelta
+from io import StringIO
+from types import SimpleNamespace
 
-# Create your tests here.
+import msgpack
+from channels.exceptions import ChannelFull
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.urls import re_path
+from django.utils import timezone
+
+from voice_backend import lifespan
+from voice_backend.backpressure import buffered_bytes
+from voice_backend.db_writer import DatabaseWriter, database_write
+
+from . import recording
+from .affinity import strip_proxy_headers
+from .admission import AdmissionControl, RoomFull, admission, expire_stale_participants
+from .catchup import save_catch_up
+from .conference_consumer import ConferenceConsumer, utterance_budget_ms
+from .events import (
+    PROTOCOL_JSON, PROTOCOL_MSGPACK, binary_frame, compact, decode_message, encode_payload, envelope, expand
+)
+from .layers import ChannelBroker, UnixSocketChannelLayer, encode_frame, read_frame
+from .history import (
+    InvalidCursor, InvalidHistoryQuery, get_history_page, make_entry, room_history
+)
+from .management.commands.benchmark_hot_paths import Command as BenchmarkHotPaths
+from .models import ConferenceRoom, Participant, TranslatedAudio, VoiceMessage
+from .outbound import (
+    CLOSE_SLOW_CONSUMER, POLICY_DISCONNECT, PRIORITY_STATUS, PRIORITY_TRANSLATION, OutboundQueue, outbound_load
+)
+from .readiness import readiness
+from .recording import SessionRecorder, read_archive, stop_recording
+from .retention import apply_retention
+
+
+class HistoryPaginationTests(TestCase):
+    def setUp(self):
+        room_history.clear()
+        self.room = ConferenceRoom.objects.create(room_id='history', room_name='History')
+        self.speaker = Participant.objects.create(name='Ann', room=self.room)
+        start = timezone.now() - timedelta(hours=1)
+        self.messages = []
+        for i in range(10):
+            message = VoiceMessage.objects.create(
+                room=self.room, speaker=self.speaker, original_text=f'utterance {i}', detected_language='en'
+            )
+            # Two utterances share each timestamp, so the pk breaks ties
+            VoiceMessage.objects.filter(pk=message.pk).update(timestamp=start + timedelta(seconds=i // 2))
+            message.refresh_from_db()
+            self.messages.append(message)
+
+    def tearDown(self):
+        room_history.clear()
+
+    def buffer(self, indexes):
+        for i in indexes:
+            room_history.record(self.room.room_id, make_entry(
+                self.messages[i], self.speaker.name, self.speaker.participant_id, {}
+            ))
+
+    def read_all(self, limit):
+        texts, cursor = [], None
+        while True:
+            page = get_history_page(self.room.room_id, cursor, limit)
+            texts += [message['original_text'] for message in page['messages']]
+            cursor = page['next_cursor']
+            if cursor is None:
+                return texts
+
+    def expected(self):
+        return [f'utterance {i}' for i in reversed(range(10))]
+
+    def test_database_only(self):
+        self.assertEqual(self.read_all(3), self.expected())
+
+    def test_buffer_out_of_completion_order(self):
+        # Concurrent speakers finish translation out of timestamp order
+        self.buffer([1, 0, 3, 2, 5, 4, 7, 6, 9, 8])
+        self.assertEqual(self.read_all(3), self.expected())
+
+    def test_buffer_missing_rows_saved_elsewhere(self):
+        # Only some utterances went through this worker's pipeline
+        self.buffer([9, 8, 6, 5])
+        self.assertEqual(self.read_all(2), self.expected())
+        self.assertEqual(self.read_all(4), self.expected())
+
+    def test_buffer_covering_newest_page(self):
+        self.buffer([5, 6, 8, 7, 9])
+        page = get_history_page(self.room.room_id, None, 4)
+        self.assertEqual([m['original_text'] for m in page['messages']],
+                         ['utterance 9', 'utterance 8', 'utterance 7', 'utterance 6'])
+        self.assertEqual(self.read_all(4), self.expected())
+
+    def test_deleted_row_still_buffered(self):
+        self.buffer(range(10))
+        self.messages[8].delete()
+        self.assertNotIn('utterance 8', self.read_all(3))
+
+    def test_deleted_and_missing_rows_in_same_page(self):
+        # The row count over the range still matches, the rows do not
+        self.buffer([9, 7, 6, 5])
+        self.messages[7].delete()
+        expected = [text for text in self.expected() if text != 'utterance 7']
+        self.assertEqual(self.read_all(4), expected)
+
+    def test_language_spellings_match_stored_translations(self):
+        # Older rows may hold the language's name rather than its code
+        TranslatedAudio.objects.create(
+            voice_message=self.messages[9], target_participant=self.speaker, target_language='Spanish',
+            translated_text='enunciado 9', translation_status='completed'
+        )
+        for spelling in ['es', 'es-MX', 'Spanish']:
+            page = get_history_page(self.room.room_id, None, 1, spelling)
+            self.assertEqual(page['messages'][0]['translated_text'], 'enunciado 9')
+            self.assertEqual(page['messages'][0]['target_language'], 'es')
+
+        room_history.record(self.room.room_id, make_entry(
+            self.messages[9], self.speaker.name, self.speaker.participant_id, {'es': 'enunciado nueve'}
+        ))
+        page = get_history_page(self.room.room_id, None, 1, 'español')
+        self.assertEqual(page['messages'][0]['translated_text'], 'enunciado nueve')
+        page = get_history_page(self.room.room_id, None, 1, 'English')
+        self.assertEqual(page['messages'][0]['translated_text'], 'utterance 9')
+
+    def test_invalid_input(self):
+        with self.assertRaises(InvalidCursor):
+            get_history_page(self.room.room_id, 'nonsense', 5)
+        with self.assertRaises(InvalidHistoryQuery):
+            get_history_page(self.room.room_id, None, 'abc')
+
+    def test_view_errors(self):
+        self.assertEqual(self.client.get('/chat/rooms/history/history/?limit=abc').status_code, 400)
+        self.assertEqual(self.client.get('/chat/rooms/missing/history/').status_code, 404)
+
+
+class OutboundQueueTests(SimpleTestCase):
+    def run_queue(self, queue, frames):
+        async def main():
+            for frame, priority, key in frames:
+                queue.put(frame, priority, key)
+            writer = asyncio.ensure_future(queue.run())
+            await asyncio.sleep(0.01)
+            writer.cancel()
+        asyncio.run(main())
+
+    def test_frames_sent_in_queue_order(self):
+        sent = []
+
+        async def send(text_data=None, bytes_data=None):
+            sent.append(text_data)
+
+        queue = OutboundQueue(send, None)
+        self.run_queue(queue, [
+            ('translation 1', PRIORITY_TRANSLATION, None),
+            ('joined', PRIORITY_STATUS, ('presence', 'p2')),
+            ('translation 2', PRIORITY_TRANSLATION, None),
+            ('left', PRIORITY_STATUS, ('presence', 'p2')),
+        ])
+        # The later presence event replaces the queued one in place
+        self.assertEqual(sent, ['translation 1', 'left', 'translation 2'])
+
+    def test_overflow_drops_least_important(self):
+        sent = []
+
+        async def send(text_data=None, bytes_data=None):
+            sent.append(text_data)
+
+        queue = OutboundQueue(send, None, max_size=2)
+        self.run_queue(queue, [
+            ('status', PRIORITY_STATUS, None),
+            ('translation 1', PRIORITY_TRANSLATION, None),
+            ('translation 2', PRIORITY_TRANSLATION, None),
+        ])
+        self.assertEqual(sent, ['translation 1', 'translation 2'])
+
+    def test_send_error_closes_socket(self):
+        closed = []
+
+        async def send(text_data=None, bytes_data=None):
+            raise ConnectionResetError('gone')
+
+        async def close(code=None):
+            closed.append(code)
+
+        queue = OutboundQueue(send, close)
+        self.run_queue(queue, [('translation', PRIORITY_TRANSLATION, None)])
+        self.assertEqual(closed, [None])
+        self.assertEqual(queue.stats['sent'], 0)
+
+    def test_blocked_send_backs_up_into_the_queue(self):
+        sent = []
+        unblocked = asyncio.Event()
+
+        async def send(text_data=None, bytes_data=None):
+            await unblocked.wait()
+            sent.append(text_data)
+
+        queue = OutboundQueue(send, None, max_size=3)
+
+        async def main():
+            writer = asyncio.ensure_future(queue.run())
+            queue.put('translation 0', PRIORITY_TRANSLATION)
+            await asyncio.sleep(0)
+            # The writer is stuck sending translation 0; the rest waits here
+            for i in range(3):
+                queue.put(f'speaking {i}', PRIORITY_STATUS, ('speaking', 'p1'))
+            queue.put('translation 1', PRIORITY_TRANSLATION)
+            queue.put('translation 2', PRIORITY_TRANSLATION)
+            queue.put('translation 3', PRIORITY_TRANSLATION)
+            unblocked.set()
+            await asyncio.sleep(0.01)
+            writer.cancel()
+        asyncio.run(main())
+        self.assertEqual(sent, ['translation 0', 'translation 1', 'translation 2', 'translation 3'])
+        self.assertEqual(queue.stats['coalesced'], 2)
+        self.assertEqual(queue.stats['dropped'], 1)
+
+    def test_full_socket_buffer_holds_frames_back(self):
+        sent = []
+        buffer = {'size': 1024 * 1024}
+
+        async def send(text_data=None, bytes_data=None):
+            sent.append(text_data)
+
+        queue = OutboundQueue(send, None, max_size=2, buffered=lambda: buffer['size'], high_water=1024)
+
+        async def main():
+            writer = asyncio.ensure_future(queue.run())
+            for i in range(3):
+                queue.put(f'translation {i}', PRIORITY_TRANSLATION)
+            await asyncio.sleep(0.1)
+            self.assertEqual(sent, [])
+            buffer['size'] = 0
+            await asyncio.sleep(0.1)
+            writer.cancel()
+        asyncio.run(main())
+        self.assertEqual(sent, ['translation 1', 'translation 2'])
+        self.assertEqual(queue.stats['stalls'], 1)
+        self.assertGreaterEqual(queue.lag.max, 100.0)
+
+    def test_disconnect_policy_closes_a_stalled_socket(self):
+        closed = []
+
+        async def send(text_data=None, bytes_data=None):
+            pass
+
+        async def close(code=None):
+            closed.append(code)
+
+        queue = OutboundQueue(send, close, max_size=1, policy=POLICY_DISCONNECT, buffered=lambda: 4096, high_water=1024)
+
+        async def main():
+            writer = asyncio.ensure_future(queue.run())
+            queue.put('translation 0', PRIORITY_TRANSLATION)
+            queue.put('translation 1', PRIORITY_TRANSLATION)
+            await asyncio.wait_for(writer, 1)
+        asyncio.run(main())
+        self.assertEqual(closed, [CLOSE_SLOW_CONSUMER])
+        self.assertEqual(queue.stats['sent'], 0)
+
+
+class WriteBufferTests(SimpleTestCase):
+    def test_buffered_bytes_of_tls_over_tcp(self):
+        tcp = SimpleNamespace(dataBuffer=b'x' * 100, offset=40, _tempDataLen=10)
+        tls = SimpleNamespace(_appSendBuffer=[b'abc'], transport=tcp)
+        self.assertEqual(buffered_bytes(tls), 73)
+        self.assertEqual(buffered_bytes(None), 0)
+
+
+class SocketRegistryTests(SimpleTestCase):
+    def test_closed_socket_leaves_readiness_without_gc(self):
+        application = URLRouter([
+            re_path(r'^ws/conference/(?P<room_id>\w+)/$', ConferenceConsumer.as_asgi()),
+        ])
+
+        async def main():
+            before = outbound_load()['sockets']
+            communicator = WebsocketCommunicator(application, '/ws/conference/registry/')
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            self.assertEqual(outbound_load()['sockets'], before + 1)
+            await communicator.disconnect()
+            self.assertEqual(outbound_load()['sockets'], before)
+            report = readiness()[1]
+            self.assertEqual(report['sockets']['sockets'], before)
+
+        gc.disable()
+        try:
+            asyncio.run(main())
+        finally:
+            gc.enable()
+
+
+class SupersessionTests(SimpleTestCase):
+    def make_consumer(self):
+        consumer = ConferenceConsumer()
+        consumer.participant = SimpleNamespace(name='Ann', participant_id='p1', preferred_language='en')
+        consumer.voice_tasks = {}
+        consumer.speaking = False
+        consumer.replies = []
+        consumer.started = []
+
+        async def send_payload(payload):
+            consumer.replies.append(payload)
+
+        async def run_pipeline(audio_data, speaker_language, pcm_format, deadline, partial, utterance_id):
+            consumer.started.append((utterance_id, partial, deadline.budget_ms))
+            with admission.pipeline():
+                await asyncio.sleep(1)
+
+        consumer.send_payload = send_payload
+        consumer.run_pipeline = run_pipeline
+        return consumer
+
+    def voice_message(self, **fields):
+        return {'type': 'voice_message', 'audio_data': 'AAAA', **fields}
+
+    def test_revision_cancels_the_one_in_flight(self):
+        async def main():
+            consumer = self.make_consumer()
+            await consumer.handle_voice_message(self.voice_message(utterance_id='u1', partial=True))
+            first = consumer.voice_tasks['u1']
+            await asyncio.sleep(0)
+            await consumer.handle_voice_message(self.voice_message(utterance_id='u1'))
+            second = consumer.voice_tasks['u1']
+            await asyncio.sleep(0)
+            self.assertTrue(first.cancelled())
+            self.assertIsNot(first, second)
+            self.assertFalse(second.done())
+            self.assertEqual([partial for _, partial, _ in consumer.started], [True, False])
+            second.cancel()
+            await asyncio.sleep(0.01)
+            self.assertEqual(consumer.voice_tasks, {})
+        asyncio.run(main())
+
+    def test_revisions_are_shed_when_overloaded(self):
+        async def main():
+            consumer = self.make_consumer()
+            await consumer.handle_voice_message(self.voice_message(utterance_id='u1'))
+            first = consumer.voice_tasks['u1']
+            await asyncio.sleep(0)
+            with self.settings(PIPELINE_MAX_IN_FLIGHT=0):
+                await consumer.handle_voice_message(self.voice_message(utterance_id='u1'))
+            await asyncio.sleep(0)
+            self.assertTrue(first.cancelled())
+            self.assertEqual(consumer.replies[-1]['type'], 'overloaded')
+            self.assertEqual(len(consumer.started), 1)
+        asyncio.run(main())
+
+    def test_bad_budget_and_utterance_ids_are_rejected(self):
+        async def main():
+            consumer = self.make_consumer()
+            for fields in [{'budget_ms': 'soon'}, {'budget_ms': 0}, {'budget_ms': 'nan'},
+                           {'utterance_id': 'a"] , *'}, {'utterance_id': 'x' * 65}, {'utterance_id': 5}]:
+                await consumer.handle_voice_message(self.voice_message(**fields))
+            self.assertEqual([reply['type'] for reply in consumer.replies], ['error'] * 6)
+            self.assertEqual(consumer.voice_tasks, {})
+        asyncio.run(main())
+
+    def test_budget_is_clamped_to_the_configured_one(self):
+        with self.settings(UTTERANCE_BUDGET_MS=8000):
+            self.assertEqual(utterance_budget_ms(None), 8000)
+            self.assertEqual(utterance_budget_ms('2500'), 2500.0)
+            self.assertEqual(utterance_budget_ms(60000), 8000)
+
+
+class AdmissionQueueTests(SimpleTestCase):
+    def test_freed_place_is_reserved_for_first_waiter(self):
+        async def main():
+            admission = AdmissionControl()
+            first, _ = admission.wait_for_slot('room')
+            second, position = admission.wait_for_slot('room')
+            self.assertEqual(position, 2)
+            self.assertIs(admission.slot_freed('room'), first)
+            self.assertEqual(admission.reserved('room'), 1)
+            self.assertFalse(first.done())
+            admission.hand_over(first)
+            self.assertTrue(first.done())
+            self.assertFalse(second.done())
+
+            # The first waiter leaves before joining: its place goes to the next one
+            admission.cancel_wait('room', first)
+            self.assertTrue(second.done())
+            self.assertEqual(admission.reserved('room'), 1)
+            admission.release('room', second)
+            self.assertEqual(admission.reserved('room'), 0)
+            self.assertFalse(admission.has_waiters('room'))
+            self.assertIsNone(admission.slot_freed('room'))
+        asyncio.run(main())
+
+
+class RoomCapacityTests(TestCase):
+    def setUp(self):
+        self.room = ConferenceRoom.objects.create(room_id='capacity', room_name='Capacity', max_participants=2)
+        self.create_participant = ConferenceConsumer.create_participant.__wrapped__.__get__(ConferenceConsumer())
+
+    def test_reserved_places_count_as_taken(self):
+        self.create_participant(self.room, 'Ann', 'en')
+        with self.assertRaises(RoomFull):
+            self.create_participant(self.room, 'Bob', 'en', reserved=1)
+        self.create_participant(self.room, 'Bob', 'en')
+        # Reconnecting does not take a second place
+        self.create_participant(self.room, 'Bob', 'fr')
+        with self.assertRaises(RoomFull):
+            self.create_participant(self.room, 'Cy', 'en')
+
+    def test_stale_participants_free_their_place(self):
+        self.create_participant(self.room, 'Ann', 'en')
+        self.create_participant(self.room, 'Bob', 'en')
+        Participant.objects.filter(name='Ann').update(last_activity=timezone.now() - timedelta(hours=1))
+        self.create_participant(self.room, 'Cy', 'en')
+
+        self.assertEqual(expire_stale_participants.__wrapped__(), 1)
+        self.assertEqual(
+            sorted(self.room.participants.filter(is_online=True).values_list('name', flat=True)), ['Bob', 'Cy']
+        )
+
+
+class CatchUpTests(TestCase):
+    def test_language_switch_replaces_catch_up_translation(self):
+        room = ConferenceRoom.objects.create(room_id='catchup', room_name='Catch-up')
+        speaker = Participant.objects.create(name='Ann', room=room)
+        listener = Participant.objects.create(name='Bob', room=room, preferred_language='es')
+        message = VoiceMessage.objects.create(room=room, speaker=speaker, original_text='Hello', detected_language='en')
+        entries = [{'pk': message.pk}]
+
+        save_catch_up.__wrapped__(listener, 'es', entries, ['Hola'])
+        save_catch_up.__wrapped__(listener, 'fr', entries, ['Bonjour'])
+
+        translation = TranslatedAudio.objects.get(voice_message=message, target_participant=listener)
+        self.assertEqual((translation.target_language, translation.translated_text), ('fr', 'Bonjour'))
+
+
+class EnvelopeTests(SimpleTestCase):
+    def test_msgpack_frame_built_on_demand_and_shared(self):
+        payload = {'type': 'voice_translation', 'original_text': 'Hello', 'translated_text': 'Hola', 'partial': False}
+        event = envelope('voice_translation', payload, target_participant_id='p2')
+        self.assertNotIn('binary', event)
+
+        # Each consumer receives its own copy of a group message
+        first, second = dict(event), dict(event)
+        self.assertEqual(decode_message(binary_frame(first)), payload)
+        self.assertIs(binary_frame(second), first['binary'])
+
+    def test_routing_fields_stay_on_the_envelope(self):
+        event = envelope('voice_translation', {'type': 'voice_translation', 'translated_text': 'Hola'},
+                         target_participant_id='p2', expires_at=10.0)
+        self.assertEqual((event['type'], event['target_participant_id']), ('voice_translation', 'p2'))
+        self.assertEqual(json.loads(event['text']), {'type': 'voice_translation', 'translated_text': 'Hola'})
+
+    def test_compact_form_round_trips(self):
+        payload = {'type': 'participants_list', 'participants': [{'id': 'p1', 'name': 'Ann', 'language': 'en'}]}
+        packed = encode_payload(payload, PROTOCOL_MSGPACK)
+        self.assertEqual(msgpack.unpackb(packed), {'t': 'pls', 'ps': [{'i': 'p1', 'n': 'Ann', 'l': 'en'}]})
+        self.assertEqual(decode_message(packed), payload)
+        # Unknown names pass through, and values neither format knows are sent as strings
+        message_id = uuid.uuid4()
+        self.assertEqual(expand(compact({'custom': message_id})), {'custom': message_id})
+        self.assertEqual(decode_message(encode_payload({'id': message_id}, PROTOCOL_MSGPACK)), {'id': str(message_id)})
+
+    def test_same_language_listener_gets_the_text_once(self):
+        payload = {'type': 'voice_translation', 'original_text': 'Hola', 'translated_text': 'Hola'}
+        self.assertEqual(compact(payload), {'t': 'vt', 'tt': 'Hola'})
+
+    def forwarded(self, protocol, *events):
+        consumer = ConferenceConsumer()
+        consumer.participant = SimpleNamespace(participant_id='p2')
+        consumer.protocol = protocol
+        frames = []
+        consumer.outbound = SimpleNamespace(put=lambda frame, priority, key: frames.append((frame, priority)))
+
+        async def main():
+            for event in events:
+                await getattr(consumer, event['type'])(event)
+        asyncio.run(main())
+        return frames
+
+    def test_consumer_forwards_the_encoded_frame(self):
+        payload = {'type': 'voice_translation', 'translated_text': 'Hola'}
+        event = envelope('voice_translation', payload, target_participant_id='p2')
+        self.assertEqual(self.forwarded(PROTOCOL_JSON, event), [(event['text'], PRIORITY_TRANSLATION)])
+        [(frame, _)] = self.forwarded(PROTOCOL_MSGPACK, event)
+        self.assertEqual(decode_message(frame), payload)
+
+    def test_translation_only_reaches_its_target_in_time(self):
+        payload = {'type': 'voice_translation', 'translated_text': 'Hola'}
+        other = envelope('voice_translation', payload, target_participant_id='p3')
+        expired = envelope('voice_translation', payload, target_participant_id='p2', expires_at=time.time() - 1)
+        self.assertEqual(self.forwarded(PROTOCOL_JSON, other, expired), [])
+
+
+class DatabaseWriterTests(TestCase):
+    def test_failing_write_only_rolls_back_itself(self):
+        room = ConferenceRoom.objects.create(room_id='writer', room_name='Writer')
+
+        def add(name):
+            return Participant.objects.create(name=name, room=room).name
+
+        loop = asyncio.new_event_loop()
+        try:
+            batch = [(add, (name,), {}, loop, loop.create_future()) for name in ['Ann', 'Ann', 'Bob']]
+            writer = DatabaseWriter()
+            writer._execute(batch)
+            results = loop.run_until_complete(
+                asyncio.gather(*(future for *_, future in batch), return_exceptions=True)
+            )
+        finally:
+            loop.close()
+
+        self.assertEqual(results[0], 'Ann')
+        self.assertIsInstance(results[1], IntegrityError)
+        self.assertEqual(results[2], 'Bob')
+        self.assertEqual(sorted(room.participants.values_list('name', flat=True)), ['Ann', 'Bob'])
+        self.assertEqual(writer.stats, {'writes': 3, 'batches': 1, 'failed': 1})
+
+
+class DatabaseWriterThreadTests(TransactionTestCase):
+    def test_writes_queued_behind_a_batch_share_the_next_one(self):
+        room = ConferenceRoom.objects.create(room_id='batched', room_name='Batched')
+        busy, release = threading.Event(), threading.Event()
+
+        def add(name):
+            if name == 'first':
+                busy.set()
+                release.wait(5)
+            return Participant.objects.create(name=name, room=room).name
+
+        async def main():
+            writer = DatabaseWriter()
+            first = writer.submit(add, 'first')
+            await asyncio.get_running_loop().run_in_executor(None, busy.wait, 5)
+            rest = [writer.submit(add, name) for name in ['Ann', 'Bob', 'Cy']]
+            release.set()
+            return await asyncio.gather(first, *rest), writer.stats
+        results, stats = asyncio.run(main())
+
+        self.assertEqual(results, ['first', 'Ann', 'Bob', 'Cy'])
+        self.assertEqual(stats, {'writes': 4, 'batches': 2, 'failed': 0})
+        self.assertEqual(room.participants.count(), 4)
+
+    def test_decorated_write_runs_on_the_writer_thread(self):
+        @database_write
+        def thread_name():
+            return threading.current_thread().name
+
+        with self.settings(DATABASE_SINGLE_WRITER=True):
+            self.assertEqual(asyncio.run(thread_name()), 'db-writer')
+        with self.settings(DATABASE_SINGLE_WRITER=False):
+            self.assertNotEqual(asyncio.run(thread_name()), 'db-writer')
+
+
+class RecordingTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def record_session(self):
+        recorder = SessionRecorder('room', self.directory.name)
+        recording._recorders['room'] = recorder
+        connection = recorder.opened()
+        for i in range(50):
+            recorder.received(connection, text_data=f'frame {i}')
+        return recorder
+
+    def test_stop_recording_writes_open_sessions_out(self):
+        recorder = self.record_session()
+        stop_recording()
+        records = list(read_archive(recorder.path))
+        self.assertEqual([r['k'] for r in records[:2]], ['session', 'open'])
+        self.assertEqual(len(records), 52)
+
+    def test_truncated_archive_reads_up_to_the_cut(self):
+        recorder = self.record_session()
+        stop_recording()
+        with open(recorder.path, 'rb') as archive:
+            data = archive.read()
+        truncated = os.path.join(self.directory.name, 'truncated.session.gz')
+        with open(truncated, 'wb') as archive:
+            archive.write(data[:-12])
+        records = list(read_archive(truncated))
+        self.assertEqual(records[0]['k'], 'session')
+        self.assertGreater(len(records), 40)
+        self.assertLessEqual(len(records), 52)
+
+
+class UnixSocketLayerTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, 'channels.sock')
+
+    def run_with_broker(self, test, **options):
+        async def main():
+            broker = ChannelBroker(self.path, **options)
+            server = asyncio.ensure_future(broker.serve())
+            while not os.path.exists(self.path):
+                await asyncio.sleep(0.01)
+            # Two layers stand in for two worker processes
+            layers = [UnixSocketChannelLayer(self.path, **options) for _ in range(2)]
+            try:
+                await test(broker, *layers)
+            finally:
+                for layer in layers:
+                    await layer.close()
+                # Let the broker see the connections close before it is stopped
+                await asyncio.sleep(0.05)
+                server.cancel()
+        asyncio.run(main())
+
+    def test_send_and_receive(self):
+        async def test(broker, first, second):
+            channel = await first.new_channel()
+            receiving = asyncio.ensure_future(first.receive(channel))
+            await asyncio.sleep(0.05)
+            await second.send(channel, {'type': 'hello', 'n': 1})
+            self.assertEqual(await asyncio.wait_for(receiving, 1), {'type': 'hello', 'n': 1})
+
+            # Shared channels are queued by the broker for whichever process asks
+            await first.send('jobs', {'type': 'job'})
+            self.assertEqual(await asyncio.wait_for(second.receive('jobs'), 1), {'type': 'job'})
+        self.run_with_broker(test)
+
+    def test_group_send_reaches_every_member_once(self):
+        async def test(broker, first, second):
+            channels = [await first.new_channel(), await first.new_channel(), await second.new_channel()]
+            for channel in channels:
+                await first.group_add('room', channel)
+            await second.group_discard('room', channels[1])
+            await second.group_send('room', {'type': 'chat'})
+
+            layers = {channels[0]: first, channels[2]: second}
+            for channel, layer in layers.items():
+                self.assertEqual(await asyncio.wait_for(layer.receive(channel), 1), {'type': 'chat'})
+            self.assertNotIn(channels[1], first._queues)
+            self.assertEqual(broker.stats['delivered'], 2)
+        self.run_with_broker(test)
+
+    def test_shared_channel_full(self):
+        async def test(broker, first, second):
+            await first.send('jobs', {'type': 'job'})
+            with self.assertRaises(ChannelFull):
+                await first.send('jobs', {'type': 'job'})
+        self.run_with_broker(test, capacity=1)
+
+    def test_bad_frame_is_dropped_without_closing_the_connection(self):
+        async def test(broker, first, second):
+            reader, writer = await asyncio.open_unix_connection(self.path)
+            writer.write(encode_frame({'op': 'send', 'id': 1}))
+            writer.write(encode_frame(['not', 'a', 'map']))
+            writer.write(encode_frame({'op': 'stats', 'id': 2}))
+            replies = [await asyncio.wait_for(read_frame(reader), 1) for _ in range(2)]
+            writer.close()
+            self.assertTrue(replies[0]['error'].startswith('bad frame'))
+            self.assertEqual(replies[1]['id'], 2)
+            self.assertEqual(replies[1]['result']['bad_frames'], 2)
+        self.run_with_broker(test)
+
+    def test_queues_of_gone_channels_are_swept(self):
+        async def test(broker, first, second):
+            channel = await first.new_channel()
+            await first.group_add('room', channel)
+            await second.group_send('room', {'type': 'chat'})
+            await asyncio.sleep(0.05)
+            self.assertIn(channel, first._queues)
+
+            first._sweep(time.time() + first.expiry + 1)
+            self.assertNotIn(channel, first._queues)
+        self.run_with_broker(test)
+
+
+class AffinityRouterTests(SimpleTestCase):
+    def test_client_proxy_headers_are_stripped(self):
+        headers = (
+            b'Host: example.com\r\nX-Forwarded-For: 10.0.0.1\r\nx-forwarded-port: 1\r\n'
+            b'X-Forwarded-Proto:https\r\nUpgrade: websocket\r\n\r\n'
+        )
+        self.assertEqual(strip_proxy_headers(headers), b'Host: example.com\r\nUpgrade: websocket\r\n\r\n')
+
+
+class RetentionTests(TestCase):
+    def setUp(self):
+        old = timezone.now() - timedelta(days=60)
+        room = ConferenceRoom.objects.create(room_id='old', room_name='Old')
+        speaker = Participant.objects.create(name='Ann', room=room, is_online=False)
+        VoiceMessage.objects.create(room=room, speaker=speaker, original_text='hello', detected_language='en')
+        # An active room in which only the messages have expired
+        kept = ConferenceRoom.objects.create(room_id='kept', room_name='Kept')
+        Participant.objects.create(name='Bob', room=kept)
+        VoiceMessage.objects.create(
+            room=kept, speaker=Participant.objects.create(name='Cy', room=kept, is_online=False),
+            original_text='hi', detected_language='en'
+        )
+        ConferenceRoom.objects.update(created_at=old)
+        Participant.objects.update(last_activity=old)
+        VoiceMessage.objects.update(timestamp=old)
+
+    def test_dry_run_counts_what_the_cascade_deletes(self):
+        options = dict(orphans=False, vacuum=False)
+        expected = {'voice_messages': 2, 'participants': 2, 'rooms': 1}
+        self.assertEqual(apply_retention(dry_run=True, **options)['deleted'], expected)
+        self.assertEqual(VoiceMessage.objects.count(), 2)
+        self.assertEqual(apply_retention(**options)['deleted'], expected)
+        self.assertEqual(list(ConferenceRoom.objects.values_list('room_id', flat=True)), ['kept'])
+
+
+class LifespanTests(SimpleTestCase):
+    def setUp(self):
+        self.ran = []
+        steps, report = lifespan.STARTUP_STEPS, dict(lifespan.startup_report)
+        self.addCleanup(setattr, lifespan, 'STARTUP_STEPS', steps)
+        self.addCleanup(lifespan.startup_report.update, report)
+        lifespan.startup_report.update({'complete': False, 'steps': {}})
+
+        async def warm():
+            self.ran.append('warm')
+
+        async def broken():
+            raise RuntimeError('no network')
+        lifespan.STARTUP_STEPS = [('broken', broken), ('warm', warm)]
+
+    def test_startup_times_steps_and_survives_failures(self):
+        steps = asyncio.run(lifespan.startup(background_preload=False))
+        self.assertEqual(self.ran, ['warm'])
+        self.assertEqual(set(steps), {'broken', 'warm', 'preload'})
+        self.assertTrue(lifespan.startup_report['complete'])
+
+    def test_skipped_steps_not_run(self):
+        steps = asyncio.run(lifespan.startup(skip={'warm', 'preload'}))
+        self.assertEqual(self.ran, [])
+        self.assertIn('broken', steps)
+        self.assertNotIn('warm', steps)
+
+    def test_lifespan_protocol(self):
+        messages = [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message['type'])
+
+        async def app(scope, receive, send):
+            raise AssertionError('lifespan scopes are not passed on')
+
+        asyncio.run(lifespan.LifespanMiddleware(app)({'type': 'lifespan'}, receive, send))
+        self.assertEqual(sent, ['lifespan.startup.complete', 'lifespan.shutdown.complete'])
+        self.assertEqual(self.ran, ['warm'])
+
+    def test_first_connection_starts_up_without_lifespan(self):
+        scopes = []
+
+        async def app(scope, receive, send):
+            scopes.append(scope['type'])
+
+        async def main():
+            middleware = lifespan.LifespanMiddleware(app)
+            await middleware({'type': 'websocket'}, None, None)
+            await middleware({'type': 'http'}, None, None)
+            await middleware._startup
+        asyncio.run(main())
+        self.assertEqual(scopes, ['websocket', 'http'])
+        # Once per worker, however many connections arrive
+        self.assertEqual(self.ran, ['warm'])
+
+
+class HotPathBenchmarkTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def run_benchmark(self, **options):
+        out = StringIO()
+        call_command('benchmark_hot_paths', clip_seconds='1', room_sizes='3', only='base64_decode[wav',
+                     repeat=1, stdout=out, **options)
+        return out.getvalue()
+
+    def test_cases_cover_every_payload_and_room(self):
+        names = [name for name, _, _ in BenchmarkHotPaths().cases([1.0], [3])]
+        for name in ['base64_decode[wav,1s]', 'json_loads[opus,1s]', 'native_convert[wav,1s]',
+                     'multipart_body[wav16k,1s]', 'fanout_json_dumps[3,1s]', 'fanout_envelope[3,1s]']:
+            self.assertIn(name, names)
+
+    def write_baseline(self, path, report, factor):
+        cases = {name: {**case, 'min_us': case['min_us'] * factor} for name, case in report['cases'].items()}
+        with open(path, 'w') as report_file:
+            json.dump({**report, 'cases': cases}, report_file)
+
+    def test_saved_results_compared_with_baseline(self):
+        path = os.path.join(self.directory.name, 'results.json')
+        self.run_benchmark(save=path)
+        with open(path) as report_file:
+            report = json.load(report_file)
+        self.assertEqual(list(report['cases']), ['base64_decode[wav,1s]'])
+
+        baseline = os.path.join(self.directory.name, 'baseline.json')
+        self.write_baseline(baseline, report, 1000.0)
+        self.assertIn('faster', self.run_benchmark(baseline=baseline, check=True))
+        self.write_baseline(baseline, report, 0.001)
+        with self.assertRaisesRegex(CommandError, 'slower than the baseline'):
+            self.run_benchmark(baseline=baseline, check=True)
@@ -0,0 +1,151 @@
+"""
+httpx transports for session recording and replay (see chat.recording).
+
+Imported only when recording is enabled or a session is replayed, so httpx
+stays off the worker's startup path.
+"""
+import asyncio
+import time
+from collections import defaultdict, deque
+
+import httpx
+
+from .recording import current_recorder, current_utterance, endpoint_of, fingerprint
+
+
+def request_fingerprint(request):
+    if 'json' not in request.headers.get('content-type', ''):
+        return None
+    return fingerprint(request.content)
+
+
+class RecordingTransport(httpx.AsyncBaseTransport):
+    """Passes requests to the network and records each response with the room it was made for"""
+
+    def __init__(self, transport):
+        self.transport = transport
+
+    async def handle_async_request(self, request):
+        recorder = current_recorder.get()
+        if recorder is None:
+            return await self.transport.handle_async_request(request)
+
+        record = {
+            'e': endpoint_of(request.url.path),
+            'u': current_utterance.get(),
+            'f': request_fingerprint(request),
+        }
+        started = time.perf_counter()
+        try:
+            response = await self.transport.handle_async_request(request)
+            body = await response.aread()
+        except Exception as e:
+            record.update(x=type(e).__name__, ms=round((time.perf_counter() - started) * 1000.0, 1))
+            recorder.upstream(record)
+            raise
+        record.update(
+            s=response.status_code,
+            h=response.headers.get('content-type', ''),
+            b=body,
+            ms=round((time.perf_counter() - started) * 1000.0, 1)
+        )
+        recorder.upstream(record)
+        # The body is already decoded, so hand it back without transfer headers
+        headers = [(name, value) for name, value in response.headers.items()
+                   if name.lower() not in ('content-encoding', 'content-length', 'transfer-encoding')]
+        return httpx.Response(response.status_code, headers=headers, content=body,
+                              extensions=response.extensions)
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+class _Responses:
+    """Recorded responses for one key, handed out in order; the last repeats once used up"""
+
+    def __init__(self):
+        self.items = deque()
+        self.last = None
+
+    def take(self, used):
+        # A record sits under several keys; whichever key hands it out first uses it up
+        while self.items:
+            record = self.items.popleft()
+            if id(record) not in used:
+                used.add(id(record))
+                self.last = record
+                return record, False
+        return self.last, True
+
+
+class ReplayTransport(httpx.AsyncBaseTransport):
+    """Local stand-in for the upstream API that answers from a recorded session.
+
+    A request gets the recorded response with the same fingerprint
+    (completion messages), else the next one recorded for its utterance and
+    endpoint, else the next unattributed one for its endpoint. Requests the
+    recording has no answer for (a partial clip that was superseded before
+    its transcription returned, say) borrow a response of the same endpoint
+    without using it up. Each response is delayed by its recorded latency
+    times `latency_scale`.
+    """
+
+    def __init__(self, records, latency_scale=1.0):
+        self.latency_scale = latency_scale
+        self.by_fingerprint = defaultdict(_Responses)
+        self.by_utterance = defaultdict(_Responses)
+        self.unattributed = defaultdict(_Responses)
+        self.by_endpoint = defaultdict(list)
+        self.used = set()
+        for record in records:
+            if record.get('f'):
+                self.by_fingerprint[record['f']].items.append(record)
+            if record.get('u'):
+                self.by_utterance[(record['e'], record['u'])].items.append(record)
+            if not record.get('f') and not record.get('u'):
+                self.unattributed[record['e']].items.append(record)
+            self.by_endpoint[record['e']].append(record)
+        self.stats = {'requests': 0, 'exact': 0, 'utterance': 0, 'endpoint': 0, 'reused': 0,
+                      'borrowed': 0, 'missing': 0}
+
+    def match(self, request):
+        endpoint = endpoint_of(request.url.path)
+        candidates = [
+            ('exact', self.by_fingerprint.get(request_fingerprint(request))),
+            ('utterance', self.by_utterance.get((endpoint, current_utterance.get()))),
+            ('endpoint', self.unattributed.get(endpoint)),
+        ]
+        for how, responses in candidates:
+            if responses is None:
+                continue
+            record, reused = responses.take(self.used)
+            if record is not None:
+                self.stats['reused' if reused else how] += 1
+                return record
+
+        recorded = self.by_endpoint.get(endpoint)
+        if not recorded:
+            self.stats['missing'] += 1
+            return None
+        self.stats['borrowed'] += 1
+        return recorded[self.stats['borrowed'] % len(recorded)]
+
+    async def handle_async_request(self, request):
+        if request.method == 'GET':
+            # Connection pre-warming
+            return httpx.Response(200, json={'data': []})
+        self.stats['requests'] += 1
+
+        record = self.match(request)
+        if record is None:
+            return httpx.Response(503, json={'error': 'no recorded response'})
+
+        if record.get('ms') and self.latency_scale:
+            await asyncio.sleep(record['ms'] * self.latency_scale / 1000.0)
+        if record.get('x'):
+            error = getattr(httpx, record['x'], None)
+            if not (isinstance(error, type) and issubclass(error, httpx.TransportError)):
+                error = httpx.TransportError
+            raise error(f"recorded {record['x']}", request=request)
+        return httpx.Response(record['s'], headers={'content-type': record.get('h') or 'application/json'},
+                              content=record['b'])
@@ -5,7 +5,10 @@ app_name = 'chat'
 
 urlpatterns = [
     path('health/', views.health_check, name='health-check'),
+    path('ready/', views.readiness_check, name='readiness'),
     path('rooms/', views.list_rooms, name='list-rooms'),
     path('rooms/create/', views.create_room, name='create-room'),
     path('rooms/<str:room_id>/participants/', views.room_participants, name='room-participants'),
+    path('rooms/<str:room_id>/history/', views.room_history, name='room-history'),
+    path('sockets/', views.socket_stats, name='socket-stats'),
 ]
@@ -1,9 +1,13 @@
 from rest_framework import generics, status
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
+from django.http import JsonResponse
 from django.shortcuts import get_object_or_404
 
 from .models import ConferenceRoom, Participant, VoiceMessage
+from .history import InvalidHistoryQuery, get_history_page
+from .outbound import outbound_snapshot
+from .readiness import readiness
 
 
 @api_view(['GET'])
@@ -15,6 +19,16 @@ def health_check(request):
     })
 
 
+async def readiness_check(request):
+    """Readiness for load balancers: 200 while this worker can take new conferences, else 503.
+
+    A plain async view rather than DRF's sync api_view, so it runs on the event
+    loop it reports on instead of queueing behind database calls for a thread.
+    """
+    ready, report = readiness()
+    return JsonResponse(report, status=200 if ready else 503)
+
+
 @api_view(['GET'])
 def list_rooms(request):
     """List all active conference rooms"""
@@ -89,3 +103,42 @@ def room_participants(request, room_id):
             {'error': str(e)},
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
+
+
+@api_view(['GET'])
+def room_history(request, room_id):
+    """Get a page of a room's transcript, newest first"""
+    get_object_or_404(ConferenceRoom, room_id=room_id)
+    try:
+        page = get_history_page(
+            room_id,
+            cursor=request.query_params.get('cursor'),
+            limit=request.query_params.get('limit'),
+            language=request.query_params.get('language')
+        )
+        
+        return Response({
+            'room_id': room_id,
+            **page
+        })
+        
+    except InvalidHistoryQuery as e:
+        return Response(
+            {'error': str(e)},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    except Exception as e:
+        return Response(
+            {'error': str(e)},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+
+@api_view(['GET'])
+def socket_stats(request):
+    """Outbound queue depth and send lag of each WebSocket open on this worker"""
+    sockets = outbound_snapshot()
+    return Response({
+        'count': len(sockets),
+        'sockets': sorted(sockets, key=lambda s: s['lag_ms_max'] or 0, reverse=True)
+    })
@@ -15,11 +15,23 @@ import chat.routing
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'voice_backend.settings')
 
-application = ProtocolTypeRouter({
+from django.conf import settings
+from .backpressure import enable_write_buffer_extension
+from .compression import enable_permessage_deflate
+from .lifespan import LifespanMiddleware
+
+# Other servers negotiate permessage-deflate themselves (uvicorn: --ws-per-message-deflate)
+if getattr(settings, 'WEBSOCKET_PERMESSAGE_DEFLATE', False) and getattr(settings, 'ASGI_SERVER', 'daphne') == 'daphne':
+    enable_permessage_deflate()
+# Lets the outbound queues see a slow client's socket buffer fill up
+if getattr(settings, 'WEBSOCKET_BACKPRESSURE', True) and getattr(settings, 'ASGI_SERVER', 'daphne') == 'daphne':
+    enable_write_buffer_extension()
+
+application = LifespanMiddleware(ProtocolTypeRouter({
     "http": get_asgi_application(),
     "websocket": AuthMiddlewareStack(
         URLRouter(
             chat.routing.websocket_urlpatterns
         )
     ),
-})
+}))
@@ -0,0 +1,72 @@
+"""
+Socket write-buffer size for WebSocket consumers under Daphne.
+
+An ASGI send returns once Daphne has handed the frame to Twisted, so a
+client on a slow link backs up in the transport's write buffer where the
+application cannot see it. When enabled, each WebSocket scope gets a
+``write_buffer`` extension whose ``size()`` returns the bytes still waiting
+in that buffer; the outbound queue stops sending while it is over the
+high-water mark, so the backlog builds up in the queue, where it can be
+coalesced, dropped or disconnected.
+
+Like voice_backend/compression.py this relies on Daphne internals
+(``Server.create_application``) and is only applied to the pinned release.
+"""
+from functools import partial
+
+from .compression import PATCHED_DAPHNE_VERSIONS
+
+WRITE_BUFFER_EXTENSION = 'write_buffer'
+
+
+def buffered_bytes(transport):
+    """Bytes a Twisted transport has accepted but not yet written to the socket"""
+    size = 0
+    # The WebSocket protocol's transport, and under TLS the TCP transport below it
+    for _ in range(3):
+        if transport is None:
+            break
+        # twisted.internet.abstract.FileDescriptor
+        data = getattr(transport, 'dataBuffer', None)
+        if data is not None:
+            size += len(data) - getattr(transport, 'offset', 0) + getattr(transport, '_tempDataLen', 0)
+        # TLSMemoryBIOProtocol holds plaintext until the handshake is done, then writes to the TCP transport
+        pending = getattr(transport, '_appSendBuffer', None)
+        if pending:
+            size += sum(len(chunk) for chunk in pending)
+        transport = getattr(transport, 'transport', None)
+    return size
+
+
+def protocol_buffer_size(protocol):
+    return buffered_bytes(getattr(protocol, 'transport', None))
+
+
+def write_buffer_extension(scope):
+    """The write_buffer extension of a WebSocket scope, or None if the server does not provide it"""
+    return (scope.get('extensions') or {}).get(WRITE_BUFFER_EXTENSION)
+
+
+def enable_write_buffer_extension():
+    try:
+        import daphne
+        from daphne.server import Server
+    except ImportError:
+        return False
+    if not daphne.__version__.startswith(PATCHED_DAPHNE_VERSIONS):
+        print(f"[STARTUP] Socket backpressure not enabled: untested Daphne {daphne.__version__}")
+        return False
+
+    create_application = Server.create_application
+    if getattr(create_application, 'write_buffer_enabled', False):
+        return True
+
+    def create_application_with_buffer(self, protocol, scope):
+        if scope.get('type') == 'websocket':
+            extensions = scope.setdefault('extensions', {})
+            extensions[WRITE_BUFFER_EXTENSION] = {'size': partial(protocol_buffer_size, protocol)}
+        return create_application(self, protocol, scope)
+
+    create_application_with_buffer.write_buffer_enabled = True
+    Server.create_application = create_application_with_buffer
+    return True
@@ -0,0 +1,41 @@
+"""
+permessage-deflate for Daphne WebSockets.
+
+Daphne does not expose autobahn's compression options, so when enabled the
+option is injected into its WebSocket factory before the server starts. Only
+clients that offer the extension (all current browsers) are affected.
+
+The patch relies on Daphne internals (``WebSocketFactory.setProtocolOptions``),
+so it is only applied to the Daphne release pinned in requirements.txt.
+"""
+PATCHED_DAPHNE_VERSIONS = ('4.2',)
+
+
+def enable_permessage_deflate():
+    try:
+        import daphne
+        from autobahn.websocket.compress import PerMessageDeflateOffer, PerMessageDeflateOfferAccept
+        from daphne.ws_protocol import WebSocketFactory
+    except ImportError:
+        return False
+    if not daphne.__version__.startswith(PATCHED_DAPHNE_VERSIONS):
+        print(f"[STARTUP] permessage-deflate not enabled: untested Daphne {daphne.__version__}")
+        return False
+
+    def accept(offers):
+        for offer in offers:
+            if isinstance(offer, PerMessageDeflateOffer):
+                return PerMessageDeflateOfferAccept(offer)
+        return None
+
+    set_protocol_options = WebSocketFactory.setProtocolOptions
+    if getattr(set_protocol_options, 'deflate_enabled', False):
+        return True
+
+    def setProtocolOptions(self, *args, **kwargs):
+        kwargs.setdefault('perMessageCompressionAccept', accept)
+        return set_protocol_options(self, *args, **kwargs)
+
+    setProtocolOptions.deflate_enabled = True
+    WebSocketFactory.setProtocolOptions = setProtocolOptions
+    return True
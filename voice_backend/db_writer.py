@@ -0,0 +1,131 @@
+"""
+Single-writer database access for SQLite.
+
+SQLite allows one writer at a time; concurrent writes from many consumers
+otherwise queue on the database lock (or fail with ``database is locked``).
+Writes decorated with ``database_write`` are handed to one dedicated thread,
+which drains whatever is queued into a single transaction, each write in its
+own savepoint so a failing write only rolls back itself. Callers get their
+result once the batch has committed. Reads decorated with ``database_read``
+run on the executor thread pool in parallel, which WAL mode allows while a
+write is in progress.
+
+With ``DATABASE_SINGLE_WRITER`` off, both decorators behave like channels'
+``database_sync_to_async``.
+"""
+import asyncio
+import functools
+import queue
+import threading
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import connection, transaction
+
+from voice_translator.metrics import metrics
+
+
+class DatabaseWriter:
+    def __init__(self, batch_size=64):
+        self.batch_size = batch_size
+        self._jobs = queue.SimpleQueue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.stats = {'writes': 0, 'batches': 0, 'failed': 0}
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+                self._thread.start()
+
+    def submit(self, func, *args, **kwargs):
+        """Queue a write; returns a future resolved on the caller's loop once it has committed"""
+        self._ensure_started()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._jobs.put((func, args, kwargs, loop, future))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._jobs.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._jobs.get_nowait())
+                except queue.Empty:
+                    break
+            self._execute(batch)
+
+    def _execute(self, batch):
+        outcomes = []
+        # A lone write needs no savepoint of its own
+        savepoint = len(batch) > 1
+        try:
+            with transaction.atomic():
+                for func, args, kwargs, _, _ in batch:
+                    try:
+                        with transaction.atomic(savepoint=savepoint):
+                            outcomes.append((True, func(*args, **kwargs)))
+                    except Exception as e:
+                        outcomes.append((False, e))
+        except Exception as e:
+            # The commit itself failed: nothing in the batch was written
+            print(f"[ERROR] Database writer batch of {len(batch)} failed: {e}")
+            outcomes = [(False, e)] * len(batch)
+            connection.close()
+
+        failed = sum(1 for ok, _ in outcomes if not ok)
+        self.stats['writes'] += len(batch)
+        self.stats['batches'] += 1
+        self.stats['failed'] += failed
+        metrics.observe('db_write_batch_size', len(batch))
+
+        for (ok, value), (_, _, _, loop, future) in zip(outcomes, batch):
+            try:
+                loop.call_soon_threadsafe(_resolve, future, ok, value)
+            except RuntimeError:
+                # The caller's loop has shut down
+                pass
+
+
+def _resolve(future, ok, value):
+    if future.cancelled():
+        return
+    if ok:
+        future.set_result(value)
+    else:
+        future.set_exception(value)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    """Process-wide database writer"""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = DatabaseWriter(batch_size=getattr(settings, 'DATABASE_WRITER_BATCH_SIZE', 64))
+        return _writer
+
+
+def database_write(func):
+    """Like database_sync_to_async, but runs the call on the single writer thread"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        if not getattr(settings, 'DATABASE_SINGLE_WRITER', False):
+            return await database_sync_to_async(func)(*args, **kwargs)
+        return await get_writer().submit(func, *args, **kwargs)
+    return wrapper
+
+
+def database_read(func):
+    """Like database_sync_to_async, but lets reads run in parallel on the thread pool"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        # Read per call, like database_write, so both follow the same setting
+        thread_sensitive = not getattr(settings, 'DATABASE_SINGLE_WRITER', False)
+        return await database_sync_to_async(func, thread_sensitive=thread_sensitive)(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,156 @@
+"""
+Worker startup and shutdown.
+
+Servers that speak the ASGI lifespan protocol (uvicorn, hypercorn) run
+`startup()` before accepting connections and `shutdown()` on exit. Daphne
+does not send lifespan events, so there the same startup runs in the
+background as soon as the first connection arrives.
+
+Startup starts the event-loop lag monitor used by the readiness check and
+the presence heartbeat that expires participants left online by a crashed
+worker, resolves ffmpeg once and pre-spawns the decoder processes, opens
+keep-alive connections to the transcription/translation API so the first
+utterance skips the TLS handshake, and loads the language registry. Heavy
+modules that are only needed later (numpy, pydub, the HTTP URLconf with
+DRF) are then imported on a background thread, off the path to readiness.
+"""
+import asyncio
+import importlib
+import threading
+import time
+
+from django.conf import settings
+
+# Filled in as startup runs: step -> milliseconds, and whether it has finished
+startup_report = {'complete': False, 'steps': {}}
+
+PRELOAD_MODULES = ['numpy', 'pydub']
+
+
+async def load_languages():
+    from voice_translator.languages import languages
+    return len(list(languages))
+
+
+async def check_ffmpeg():
+    from voice_translator.ffmpeg_pool import ffmpeg_path, get_decoder_pool
+
+    binary = getattr(settings, 'FFMPEG_BINARY', 'ffmpeg')
+    if ffmpeg_path(binary) is None:
+        print(f"[STARTUP] {binary} not found in PATH; only WAV and raw PCM audio can be decoded")
+        return
+    pool = get_decoder_pool()
+    if pool is not None:
+        pool.health_check()
+
+
+async def prewarm_upstream():
+    from voice_translator.services import VoiceTranslationService
+    from voice_translator.upstream import prewarm_upstream as open_connections
+
+    service = VoiceTranslationService()
+    connections = getattr(settings, 'UPSTREAM_PREWARM_CONNECTIONS', 2)
+    if connections <= 0 or not service.groq_api_key:
+        return
+    await open_connections(
+        f'{service.groq_base_url}/models',
+        headers={'Authorization': f'Bearer {service.groq_api_key}'},
+        connections=connections,
+        timeout=getattr(settings, 'UPSTREAM_PREWARM_TIMEOUT', 5.0)
+    )
+
+
+async def start_loop_monitor():
+    from chat.readiness import loop_monitor
+    loop_monitor.start()
+
+
+async def start_presence_heartbeat():
+    from chat.admission import presence_heartbeat
+    presence_heartbeat.start()
+
+
+STARTUP_STEPS = [
+    ('loop_monitor', start_loop_monitor),
+    ('presence', start_presence_heartbeat),
+    ('languages', load_languages),
+    ('ffmpeg', check_ffmpeg),
+    ('upstream', prewarm_upstream),
+]
+
+
+def preload():
+    """Import what the first utterance and the first HTTP request would otherwise pay for"""
+    from django.urls import get_resolver
+
+    started = time.perf_counter()
+    for name in PRELOAD_MODULES:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            pass
+    get_resolver().url_patterns
+    startup_report['steps']['preload'] = round((time.perf_counter() - started) * 1000.0, 1)
+
+
+async def startup(skip=(), background_preload=True):
+    """Run the startup steps; returns {step: ms}"""
+    for name, step in STARTUP_STEPS:
+        if name in skip:
+            continue
+        started = time.perf_counter()
+        try:
+            await step()
+        except Exception as e:
+            print(f"[STARTUP] {name} failed: {e}")
+        startup_report['steps'][name] = round((time.perf_counter() - started) * 1000.0, 1)
+
+    if 'preload' not in skip:
+        if background_preload:
+            threading.Thread(target=preload, name='startup-preload', daemon=True).start()
+        else:
+            preload()
+    startup_report['complete'] = True
+    print(f"[STARTUP] Worker ready: {startup_report['steps']}")
+    return dict(startup_report['steps'])
+
+
+async def shutdown():
+    from chat.recording import stop_recording
+    from voice_translator.upstream import close_upstream_client
+    await close_upstream_client()
+    # Close the archives of rooms still open, off the event loop
+    await asyncio.get_running_loop().run_in_executor(None, stop_recording)
+
+
+class LifespanMiddleware:
+    """Handles lifespan scopes itself and passes everything else to `app`"""
+
+    def __init__(self, app):
+        self.app = app
+        self._startup = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if self._startup is None:
+            # No lifespan events (Daphne): warm up alongside the first connection
+            self._startup = asyncio.ensure_future(startup())
+        await self.app(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self._startup = asyncio.ensure_future(startup())
+                try:
+                    await self._startup
+                except Exception as e:
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
@@ -12,7 +12,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 import os
-from decouple import config
+from decouple import Csv, config
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -32,8 +32,13 @@ ALLOWED_HOSTS = ['*']
 
 # Application definition
 
+# The 'daphne' app only makes runserver serve ASGI, but importing it loads
+# Twisted and autobahn (a third of a second). Workers started by another ASGI
+# server (uvicorn, for lifespan support) can leave it out.
+ASGI_SERVER = config('ASGI_SERVER', default='daphne')
+
 INSTALLED_APPS = [
-    'daphne',
+    *(['daphne'] if ASGI_SERVER == 'daphne' else []),
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
@@ -79,11 +84,37 @@ WSGI_APPLICATION = 'voice_backend.wsgi.application'
 ASGI_APPLICATION = 'voice_backend.asgi.application'
 
 # Channels configuration
-CHANNEL_LAYERS = {
-    'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer',
-    },
-}
+# 'memory' only works with a single Daphne process. 'unix' lets several
+# processes on one host share rooms through the broker started with
+# `python manage.py run_channel_broker` (POSIX only).
+CHANNEL_LAYER_BACKEND = config('CHANNEL_LAYER_BACKEND', default='memory')
+
+if CHANNEL_LAYER_BACKEND == 'unix':
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'chat.layers.UnixSocketChannelLayer',
+            'CONFIG': {
+                'path': config('CHANNEL_BROKER_SOCKET', default='/tmp/voice_backend_channels.sock'),
+                'capacity': 100,
+                'expiry': 60,
+            },
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        },
+    }
+
+# Negotiate permessage-deflate with clients that offer it (Daphne only). Off by
+# default: it patches Daphne internals (see voice_backend/compression.py) and
+# costs CPU per frame on the worker.
+WEBSOCKET_PERMESSAGE_DEFLATE = config('WEBSOCKET_PERMESSAGE_DEFLATE', default=False, cast=bool)
+
+# Daphne workers behind `python manage.py run_affinity_router`, which sends
+# each conference room's sockets to one worker by consistent hash
+AFFINITY_WORKERS = config('AFFINITY_WORKERS', default='', cast=Csv())
 
 
 # Database
@@ -93,6 +124,23 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Keep per-thread connections (and their page cache) between calls
+        'CONN_MAX_AGE': 600,
+        'OPTIONS': {
+            # WAL lets reads proceed while a write is in progress; NORMAL sync
+            # is durable across application crashes in WAL mode
+            'init_command': (
+                'PRAGMA journal_mode=WAL;'
+                'PRAGMA synchronous=NORMAL;'
+                'PRAGMA temp_store=MEMORY;'
+                'PRAGMA cache_size=-20000;'
+                'PRAGMA mmap_size=134217728'
+            ),
+            # Take the write lock when a transaction starts, instead of failing
+            # with "database is locked" when a read transaction upgrades
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
     }
 }
 
@@ -170,3 +218,189 @@ OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY', '')
 # File upload settings
 FILE_UPLOAD_MAX_MEMORY_SIZE = 25 * 1024 * 1024  # 25MB
 DATA_UPLOAD_MAX_MEMORY_SIZE = 25 * 1024 * 1024  # 25MB
+
+# Audio decoding
+# Compressed clips (WebM/Opus from MediaRecorder) are decoded by a pool of
+# pre-spawned ffmpeg processes. Set the pool size to 0 to decode via pydub.
+FFMPEG_BINARY = 'ffmpeg'
+AUDIO_DECODER_POOL_SIZE = 2
+AUDIO_DECODER_QUEUE_LIMIT = 32
+AUDIO_DECODER_TIMEOUT = 10.0  # seconds
+
+# Codec used to upload clips to Whisper, by clip length: the first entry whose
+# max duration (seconds, None = unbounded) fits is used. Codecs: 'wav',
+# 'flac' (lossless) and 'ogg_opus' (lossy, WHISPER_OPUS_BITRATE).
+WHISPER_UPLOAD_CODECS = [
+    (5.0, 'wav'),
+    (None, 'flac'),
+]
+WHISPER_OPUS_BITRATE = '24k'
+AUDIO_ENCODER_POOL_SIZE = 1
+
+# Clips longer than CHUNKED_TRANSCRIPTION_MIN_SECONDS are split at pauses into
+# chunks of at most TRANSCRIPTION_CHUNK_MAX_SECONDS, transcribed concurrently
+CHUNKED_TRANSCRIPTION_MIN_SECONDS = 25.0
+TRANSCRIPTION_CHUNK_MAX_SECONDS = 15.0
+TRANSCRIPTION_CHUNK_MIN_SECONDS = 5.0
+TRANSCRIPTION_CHUNK_CONCURRENCY = 4
+
+# Decode, resample, silence detection and encoding run in a process pool so
+# they never block the event loop. 0 workers uses the loop's thread pool.
+AUDIO_EXECUTOR_WORKERS = 2
+AUDIO_EXECUTOR_QUEUE_LIMIT = 64
+AUDIO_EXECUTOR_TIMEOUT = 15.0  # seconds
+
+# Room transcript history: the newest ROOM_HISTORY_BUFFER_SIZE utterances of
+# each room are kept in memory; older pages are read from the database
+ROOM_HISTORY_BUFFER_SIZE = 200
+ROOM_HISTORY_MAX_ROOMS = 256
+ROOM_HISTORY_PAGE_SIZE = 50
+
+# Upstream (Groq) request concurrency per worker. Background work such as
+# catch-up translation uses at most UPSTREAM_BACKGROUND_CONCURRENCY slots and
+# only when no live request is waiting.
+UPSTREAM_CONCURRENCY = 8
+UPSTREAM_BACKGROUND_CONCURRENCY = 2
+
+# Late joiners and language switches get the last CATCHUP_TRANSLATION_LIMIT
+# utterances translated, CATCHUP_BATCH_SIZE per upstream request
+CATCHUP_TRANSLATION_LIMIT = 20
+CATCHUP_BATCH_SIZE = 8
+
+# Translation max_tokens is the estimated output length (input tokens scaled
+# by the language pair's expansion ratio) times TRANSLATION_TOKEN_HEADROOM,
+# clamped to [FLOOR, CAP]. A cut-off reply is retried once at the cap.
+TRANSLATION_TOKEN_HEADROOM = 1.5
+TRANSLATION_MAX_TOKENS_FLOOR = 16
+TRANSLATION_MAX_TOKENS_CAP = 1000
+
+# Model routing. Each list holds (model, preferred_up_to): a model is preferred
+# for requests up to that length (seconds of audio for STT, estimated input
+# tokens for translation; None = any). The first preferred, healthy model whose
+# recent (EWMA) latency for that length fits the deadline is used, falling back
+# to the fastest healthy one. Latency is tracked per length bucket.
+STT_MODELS = [
+    ('whisper-large-v3-turbo', 10.0),
+    ('whisper-large-v3', None),
+]
+STT_LATENCY_BUCKETS = [5.0, 15.0, 30.0]  # seconds
+STT_DEADLINE_MS = 4000
+TRANSLATION_MODELS = [
+    ('llama-3.1-8b-instant', None),
+]
+TRANSLATION_LATENCY_BUCKETS = [32, 128, 512]  # tokens
+TRANSLATION_DEADLINE_MS = 1500
+MODEL_ROUTER_ALPHA = 0.2
+MODEL_ROUTER_MAX_ERROR_RATE = 0.5
+MODEL_ROUTER_PROBE_INTERVAL = 30.0  # seconds before an erroring model is retried
+
+# Request hedging: a live transcription or translation still running after the
+# HEDGE_PERCENTILE latency of recent requests of its kind and length gets a
+# duplicate; the first to succeed wins and the other is cancelled. Hedges are
+# capped at HEDGE_BUDGET_RATIO of requests (bursts of up to HEDGE_BUDGET_BURST).
+HEDGING_ENABLED = True
+HEDGE_PERCENTILE = 95
+HEDGE_MIN_SAMPLES = 20
+HEDGE_MIN_DELAY_MS = 100.0
+HEDGE_BUDGET_RATIO = 0.05
+HEDGE_BUDGET_BURST = 5.0
+
+# Circuit breakers per Groq endpoint: CIRCUIT_FAILURE_THRESHOLD consecutive
+# failures (errors, timeouts, 429/5xx) open the circuit and calls fail fast;
+# after CIRCUIT_RESET_TIMEOUT seconds half-open probes test recovery. While the
+# translation circuit is open listeners get a cached translation or the
+# original text flagged as untranslated.
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_RESET_TIMEOUT = 15.0  # seconds
+CIRCUIT_HALF_OPEN_PROBES = 1
+TRANSLATION_CACHE_SIZE = 2048
+
+# Latency budget per utterance, shared by transcription and translation (and
+# used as their routers' deadline); work still running when it runs out is
+# cancelled. Translations reaching a listener more than
+# UTTERANCE_FANOUT_GRACE_MS past the budget are dropped.
+UTTERANCE_BUDGET_MS = 8000
+UTTERANCE_FANOUT_GRACE_MS = 2000
+
+# Per-socket outbound queue. When full, OUTBOUND_OVERFLOW_POLICY 'drop' drops
+# the oldest least-important frame (presence before replies before
+# translations); 'disconnect' closes the socket (code 4008) and the client
+# catches up from room history. Frames are sent in the order they were queued.
+# Under Daphne (WEBSOCKET_BACKPRESSURE) the writer holds back while more than
+# OUTBOUND_HIGH_WATER_BYTES wait in the socket's write buffer, so a slow
+# client's backlog collects in the queue and the policy above applies.
+OUTBOUND_QUEUE_SIZE = 256
+OUTBOUND_OVERFLOW_POLICY = 'drop'
+OUTBOUND_HIGH_WATER_BYTES = 256 * 1024
+WEBSOCKET_BACKPRESSURE = config('WEBSOCKET_BACKPRESSURE', default=True, cast=bool)
+
+# Admission control. Joins beyond ConferenceRoom.max_participants are
+# 'reject'ed or 'queue'd (for up to ROOM_JOIN_QUEUE_TIMEOUT seconds) until
+# someone leaves; the queue needs all of a room's sockets on one worker,
+# which the affinity router (AFFINITY_WORKERS) provides. New voice messages get an 'overloaded' reply while this
+# worker has PIPELINE_MAX_IN_FLIGHT utterances in flight or
+# UPSTREAM_MAX_WAITING live requests waiting for an upstream slot.
+ROOM_FULL_POLICY = 'queue'
+ROOM_JOIN_QUEUE_TIMEOUT = 120  # seconds
+# Each worker refreshes last_activity of its connected participants every
+# PARTICIPANT_HEARTBEAT_INTERVAL seconds; online rows not refreshed for
+# PARTICIPANT_STALE_AFTER seconds stop counting against room capacity and
+# are marked offline.
+PARTICIPANT_HEARTBEAT_INTERVAL = 60
+PARTICIPANT_STALE_AFTER = 180
+PIPELINE_MAX_IN_FLIGHT = 32
+UPSTREAM_MAX_WAITING = 16
+OVERLOAD_RETRY_AFTER_MS = 2000
+
+# Route consumer writes through one dedicated thread that commits whatever is
+# queued in a single transaction (up to DATABASE_WRITER_BATCH_SIZE writes),
+# and let reads run in parallel. Only useful for SQLite, which has a single
+# write lock anyway; with 20 consumers it is about 6% faster than WAL mode
+# alone, at the cost of one more thread and writes that commit (or fail to
+# commit) together with unrelated writes from other requests.
+DATABASE_SINGLE_WRITER = DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3'
+DATABASE_WRITER_BATCH_SIZE = 64
+
+# Retention (manage.py apply_retention). Voice messages, with their
+# translations and audio, are kept RETENTION_VOICE_MESSAGE_DAYS; offline
+# participants with no messages left are kept RETENTION_PARTICIPANT_DAYS after
+# their last activity; empty rooms RETENTION_ROOM_DAYS after creation. None
+# keeps them forever. Media files no row refers to are removed once older
+# than RETENTION_ORPHAN_GRACE_SECONDS. Each run frees up to
+# RETENTION_VACUUM_PAGES SQLite pages.
+RETENTION_VOICE_MESSAGE_DAYS = 30
+RETENTION_PARTICIPANT_DAYS = 30
+RETENTION_ROOM_DAYS = 30
+RETENTION_BATCH_SIZE = 500
+RETENTION_ORPHAN_GRACE_SECONDS = 3600
+RETENTION_VACUUM_PAGES = 2000
+
+# Worker startup (voice_backend/lifespan.py): open this many keep-alive
+# connections to the upstream API before the first utterance, waiting at most
+# UPSTREAM_PREWARM_TIMEOUT seconds. Idle pooled connections are closed after
+# UPSTREAM_KEEPALIVE_EXPIRY seconds.
+UPSTREAM_PREWARM_CONNECTIONS = 2
+UPSTREAM_PREWARM_TIMEOUT = 5.0
+UPSTREAM_KEEPALIVE_EXPIRY = 60.0
+
+# Readiness (/chat/ready/ answers 503 so the load balancer sends new
+# conferences elsewhere): while starting up, when the event loop lags more
+# than READINESS_MAX_LOOP_LAG_MS (p95 over the last ~10 s, sampled every
+# LOOP_LAG_INTERVAL_MS), at READINESS_MAX_SOCKETS open sockets, or once
+# in-flight utterances or waiting upstream requests reach
+# READINESS_LOAD_FACTOR of the limits where voice messages start being shed.
+# Open upstream circuits only count with READINESS_FAIL_ON_OPEN_CIRCUIT, as
+# every worker shares the same upstream.
+LOOP_LAG_INTERVAL_MS = 250
+READINESS_MAX_LOOP_LAG_MS = 200
+READINESS_MAX_SOCKETS = 500
+READINESS_LOAD_FACTOR = 0.8
+READINESS_FAIL_ON_OPEN_CIRCUIT = False
+
+# Session recording (replayed with manage.py replay_session): with
+# SESSION_RECORDING_DIR set, every room session's inbound WebSocket frames and
+# upstream API responses are saved there as one compressed archive, limited
+# to SESSION_RECORDING_ROOMS when that is non-empty. Archives contain the
+# participants' audio; only enable recording where that is acceptable.
+SESSION_RECORDING_DIR = config('SESSION_RECORDING_DIR', default='')
+SESSION_RECORDING_ROOMS = config('SESSION_RECORDING_ROOMS', default='', cast=Csv())
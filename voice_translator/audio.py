@@ -0,0 +1,353 @@
+import importlib
+import importlib.util
+import io
+import math
+import struct
+import wave
+from functools import lru_cache
+
+
+class LazyModule:
+    """Module imported on first attribute access, keeping it off worker startup"""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+NUMPY_AVAILABLE = importlib.util.find_spec('numpy') is not None
+PYDUB_AVAILABLE = importlib.util.find_spec('pydub') is not None
+
+np = LazyModule('numpy')
+
+
+# Whisper is fed 16 kHz mono 16-bit PCM
+TARGET_SAMPLE_RATE = 16000
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# Raw PCM layouts a client may send instead of a container:
+# name -> (sample kind, bytes per sample)
+PCM_FORMATS = {
+    'pcm_u8': ('uint', 1),
+    'pcm_s16le': ('int', 2),
+    'pcm_s24le': ('int', 3),
+    'pcm_s32le': ('int', 4),
+    'pcm_f32le': ('float', 4),
+}
+
+# Codecs accepted by the transcription endpoint: name -> (filename, MIME type)
+UPLOAD_CODECS = {
+    'wav': ('audio.wav', 'audio/wav'),
+    'flac': ('audio.flac', 'audio/flac'),
+    'ogg_opus': ('audio.ogg', 'audio/ogg'),
+}
+
+# Silence detection: frame energy is smoothed over a short window so that a
+# single quiet frame inside a word is not mistaken for a pause
+SILENCE_FRAME_MS = 30
+SILENCE_WINDOW_MS = 300
+
+# Polyphase filter design (taps per side, per unit of the larger rate factor)
+RESAMPLE_HALF_WIDTH = 10
+RESAMPLE_KAISER_BETA = 5.0
+
+
+class AudioDecodeError(Exception):
+    pass
+
+
+def is_wav(data):
+    return len(data) >= 12 and data[0:4] == b'RIFF' and data[8:12] == b'WAVE'
+
+
+def parse_wav_header(data):
+    """Parse a RIFF/WAVE header, returning its format and the PCM data location"""
+    if not is_wav(data):
+        return None
+
+    fmt = None
+    offset = 12
+    while offset + 8 <= len(data):
+        chunk_id = data[offset:offset + 4]
+        chunk_size = struct.unpack_from('<I', data, offset + 4)[0]
+        body = offset + 8
+
+        if chunk_id == b'fmt ':
+            if chunk_size < 16:
+                raise AudioDecodeError('Malformed WAV fmt chunk')
+            format_tag, channels, sample_rate, _, _, bits = struct.unpack_from('<HHIIHH', data, body)
+            if not channels or not sample_rate:
+                raise AudioDecodeError('WAV fmt chunk has no channels or no sample rate')
+            if format_tag == WAVE_FORMAT_EXTENSIBLE and chunk_size >= 40:
+                # The real format tag is the first two bytes of the SubFormat GUID
+                format_tag = struct.unpack_from('<H', data, body + 24)[0]
+            fmt = {
+                'format_tag': format_tag,
+                'channels': channels,
+                'sample_rate': sample_rate,
+                'bits_per_sample': bits,
+            }
+        elif chunk_id == b'data':
+            if fmt is None:
+                raise AudioDecodeError('WAV data chunk before fmt chunk')
+            # Streaming writers leave the size as 0 or 0xFFFFFFFF
+            available = len(data) - body
+            if chunk_size == 0 or chunk_size > available:
+                chunk_size = available
+            fmt['data_offset'] = body
+            fmt['data_size'] = chunk_size
+            return fmt
+
+        # Chunks are word aligned
+        offset = body + chunk_size + (chunk_size & 1)
+
+    raise AudioDecodeError('WAV file has no data chunk')
+
+
+def _sample_layout(fmt):
+    """Map a parsed WAV fmt chunk onto a (kind, width) sample layout"""
+    width = fmt['bits_per_sample'] // 8
+    if fmt['format_tag'] == WAVE_FORMAT_PCM and width in (1, 2, 3, 4):
+        return ('uint', 1) if width == 1 else ('int', width)
+    if fmt['format_tag'] == WAVE_FORMAT_IEEE_FLOAT and width in (4, 8):
+        return ('float', width)
+    return None
+
+
+def can_decode_natively(data, pcm_format=None):
+    """True when the clip can be converted without spawning ffmpeg"""
+    if not NUMPY_AVAILABLE:
+        return False
+    if pcm_format:
+        return pcm_format.get('format') in PCM_FORMATS
+    try:
+        fmt = parse_wav_header(data)
+    except AudioDecodeError:
+        return False
+    return fmt is not None and _sample_layout(fmt) is not None
+
+
+def decode_pcm(data, channels, kind, width):
+    """Decode interleaved little-endian PCM into a float32 (frames, channels) array"""
+    frame_size = channels * width
+    usable = len(data) - (len(data) % frame_size)
+    buffer = memoryview(data)[:usable]
+
+    if kind == 'uint':
+        samples = (np.frombuffer(buffer, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    elif kind == 'float':
+        samples = np.frombuffer(buffer, dtype='<f4' if width == 4 else '<f8').astype(np.float32)
+    elif width == 3:
+        # No native 24-bit dtype: assemble each sample from its three bytes
+        raw = np.frombuffer(buffer, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        ints = raw[:, 0] | (raw[:, 1] << 8) | (raw[:, 2] << 16)
+        ints = np.where(ints & 0x800000, ints - 0x1000000, ints)
+        samples = ints.astype(np.float32) / float(1 << 23)
+    else:
+        dtype = {2: '<i2', 4: '<i4'}[width]
+        samples = np.frombuffer(buffer, dtype=dtype).astype(np.float32) / float(1 << (8 * width - 1))
+
+    return samples.reshape(-1, channels)
+
+
+def downmix(samples):
+    """Average all channels into a single mono channel"""
+    if samples.shape[1] == 1:
+        return samples[:, 0]
+    return samples.mean(axis=1, dtype=np.float32)
+
+
+@lru_cache(maxsize=32)
+def _polyphase_filter_bank(up, down):
+    """Design a Kaiser-windowed sinc low-pass and split it into `up` phases"""
+    max_rate = max(up, down)
+    half_len = RESAMPLE_HALF_WIDTH * max_rate
+    num_taps = 2 * half_len + 1
+    cutoff = 1.0 / max_rate
+
+    t = np.arange(num_taps) - half_len
+    h = cutoff * np.sinc(cutoff * t) * np.kaiser(num_taps, RESAMPLE_KAISER_BETA)
+    h *= up / h.sum()
+
+    # Pad so every phase has the same number of taps, then reverse each phase
+    # so that a forward sliding window can be dotted with it directly
+    taps_per_phase = -(-num_taps // up)
+    padded = np.zeros(taps_per_phase * up, dtype=np.float32)
+    padded[:num_taps] = h
+    bank = padded.reshape(taps_per_phase, up).T[:, ::-1].copy()
+    return bank, half_len
+
+
+def resample_poly(x, orig_rate, target_rate):
+    """Resample a mono float signal by the rational factor target_rate / orig_rate"""
+    if orig_rate <= 0 or target_rate <= 0:
+        raise ValueError(f'Cannot resample from {orig_rate} Hz to {target_rate} Hz')
+    if orig_rate == target_rate or len(x) == 0:
+        return x.astype(np.float32, copy=False)
+
+    g = math.gcd(orig_rate, target_rate)
+    up, down = target_rate // g, orig_rate // g
+    bank, delay = _polyphase_filter_bank(up, down)
+    taps = bank.shape[1]
+
+    n_out = -(-len(x) * up // down)
+    # Pad generously on both sides so every window stays in range
+    right = delay // up + taps + 2
+    padded = np.concatenate([
+        np.zeros(taps, dtype=np.float32),
+        x.astype(np.float32, copy=False),
+        np.zeros(right, dtype=np.float32),
+    ])
+    windows = np.lib.stride_tricks.sliding_window_view(padded, taps)
+
+    # Output samples n = r + j*up all share the same filter phase, and their
+    # input windows advance by `down` samples, so each phase is one strided
+    # matrix-vector product.
+    y = np.empty(n_out, dtype=np.float32)
+    for r in range(min(up, n_out)):
+        count = -(-(n_out - r) // up)
+        a = r * down + delay
+        phase = a % up
+        start = a // up + 1
+        y[r::up] = windows[start:start + (count - 1) * down + 1:down] @ bank[phase]
+    return y
+
+
+def pcm16_to_wav(pcm_data, sample_rate):
+    """Wrap raw mono 16-bit little-endian PCM in a WAV header"""
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(pcm_data)
+    return buffer.getvalue()
+
+
+def encode_wav(samples, sample_rate):
+    """Encode a mono float signal as 16-bit PCM WAV bytes"""
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767.0).astype('<i2')
+    return pcm16_to_wav(pcm.tobytes(), sample_rate)
+
+
+def wav_duration(wav_data):
+    """Duration in seconds of a WAV clip, or None if it is not WAV"""
+    try:
+        fmt = parse_wav_header(wav_data)
+    except AudioDecodeError:
+        return None
+    if not fmt or not fmt['sample_rate'] or not fmt['channels'] or fmt['bits_per_sample'] < 8:
+        return None
+    frame_size = fmt['channels'] * (fmt['bits_per_sample'] // 8)
+    return fmt['data_size'] / float(frame_size * fmt['sample_rate'])
+
+
+def choose_upload_codec(duration, policy):
+    """Pick the upload codec for a clip from a [(max_seconds or None, codec), ...] policy"""
+    if duration is None:
+        return 'wav'
+    for max_seconds, codec in policy:
+        if max_seconds is None or duration <= max_seconds:
+            return codec
+    return 'wav'
+
+
+def decode_to_mono(data, pcm_format=None):
+    """Decode WAV or raw client PCM into (mono float32 samples, sample rate)"""
+    if pcm_format:
+        kind, width = PCM_FORMATS[pcm_format['format']]
+        try:
+            channels = int(pcm_format.get('channels', 1))
+            sample_rate = int(pcm_format['sample_rate'])
+        except (KeyError, TypeError, ValueError):
+            raise AudioDecodeError('Raw PCM needs an integer sample_rate and channels')
+        if channels < 1 or sample_rate < 1:
+            raise AudioDecodeError(f'Invalid raw PCM layout: {channels} channels at {sample_rate} Hz')
+        samples = decode_pcm(data, channels, kind, width)
+    else:
+        fmt = parse_wav_header(data)
+        layout = _sample_layout(fmt) if fmt else None
+        if layout is None:
+            raise AudioDecodeError('Unsupported WAV encoding')
+        sample_rate = fmt['sample_rate']
+        body = memoryview(data)[fmt['data_offset']:fmt['data_offset'] + fmt['data_size']]
+        samples = decode_pcm(body, fmt['channels'], *layout)
+
+    return downmix(samples), sample_rate
+
+
+def find_silence_cuts(samples, sample_rate, max_chunk_seconds, min_chunk_seconds):
+    """Sample offsets splitting a signal into chunks no longer than max_chunk_seconds.
+
+    Each cut is placed at the quietest point between min_chunk_seconds and
+    max_chunk_seconds after the previous one, which lands on a pause between
+    words whenever the speaker left one.
+    """
+    frame = max(1, sample_rate * SILENCE_FRAME_MS // 1000)
+    n_frames = len(samples) // frame
+    max_frames = max(1, int(max_chunk_seconds * 1000 / SILENCE_FRAME_MS))
+    min_frames = min(max_frames - 1, int(min_chunk_seconds * 1000 / SILENCE_FRAME_MS))
+    if n_frames <= max_frames:
+        return []
+
+    frames = samples[:n_frames * frame].reshape(n_frames, frame)
+    energy = np.sqrt(np.mean(frames * frames, axis=1))
+    width = max(1, SILENCE_WINDOW_MS // SILENCE_FRAME_MS)
+    smoothed = np.convolve(energy, np.ones(width, dtype=np.float32) / width, mode='same')
+
+    cuts = []
+    start = 0
+    while n_frames - start > max_frames:
+        low, high = start + max(min_frames, 1), start + max_frames
+        # Search backwards so ties go to the latest pause (fewer, longer chunks)
+        start = high - 1 - int(np.argmin(smoothed[low:high][::-1]))
+        cuts.append(start * frame)
+    return cuts
+
+
+def split_at_silence(wav_data, max_chunk_seconds, min_chunk_seconds):
+    """Split a WAV clip at pauses into [(offset_seconds, wav_bytes), ...]"""
+    samples, sample_rate = decode_to_mono(wav_data)
+    cuts = find_silence_cuts(samples, sample_rate, max_chunk_seconds, min_chunk_seconds)
+    if not cuts:
+        return [(0.0, wav_data)]
+
+    bounds = [0] + cuts + [len(samples)]
+    return [
+        (start / float(sample_rate), encode_wav(samples[start:end], sample_rate))
+        for start, end in zip(bounds, bounds[1:])
+    ]
+
+
+def convert_with_ffmpeg(data):
+    """Decode any container ffmpeg understands to 16 kHz mono WAV bytes"""
+    if not PYDUB_AVAILABLE:
+        raise AudioDecodeError('pydub not available - audio processing disabled')
+
+    from pydub import AudioSegment
+
+    audio_segment = AudioSegment.from_file(io.BytesIO(data))
+    audio_segment = audio_segment.set_frame_rate(TARGET_SAMPLE_RATE).set_channels(1)
+    buffer = io.BytesIO()
+    audio_segment.export(buffer, format='wav')
+    return buffer.getvalue()
+
+
+def convert_for_whisper(data, pcm_format=None):
+    """Convert a clip to 16 kHz mono WAV, only shelling out to ffmpeg for compressed formats"""
+    if can_decode_natively(data, pcm_format):
+        samples, sample_rate = decode_to_mono(data, pcm_format)
+        samples = resample_poly(samples, sample_rate, TARGET_SAMPLE_RATE)
+        return encode_wav(samples, TARGET_SAMPLE_RATE)
+
+    if pcm_format:
+        raise AudioDecodeError(f"Cannot decode raw PCM format: {pcm_format.get('format')}")
+    return convert_with_ffmpeg(data)
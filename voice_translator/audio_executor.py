@@ -0,0 +1,97 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+
+from .audio import AudioDecodeError
+
+
+class AudioExecutorBusy(AudioDecodeError):
+    pass
+
+
+class AudioExecutor:
+    """Runs CPU-bound / blocking audio functions in worker processes.
+
+    Decoding, resampling, silence detection and encoding all hold the GIL or
+    block on ffmpeg, so running them on the event loop would stall every other
+    socket on the worker. Submissions beyond `max_pending` are rejected rather
+    than queued without bound.
+    """
+
+    def __init__(self, max_workers=2, max_pending=64, timeout=15.0):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._pool = None
+        self._pending = 0
+        self.stats = {
+            'completed': 0,
+            'timed_out': 0,
+            'rejected': 0,
+            'restarted': 0,
+        }
+
+    def _get_pool(self):
+        if self.max_workers <= 0:
+            # Fall back to the loop's default thread pool
+            return None
+        if self._pool is None:
+            # spawn keeps children free of the parent's threads and sockets
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return self._pool
+
+    @property
+    def pending(self):
+        return self._pending
+
+    async def run(self, func, *args):
+        """Run a picklable module-level function off the event loop"""
+        if self._pending >= self.max_pending:
+            self.stats['rejected'] += 1
+            raise AudioExecutorBusy('Audio processing queue is full')
+
+        loop = asyncio.get_running_loop()
+        self._pending += 1
+        try:
+            future = loop.run_in_executor(self._get_pool(), func, *args)
+            try:
+                result = await asyncio.wait_for(future, timeout=self.timeout)
+            except asyncio.TimeoutError:
+                # A running job cannot be interrupted; its result is discarded
+                self.stats['timed_out'] += 1
+                raise AudioDecodeError(f'Audio processing timed out after {self.timeout}s')
+            except BrokenProcessPool:
+                # A worker crashed (e.g. OOM); start a fresh pool for later calls
+                self.stats['restarted'] += 1
+                self._pool = None
+                raise AudioDecodeError('Audio worker process crashed')
+
+            self.stats['completed'] += 1
+            return result
+        finally:
+            self._pending -= 1
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+_executor = None
+
+
+def get_audio_executor():
+    global _executor
+    if _executor is None:
+        _executor = AudioExecutor(
+            max_workers=getattr(settings, 'AUDIO_EXECUTOR_WORKERS', 2),
+            max_pending=getattr(settings, 'AUDIO_EXECUTOR_QUEUE_LIMIT', 64),
+            timeout=getattr(settings, 'AUDIO_EXECUTOR_TIMEOUT', 15.0)
+        )
+    return _executor
@@ -0,0 +1,120 @@
+import threading
+import time
+
+from django.conf import settings
+
+from .metrics import metrics
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling an upstream endpoint whose circuit is open"""
+
+
+class CircuitBreaker:
+    """Fail-fast guard for one upstream endpoint.
+
+    After `failure_threshold` consecutive failures the circuit opens and calls
+    fail immediately with CircuitOpen. Once `reset_timeout` seconds have
+    passed it goes half-open and lets up to `half_open_probes` requests
+    through: a success closes the circuit, a failure opens it again.
+
+    Every transition starts a new generation. allow() returns the current
+    one and outcomes are recorded against it, so a slow call admitted before
+    the circuit opened cannot close it (or open it again) when it finishes.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=15.0, half_open_probes=1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_probes = half_open_probes
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.generation = 0
+        self._probes = 0
+
+    def _transition(self, state):
+        print(f"[CIRCUIT] {self.name}: {self.state} -> {state}")
+        metrics.increment('circuit_transition', endpoint=self.name, state=state)
+        self.state = state
+        self.generation += 1
+
+    def allow(self):
+        """Claim permission for one call and return its generation, or raise CircuitOpen"""
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self._transition(HALF_OPEN)
+                self._probes = 0
+            if self.state == CLOSED:
+                return self.generation
+            if self.state == HALF_OPEN and self._probes < self.half_open_probes:
+                self._probes += 1
+                return self.generation
+        metrics.increment('circuit_rejected', endpoint=self.name)
+        raise CircuitOpen(f'{self.name} is unavailable (circuit open)')
+
+    def record_success(self, generation):
+        with self._lock:
+            if generation != self.generation:
+                metrics.increment('circuit_stale_outcome', endpoint=self.name)
+                return
+            self.failures = 0
+            if self.state != CLOSED:
+                self._transition(CLOSED)
+
+    def record_failure(self, generation):
+        with self._lock:
+            if generation != self.generation:
+                metrics.increment('circuit_stale_outcome', endpoint=self.name)
+                return
+            self.failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+                self._transition(OPEN)
+                self.opened_at = time.monotonic()
+
+    def release(self, generation):
+        """Give back a half-open probe slot whose call ended without an outcome (e.g. cancelled)"""
+        with self._lock:
+            if generation == self.generation and self.state == HALF_OPEN and self._probes > 0:
+                self._probes -= 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.failures,
+            }
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(endpoint):
+    """Process-wide circuit breaker for an upstream endpoint"""
+    with _breakers_lock:
+        breaker = _breakers.get(endpoint)
+        if breaker is None:
+            breaker = _breakers[endpoint] = CircuitBreaker(
+                endpoint,
+                failure_threshold=getattr(settings, 'CIRCUIT_FAILURE_THRESHOLD', 5),
+                reset_timeout=getattr(settings, 'CIRCUIT_RESET_TIMEOUT', 15.0),
+                half_open_probes=getattr(settings, 'CIRCUIT_HALF_OPEN_PROBES', 1)
+            )
+        return breaker
+
+
+def circuits_snapshot():
+    with _breakers_lock:
+        return {endpoint: breaker.snapshot() for endpoint, breaker in _breakers.items()}
+
+
+def is_failure_status(status_code):
+    """Responses that say the endpoint itself is in trouble, as opposed to a bad request"""
+    return status_code == 429 or status_code >= 500
@@ -0,0 +1,68 @@
+import asyncio
+import time
+
+from .metrics import metrics
+
+
+def tightest(*deadlines_ms):
+    """Smallest of the given deadlines in ms, ignoring None"""
+    deadlines_ms = [d for d in deadlines_ms if d is not None]
+    return min(deadlines_ms) if deadlines_ms else None
+
+
+class DeadlineExceeded(Exception):
+    def __init__(self, stage):
+        super().__init__(f'Latency budget exceeded during {stage}')
+        self.stage = stage
+
+
+class Deadline:
+    """Latency budget for one utterance, shared by every pipeline stage.
+
+    Stages run through run(), which cancels them when the budget runs out.
+    `expires_at` is wall-clock time so it can travel with channel-layer
+    messages to other processes.
+    """
+
+    def __init__(self, budget_ms):
+        self.budget_ms = budget_ms
+        self._started = time.monotonic()
+        self.expires_at = time.time() + budget_ms / 1000.0
+
+    def remaining_ms(self):
+        return max(0.0, self.budget_ms - (time.monotonic() - self._started) * 1000.0)
+
+    @property
+    def expired(self):
+        return self.remaining_ms() <= 0.0
+
+    async def run(self, awaitable, stage):
+        """Await a stage, cancelling it with DeadlineExceeded if the budget runs out"""
+        try:
+            return await asyncio.wait_for(awaitable, timeout=self.remaining_ms() / 1000.0)
+        except asyncio.TimeoutError:
+            metrics.increment('deadline_exceeded', stage=stage)
+            raise DeadlineExceeded(stage)
+
+    async def run_each(self, awaitables, stage):
+        """Run stages concurrently; returns {key: result or exception}, with
+        DeadlineExceeded for the ones still running when the budget ran out"""
+        tasks = {key: asyncio.ensure_future(awaitable) for key, awaitable in awaitables.items()}
+        if not tasks:
+            return {}
+        try:
+            _, pending = await asyncio.wait(tasks.values(), timeout=self.remaining_ms() / 1000.0)
+        finally:
+            for task in tasks.values():
+                if not task.done():
+                    task.cancel()
+        if pending:
+            metrics.increment('deadline_exceeded', len(pending), stage=stage)
+
+        results = {}
+        for key, task in tasks.items():
+            if task in pending:
+                results[key] = DeadlineExceeded(stage)
+            else:
+                results[key] = task.exception() or task.result()
+        return results
@@ -0,0 +1,203 @@
+import asyncio
+import shutil
+import weakref
+from collections import deque
+from functools import lru_cache
+
+from django.conf import settings
+
+from .audio import AudioDecodeError, TARGET_SAMPLE_RATE
+
+
+class DecoderUnavailable(AudioDecodeError):
+    pass
+
+
+@lru_cache(maxsize=None)
+def ffmpeg_path(binary='ffmpeg'):
+    """Resolved path of the ffmpeg binary, or None; looked up once per process"""
+    return shutil.which(binary)
+
+
+# Output arguments for each pool: decode anything to 16 kHz mono s16le, or
+# encode 16 kHz mono WAV into one of the compact upload codecs
+DECODE_ARGS = [
+    '-i', 'pipe:0',
+    '-f', 's16le', '-acodec', 'pcm_s16le',
+    '-ac', '1', '-ar', str(TARGET_SAMPLE_RATE),
+]
+ENCODE_ARGS = {
+    'flac': ['-f', 'wav', '-i', 'pipe:0', '-c:a', 'flac', '-compression_level', '5', '-f', 'flac'],
+    'ogg_opus': ['-f', 'wav', '-i', 'pipe:0', '-c:a', 'libopus', '-b:a', '{opus_bitrate}',
+                 '-application', 'voip', '-f', 'ogg'],
+}
+
+
+class FFmpegPool:
+    """Pool of warm ffmpeg processes for one fixed pipe:0 -> pipe:1 conversion.
+
+    The ffmpeg CLI cannot decode several independent WebM streams from one
+    stdin, so each process handles a single clip: it is spawned ahead of time
+    and sits blocked on its stdin pipe until a clip arrives, then exits after
+    writing the result to stdout. A replacement is spawned in the background so
+    process startup never sits on the utterance's critical path.
+    """
+
+    def __init__(self, args, size=2, max_queue=32, timeout=10.0, ffmpeg_binary='ffmpeg'):
+        self.args = args
+        self.size = size
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.ffmpeg_binary = ffmpeg_binary
+        self._spares = deque()
+        self._slots = asyncio.Semaphore(size)
+        self._pending = 0
+        self._spawning = 0
+        self._closed = False
+        self.stats = {
+            'spawned': 0,
+            'restarted': 0,
+            'completed': 0,
+            'failed': 0,
+            'rejected': 0,
+        }
+
+    def command(self):
+        binary = ffmpeg_path(self.ffmpeg_binary) or self.ffmpeg_binary
+        return [binary, '-hide_banner', '-loglevel', 'error', *self.args, 'pipe:1']
+
+    async def _spawn(self):
+        if ffmpeg_path(self.ffmpeg_binary) is None:
+            raise DecoderUnavailable(f'{self.ffmpeg_binary} not found in PATH')
+        process = await asyncio.create_subprocess_exec(
+            *self.command(),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        self.stats['spawned'] += 1
+        return process
+
+    async def _replenish(self):
+        self._spawning += 1
+        try:
+            process = await self._spawn()
+        except Exception as e:
+            print(f"[ERROR] Could not start ffmpeg process: {e}")
+            return
+        finally:
+            self._spawning -= 1
+
+        if self._closed:
+            process.kill()
+        else:
+            self._spares.append(process)
+
+    def _fill(self):
+        """Top the spare set back up to the pool size in the background"""
+        missing = self.size - len(self._spares) - self._spawning
+        for _ in range(max(missing, 0)):
+            asyncio.ensure_future(self._replenish())
+
+    def health_check(self):
+        """Drop spares that died while idle and schedule their replacements"""
+        alive = deque()
+        for process in self._spares:
+            if process.returncode is None:
+                alive.append(process)
+            else:
+                self.stats['restarted'] += 1
+        self._spares = alive
+        self._fill()
+        return {
+            'spares': len(self._spares),
+            'pending': self._pending,
+            **self.stats,
+        }
+
+    async def _take_process(self):
+        self.health_check()
+        if self._spares:
+            process = self._spares.popleft()
+        else:
+            # Cold path: the pool is drained faster than it refills
+            process = await self._spawn()
+        self._fill()
+        return process
+
+    async def process(self, audio_data):
+        """Pipe a clip through a warm ffmpeg process and return its output"""
+        if self._closed:
+            raise DecoderUnavailable('ffmpeg pool is closed')
+        if self._pending >= self.max_queue:
+            self.stats['rejected'] += 1
+            raise DecoderUnavailable('ffmpeg queue is full')
+
+        self._pending += 1
+        try:
+            async with self._slots:
+                process = await self._take_process()
+                try:
+                    output, errors = await asyncio.wait_for(
+                        process.communicate(input=audio_data),
+                        timeout=self.timeout
+                    )
+                except asyncio.TimeoutError:
+                    process.kill()
+                    await process.wait()
+                    self.stats['failed'] += 1
+                    raise AudioDecodeError(f'ffmpeg timed out after {self.timeout}s')
+
+                if process.returncode != 0 or not output:
+                    self.stats['failed'] += 1
+                    message = errors.decode(errors='replace').strip() or f'exit code {process.returncode}'
+                    raise AudioDecodeError(f'ffmpeg failed: {message}')
+
+                self.stats['completed'] += 1
+                return output
+        finally:
+            self._pending -= 1
+
+    async def close(self):
+        self._closed = True
+        while self._spares:
+            process = self._spares.popleft()
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+
+
+# Subprocess transports belong to the loop that created them, so keep one set of pools per loop
+_pools = weakref.WeakKeyDictionary()
+
+
+def _get_pool(name, args, size):
+    loop = asyncio.get_running_loop()
+    loop_pools = _pools.setdefault(loop, {})
+    pool = loop_pools.get(name)
+    if pool is None:
+        pool = FFmpegPool(
+            args,
+            size=size,
+            max_queue=getattr(settings, 'AUDIO_DECODER_QUEUE_LIMIT', 32),
+            timeout=getattr(settings, 'AUDIO_DECODER_TIMEOUT', 10.0),
+            ffmpeg_binary=getattr(settings, 'FFMPEG_BINARY', 'ffmpeg')
+        )
+        loop_pools[name] = pool
+    return pool
+
+
+def get_decoder_pool():
+    """Return this event loop's decoder pool, or None when the pool is disabled"""
+    size = getattr(settings, 'AUDIO_DECODER_POOL_SIZE', 2)
+    if size <= 0:
+        return None
+    return _get_pool('decode', DECODE_ARGS, size)
+
+
+def get_encoder_pool(codec):
+    """Return this event loop's encoder pool for a compact upload codec"""
+    bitrate = getattr(settings, 'WHISPER_OPUS_BITRATE', '24k')
+    args = [arg.format(opus_bitrate=bitrate) for arg in ENCODE_ARGS[codec]]
+    size = max(1, getattr(settings, 'AUDIO_ENCODER_POOL_SIZE', 1))
+    return _get_pool(codec, args, size)
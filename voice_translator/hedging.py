@@ -0,0 +1,177 @@
+import asyncio
+import contextvars
+import threading
+import time
+
+from django.conf import settings
+
+from .metrics import Histogram, metrics
+
+# The attempt running in this task
+_current_attempt = contextvars.ContextVar('hedge_attempt', default=None)
+
+
+class AttemptClock:
+    """When one attempt started talking to the upstream, as opposed to waiting for a slot"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.upstream = asyncio.Event()
+
+    def mark(self):
+        self.started = time.perf_counter()
+        self.upstream.set()
+
+
+def upstream_started():
+    """Call once the current attempt holds its upstream slot: time queued before
+    that is neither upstream latency nor counted toward the hedge delay"""
+    clock = _current_attempt.get()
+    if clock is not None:
+        clock.mark()
+
+
+class Hedger:
+    """Duplicate slow upstream requests to cut tail latency.
+
+    A request that has not finished the `percentile`-th percentile of recent
+    latencies for its key after getting its upstream slot gets a second,
+    identical attempt; the first
+    attempt to succeed wins and the other is cancelled. Hedges are paid for
+    from a budget that grows by `budget_ratio` per request (up to `burst`), so
+    extra upstream spend stays at roughly that fraction of traffic even when
+    the upstream slows down across the board.
+    """
+
+    def __init__(self, percentile=95, min_samples=20, min_delay_ms=100.0,
+                 budget_ratio=0.05, burst=5.0, window=512):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_delay_ms = min_delay_ms
+        self.budget_ratio = budget_ratio
+        self.burst = burst
+        self.window = window
+        self._lock = threading.Lock()
+        self._latencies = {}
+        self._budget = burst
+
+    def delay_ms(self, key):
+        """Hedge delay for `key`, or None until enough latencies have been seen"""
+        with self._lock:
+            histogram = self._latencies.get(key)
+            if histogram is None or len(histogram.recent) < self.min_samples:
+                return None
+            return max(self.min_delay_ms, histogram.percentile(self.percentile))
+
+    def observe(self, key, latency_ms):
+        with self._lock:
+            histogram = self._latencies.get(key)
+            if histogram is None:
+                histogram = self._latencies[key] = Histogram(window=self.window)
+            histogram.observe(latency_ms)
+
+    def _earn(self):
+        with self._lock:
+            self._budget = min(self.burst, self._budget + self.budget_ratio)
+
+    def _spend(self):
+        with self._lock:
+            if self._budget < 1.0:
+                return False
+            self._budget -= 1.0
+            return True
+
+    async def _timed(self, key, make_attempt, clock):
+        # Each attempt runs in its own task, so each gets its own clock
+        _current_attempt.set(clock)
+        result = await make_attempt()
+        self.observe(key, (time.perf_counter() - clock.started) * 1000.0)
+        return result
+
+    async def _wait_for_upstream(self, primary, clock):
+        """Until the primary holds its upstream slot (or has finished)"""
+        waiting = asyncio.ensure_future(clock.upstream.wait())
+        try:
+            await asyncio.wait([primary, waiting], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            waiting.cancel()
+
+    async def run(self, key, make_attempt):
+        """Await make_attempt(), hedging it with a second call if it runs long.
+
+        make_attempt must call upstream_started() once it holds its upstream
+        slot; the hedge delay only starts counting from then, so a saturated
+        gate does not set off hedges that would queue behind it too.
+        """
+        self._earn()
+        delay = self.delay_ms(key)
+        clock = AttemptClock()
+        primary = asyncio.ensure_future(self._timed(key, make_attempt, clock))
+        attempts = [primary]
+        try:
+            if delay is not None:
+                await self._wait_for_upstream(primary, clock)
+                await asyncio.wait(attempts, timeout=delay / 1000.0)
+            if delay is None or primary.done():
+                return await primary
+            if not self._spend():
+                metrics.increment('hedge_skipped_budget', key=key)
+                return await primary
+
+            metrics.increment('hedge_sent', key=key)
+            hedge = asyncio.ensure_future(self._timed(key, make_attempt, AttemptClock()))
+            attempts.append(hedge)
+            pending = set(attempts)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for attempt in done:
+                    if not attempt.cancelled() and attempt.exception() is None:
+                        if attempt is hedge:
+                            metrics.increment('hedge_won', key=key)
+                        return attempt.result()
+            # Both attempts failed: surface the primary's error, unless it was cancelled
+            return (hedge if primary.cancelled() else primary).result()
+        finally:
+            # The loser, or both attempts if the caller was cancelled
+            for attempt in attempts:
+                if not attempt.done():
+                    attempt.cancel()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'budget': round(self._budget, 3),
+                'delay_ms': {
+                    key: max(self.min_delay_ms, h.percentile(self.percentile))
+                    for key, h in self._latencies.items() if len(h.recent) >= self.min_samples
+                },
+            }
+
+
+_hedger = None
+_hedger_lock = threading.Lock()
+
+
+def get_hedger():
+    """Process-wide hedger, or None when hedging is disabled"""
+    global _hedger
+    if not getattr(settings, 'HEDGING_ENABLED', False):
+        return None
+    with _hedger_lock:
+        if _hedger is None:
+            _hedger = Hedger(
+                percentile=getattr(settings, 'HEDGE_PERCENTILE', 95),
+                min_samples=getattr(settings, 'HEDGE_MIN_SAMPLES', 20),
+                min_delay_ms=getattr(settings, 'HEDGE_MIN_DELAY_MS', 100.0),
+                budget_ratio=getattr(settings, 'HEDGE_BUDGET_RATIO', 0.05),
+                burst=getattr(settings, 'HEDGE_BUDGET_BURST', 5.0)
+            )
+        return _hedger
+
+
+async def hedged(key, make_attempt):
+    """Run make_attempt() through the hedger if hedging is enabled"""
+    hedger = get_hedger()
+    if hedger is None:
+        return await make_attempt()
+    return await hedger.run(key, make_attempt)
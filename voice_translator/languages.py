@@ -0,0 +1,123 @@
+"""
+The one list of languages the service knows about.
+
+Participants, the Language table, prompts, voices and transcription results
+all name languages differently ("en", "en-US", "English", Whisper's
+"english"); everything goes through `languages.normalize()` to get the ISO
+639-1 code before comparing a language. Values from clients that are stored
+(a participant's language) go through `languages.require()`, which rejects
+languages the service cannot translate to.
+"""
+
+# Tokens a sentence takes relative to the same sentence in English, for
+# Llama 3's tokenizer, for languages not listed below
+DEFAULT_TOKEN_DENSITY = 2.0
+
+# code, English name, Whisper's name, flag, TTS voice, token density, other aliases
+LANGUAGES = [
+    ('en', 'English', 'english', '🇺🇸', 'en-US-neural-male', 1.0, ['eng']),
+    ('es', 'Spanish', 'spanish', '🇪🇸', 'es-ES-neural-male', 1.25, ['spa', 'castilian', 'español', 'espanol']),
+    ('fr', 'French', 'french', '🇫🇷', 'fr-FR-neural-male', 1.3, ['fra', 'fre', 'français', 'francais']),
+    ('de', 'German', 'german', '🇩🇪', 'de-DE-neural-male', 1.35, ['deu', 'ger', 'deutsch']),
+    ('it', 'Italian', 'italian', '🇮🇹', 'it-IT-neural-male', 1.3, ['ita', 'italiano']),
+    ('pt', 'Portuguese', 'portuguese', '🇵🇹', 'pt-PT-neural-male', 1.3, ['por', 'português', 'portugues']),
+    ('ru', 'Russian', 'russian', '🇷🇺', 'ru-RU-neural-male', 1.8, ['rus', 'русский']),
+    ('zh', 'Chinese', 'chinese', '🇨🇳', 'zh-CN-neural-male', 1.3, ['zho', 'chi', 'mandarin', '中文']),
+    ('ja', 'Japanese', 'japanese', '🇯🇵', 'ja-JP-neural-male', 1.6, ['jpn', '日本語']),
+    ('ko', 'Korean', 'korean', '🇰🇷', 'ko-KR-neural-male', 1.9, ['kor', '한국어']),
+    ('ar', 'Arabic', 'arabic', '🇸🇦', 'ar-SA-neural-male', 1.9, ['ara', 'العربية']),
+    ('hi', 'Hindi', 'hindi', '🇮🇳', 'hi-IN-neural-male', 2.4, ['hin', 'हिन्दी']),
+]
+
+DEFAULT_VOICE = 'en-US-neural-male'
+
+# What transcription reports when it could not tell
+UNKNOWN = 'unknown'
+
+
+class UnsupportedLanguage(ValueError):
+    pass
+
+
+class LanguageInfo:
+    def __init__(self, code, name, whisper_name, flag, voice, token_density, aliases=()):
+        self.code = code
+        self.name = name
+        self.whisper_name = whisper_name
+        self.flag = flag
+        self.voice = voice
+        self.token_density = token_density
+        self.aliases = list(aliases)
+
+    def __repr__(self):
+        return f'<LanguageInfo {self.code}>'
+
+
+class LanguageRegistry:
+    """Languages by ISO code, with a lookup from every known spelling to the code"""
+
+    def __init__(self, languages):
+        self._languages = {}
+        self._lookup = {}
+        for entry in languages:
+            language = LanguageInfo(*entry)
+            self._languages[language.code] = language
+            for spelling in [language.code, language.name, language.whisper_name] + language.aliases:
+                self._lookup[spelling.lower()] = language.code
+
+    def __iter__(self):
+        return iter(self._languages.values())
+
+    def __contains__(self, value):
+        return self.get(value) is not None
+
+    def get(self, value):
+        """The LanguageInfo for any spelling of it ("es", "es-MX", "Spanish", "spanish"), or None"""
+        if not value:
+            return None
+        value = str(value).strip().lower().replace('_', '-')
+        code = self._lookup.get(value)
+        if code is None and '-' in value:
+            # Region or script subtags: en-US, zh-Hans, pt-BR
+            code = self._lookup.get(value.split('-', 1)[0])
+        return self._languages.get(code)
+
+    def normalize(self, value, default=None):
+        """ISO code for `value`. Unknown languages pass through lowercased, so
+        use require() for anything that gets stored; a missing or undetected
+        language gives `default`."""
+        language = self.get(value)
+        if language is not None:
+            return language.code
+        if not value or str(value).strip().lower() == UNKNOWN:
+            return default
+        return str(value).strip().lower()
+
+    def require(self, value):
+        """ISO code for `value`; raises UnsupportedLanguage for a language not in the registry"""
+        language = self.get(value)
+        if language is None:
+            raise UnsupportedLanguage(f'Unsupported language: {value}')
+        return language.code
+
+    def same(self, first, second):
+        return self.normalize(first) == self.normalize(second)
+
+    def name(self, value):
+        language = self.get(value)
+        return language.name if language else str(value)
+
+    def voice(self, value):
+        language = self.get(value)
+        return language.voice if language else DEFAULT_VOICE
+
+    def token_density(self, value):
+        language = self.get(value)
+        return language.token_density if language else DEFAULT_TOKEN_DENSITY
+
+    def choices(self):
+        """(code, name) pairs for model and form fields"""
+        return [(language.code, language.name) for language in self]
+
+
+languages = LanguageRegistry(LANGUAGES)
@@ -1,4 +1,5 @@
 from django.core.management.base import BaseCommand
+from voice_translator.languages import languages
 from voice_translator.models import Language
 
 
@@ -6,25 +7,12 @@ class Command(BaseCommand):
     help = 'Populate the database with initial languages'
 
     def handle(self, *args, **options):
-        languages = [
-            {'code': 'en', 'name': 'English', 'flag': '🇺🇸'},
-            {'code': 'es', 'name': 'Spanish', 'flag': '🇪🇸'},
-            {'code': 'fr', 'name': 'French', 'flag': '🇫🇷'},
-            {'code': 'de', 'name': 'German', 'flag': '🇩🇪'},
-            {'code': 'it', 'name': 'Italian', 'flag': '🇮🇹'},
-            {'code': 'pt', 'name': 'Portuguese', 'flag': '🇵🇹'},
-            {'code': 'ru', 'name': 'Russian', 'flag': '🇷🇺'},
-            {'code': 'ja', 'name': 'Japanese', 'flag': '🇯🇵'},
-            {'code': 'ko', 'name': 'Korean', 'flag': '🇰🇷'},
-            {'code': 'zh', 'name': 'Chinese', 'flag': '🇨🇳'},
-        ]
-
-        for lang_data in languages:
+        for entry in languages:
             language, created = Language.objects.get_or_create(
-                code=lang_data['code'],
+                code=entry.code,
                 defaults={
-                    'name': lang_data['name'],
-                    'flag': lang_data['flag']
+                    'name': entry.name,
+                    'flag': entry.flag
                 }
             )
             if created:
@@ -0,0 +1,66 @@
+import math
+
+from django.conf import settings
+
+from .languages import UNKNOWN, languages
+
+# Identical for every call, so the provider can reuse its prompt cache; the
+# per-utterance user message carries only the language pair and the text
+SYSTEM_PROMPT = (
+    "You are a professional conference interpreter. Translate the user's text "
+    "from the first language to the second, as given on the first line "
+    "(source -> target). Maintain the speaker's tone and intent, use language "
+    "appropriate for a professional conference, and preserve technical terms "
+    "and proper nouns. Reply with the translation only, nothing else."
+)
+
+BATCH_INSTRUCTION = (
+    "The text is a JSON array of utterances. "
+    "Reply with a JSON array of their translations, in the same order."
+)
+
+
+def language_code(language):
+    return languages.normalize(language, UNKNOWN)
+
+
+def estimate_tokens(text):
+    """Upper-end token estimate: about three UTF-8 bytes per token in any script"""
+    return math.ceil(len(text.encode('utf-8')) / 3)
+
+
+def expansion_ratio(source_language, target_language):
+    return languages.token_density(target_language) / languages.token_density(source_language)
+
+
+def max_tokens_for(text, source_language, target_language, cap=None):
+    """Completion budget sized to the expected translation, with headroom"""
+    headroom = getattr(settings, 'TRANSLATION_TOKEN_HEADROOM', 1.5)
+    floor = getattr(settings, 'TRANSLATION_MAX_TOKENS_FLOOR', 16)
+    if cap is None:
+        cap = getattr(settings, 'TRANSLATION_MAX_TOKENS_CAP', 1000)
+    expected = estimate_tokens(text) * expansion_ratio(source_language, target_language)
+    return max(floor, min(cap, math.ceil(expected * headroom)))
+
+
+def language_pair(source_language, target_language):
+    return f'{language_code(source_language)}-{language_code(target_language)}'
+
+
+def language_pair_label(source_language, target_language):
+    return f'{languages.name(source_language)} -> {languages.name(target_language)}'
+
+
+def translation_messages(text, source_language, target_language):
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": f"{language_pair_label(source_language, target_language)}\n{text}"},
+    ]
+
+
+def batch_translation_messages(texts_json, source_language, target_language):
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user",
+         "content": f"{language_pair_label(source_language, target_language)}\n{BATCH_INSTRUCTION}\n{texts_json}"},
+    ]
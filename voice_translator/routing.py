@@ -0,0 +1,149 @@
+import bisect
+import threading
+import time
+
+from django.conf import settings
+
+from .metrics import metrics
+
+
+class ModelStats:
+    """EWMA latency per length bucket, and EWMA error rate, for one model"""
+
+    def __init__(self, buckets):
+        self.latency_ms = [None] * (len(buckets) + 1)
+        self.error_rate = 0.0
+        self.requests = 0
+        self.last_used = 0.0
+
+    def snapshot(self, buckets):
+        bounds = [str(b) for b in buckets] + ['inf']
+        return {
+            'latency_ms': {f'<={bound}': latency for bound, latency in zip(bounds, self.latency_ms)},
+            'error_rate': round(self.error_rate, 4),
+            'requests': self.requests,
+        }
+
+
+class ModelRouter:
+    """Chooses a model per request from a configured candidate list.
+
+    `candidates` is a list of ``(model, preferred_up_to)``: a model is
+    preferred for requests whose length (seconds of audio, or estimated input
+    tokens) is at most `preferred_up_to` (None = any length), and preferred
+    models are tried in list order before the rest. The first candidate that
+    is healthy and whose EWMA latency for this length fits the deadline wins;
+    otherwise the healthy candidate with the lowest expected latency does. A
+    model whose error rate is above `max_error_rate` is skipped until it has
+    been idle for `probe_interval` seconds, then given one request to prove
+    itself again.
+    """
+
+    def __init__(self, kind, candidates, buckets, alpha=0.2, max_error_rate=0.5, probe_interval=30.0):
+        self.kind = kind
+        self.candidates = list(candidates)
+        self.buckets = list(buckets)
+        self.alpha = alpha
+        self.max_error_rate = max_error_rate
+        self.probe_interval = probe_interval
+        self._lock = threading.Lock()
+        self._stats = {model: ModelStats(self.buckets) for model, _ in self.candidates}
+
+    def bucket(self, length):
+        """Index of the latency bucket `length` falls in"""
+        return bisect.bisect_left(self.buckets, length)
+
+    def _healthy(self, stats, now):
+        return stats.error_rate <= self.max_error_rate or now - stats.last_used >= self.probe_interval
+
+    def choose(self, length, deadline_ms=None):
+        bucket = self.bucket(length)
+        preferred = [model for model, up_to in self.candidates if up_to is None or length <= up_to]
+        ordered = preferred + [model for model, _ in self.candidates if model not in preferred]
+        now = time.monotonic()
+
+        with self._lock:
+            healthy = [model for model in ordered if self._healthy(self._stats[model], now)] or ordered
+            # Unmeasured models count as fast, so each gets tried
+            expected = {model: self._stats[model].latency_ms[bucket] or 0.0 for model in healthy}
+
+            model, reason = None, 'fastest'
+            if deadline_ms is None:
+                model, reason = healthy[0], 'preferred'
+            else:
+                for candidate in healthy:
+                    if expected[candidate] <= deadline_ms:
+                        model = candidate
+                        reason = 'preferred' if candidate == ordered[0] else 'deadline'
+                        break
+            if model is None:
+                model = min(healthy, key=expected.get)
+
+            stats = self._stats[model]
+            if stats.error_rate > self.max_error_rate and now - stats.last_used >= self.probe_interval:
+                # Only one probe at a time: the clock restarts now, not when the probe finishes
+                stats.last_used = now
+                reason = 'probe'
+
+        metrics.increment('model_route', kind=self.kind, model=model, reason=reason)
+        return model
+
+    def observe(self, model, length, latency_ms, ok=True):
+        """Fold one request's outcome into the model's averages"""
+        stats = self._stats.get(model)
+        if stats is None:
+            return
+        bucket = self.bucket(length)
+        with self._lock:
+            stats.requests += 1
+            stats.last_used = time.monotonic()
+            stats.error_rate += self.alpha * ((0.0 if ok else 1.0) - stats.error_rate)
+            if ok:
+                previous = stats.latency_ms[bucket]
+                if previous is None:
+                    stats.latency_ms[bucket] = latency_ms
+                else:
+                    stats.latency_ms[bucket] = previous + self.alpha * (latency_ms - previous)
+
+    def snapshot(self):
+        with self._lock:
+            return {model: stats.snapshot(self.buckets) for model, stats in self._stats.items()}
+
+
+_routers = {}
+_routers_lock = threading.Lock()
+
+
+def _build_router(kind):
+    options = dict(
+        alpha=getattr(settings, 'MODEL_ROUTER_ALPHA', 0.2),
+        max_error_rate=getattr(settings, 'MODEL_ROUTER_MAX_ERROR_RATE', 0.5),
+        probe_interval=getattr(settings, 'MODEL_ROUTER_PROBE_INTERVAL', 30.0)
+    )
+    if kind == 'stt':
+        return ModelRouter(
+            'stt',
+            getattr(settings, 'STT_MODELS', [('whisper-large-v3', None)]),
+            getattr(settings, 'STT_LATENCY_BUCKETS', [5.0, 15.0, 30.0]),
+            **options
+        )
+    return ModelRouter(
+        'translation',
+        getattr(settings, 'TRANSLATION_MODELS', [('llama-3.1-8b-instant', None)]),
+        getattr(settings, 'TRANSLATION_LATENCY_BUCKETS', [32, 128, 512]),
+        **options
+    )
+
+
+def get_router(kind):
+    """Process-wide router for 'stt' or 'translation'"""
+    with _routers_lock:
+        router = _routers.get(kind)
+        if router is None:
+            router = _routers[kind] = _build_router(kind)
+        return router
+
+
+def routers_snapshot():
+    with _routers_lock:
+        return {kind: router.snapshot() for kind, router in _routers.items()}
@@ -1,144 +1,365 @@
-import requests
 import json
-import tempfile
-import os
 import uuid
 import asyncio
-import httpx
+import time
 from django.conf import settings
 import io
+from collections import Counter
+
+from .audio import (
+    TARGET_SAMPLE_RATE, UPLOAD_CODECS, can_decode_natively, choose_upload_codec,
+    convert_for_whisper, is_wav, pcm16_to_wav, split_at_silence, wav_duration
+)
+from .audio_executor import get_audio_executor
+from .ffmpeg_pool import get_decoder_pool, get_encoder_pool
+from .metrics import metrics
+from .circuit import CircuitOpen, get_breaker, is_failure_status
+from .deadline import tightest
+from .hedging import hedged, upstream_started
+from .languages import UNKNOWN, languages
+from .routing import get_router
+from .prompts import (
+    batch_translation_messages, estimate_tokens, language_pair, max_tokens_for, translation_messages
+)
+from .translation_cache import TranslationCache
+from .upstream import PRIORITY_BACKGROUND, PRIORITY_LIVE, get_upstream_client, get_upstream_gate
+
+# Shared by every service instance in the process
+translation_cache = TranslationCache(getattr(settings, 'TRANSLATION_CACHE_SIZE', 2048))
 
-try:
-    from pydub import AudioSegment
-    PYDUB_AVAILABLE = True
-except ImportError:
-    PYDUB_AVAILABLE = False
 
 class VoiceTranslationService:
     def __init__(self):
         self.groq_api_key = settings.GROQ_API_KEY
         self.groq_base_url = "https://api.groq.com/openai/v1"
         
-    async def transcribe_audio_whisper(self, audio_file):
+    async def convert_audio_for_whisper(self, audio_data, pcm_format=None):
+        """Convert a clip to 16kHz mono WAV, decoding compressed input on the warm ffmpeg pool"""
+        executor = get_audio_executor()
+        if pcm_format or can_decode_natively(audio_data):
+            return await executor.run(convert_for_whisper, audio_data, pcm_format)
+
+        pool = get_decoder_pool()
+        if pool is None:
+            return await executor.run(convert_for_whisper, audio_data)
+
+        pcm_data = await pool.process(audio_data)
+        # Only a header and one copy: cheaper inline than a trip through the pool
+        return pcm16_to_wav(pcm_data, TARGET_SAMPLE_RATE)
+
+    async def encode_for_upload(self, wav_data):
+        """Re-encode the 16kHz WAV into the compact codec configured for its length"""
+        policy = getattr(settings, 'WHISPER_UPLOAD_CODECS', [(None, 'wav')])
+        codec = choose_upload_codec(wav_duration(wav_data), policy)
+
+        upload_data = wav_data
+        if codec != 'wav':
+            try:
+                with metrics.timer('whisper_upload_encode_ms', codec=codec):
+                    upload_data = await get_encoder_pool(codec).process(wav_data)
+            except Exception as encode_error:
+                print(f"Upload encoding to {codec} failed, sending WAV: {encode_error}")
+                codec, upload_data = 'wav', wav_data
+
+        metrics.observe('whisper_upload_bytes', len(upload_data), codec=codec)
+        if upload_data:
+            metrics.observe('whisper_upload_ratio', len(wav_data) / len(upload_data), codec=codec)
+        return upload_data, codec
+
+    async def request_transcription(self, wav_data, response_format="json", deadline=None):
+        """POST one clip to Groq Whisper and return the parsed response. `deadline` is the
+        utterance's voice_translator.deadline.Deadline, if it has one."""
+        upload_data, codec = await self.encode_for_upload(wav_data)
+        filename, content_type = UPLOAD_CODECS[codec]
+
+        router = get_router('stt')
+        duration = wav_duration(wav_data) or 0.0
+        deadline_ms = tightest(
+            getattr(settings, 'STT_DEADLINE_MS', None),
+            deadline.remaining_ms() if deadline else None
+        )
+
+        async def attempt():
+            # Pick the Whisper variant by clip length and recent model latency
+            model = router.choose(duration, deadline_ms)
+
+            # Prepare the request to Groq Whisper
+            headers = {
+                "Authorization": f"Bearer {self.groq_api_key}"
+            }
+
+            files = {
+                "file": (filename, upload_data, content_type),
+                "model": (None, model),
+                "response_format": (None, response_format),
+                "language": (None, "auto")  # Auto-detect language
+            }
+
+            breaker = get_breaker('audio/transcriptions')
+            generation = breaker.allow()
+            try:
+                async with get_upstream_gate().slot(PRIORITY_LIVE):
+                    upstream_started()
+                    started = time.perf_counter()
+                    try:
+                        with metrics.timer('whisper_request_ms', codec=codec, model=model):
+                            response = await get_upstream_client().post(
+                                f"{self.groq_base_url}/audio/transcriptions",
+                                headers=headers,
+                                files=files,
+                                timeout=30.0
+                            )
+                    except Exception:
+                        router.observe(model, duration, 0.0, ok=False)
+                        raise
+                    router.observe(model, duration, (time.perf_counter() - started) * 1000.0,
+                                   ok=response.status_code == 200)
+            except asyncio.CancelledError:
+                breaker.release(generation)
+                raise
+            except Exception:
+                breaker.record_failure(generation)
+                raise
+
+            if is_failure_status(response.status_code):
+                breaker.record_failure(generation)
+            else:
+                breaker.record_success(generation)
+
+            if response.status_code == 200:
+                return response.json()
+            else:
+                raise Exception(f"Transcription failed: {response.status_code} - {response.text}")
+
+        # A slow response gets a duplicate request; the first to succeed wins
+        return await hedged(f'stt:{router.bucket(duration)}', attempt)
+
+    async def transcribe_chunked(self, wav_data, deadline=None):
+        """Split a long clip at pauses, transcribe the chunks concurrently and stitch them in order"""
+        chunks = await get_audio_executor().run(
+            split_at_silence,
+            wav_data,
+            getattr(settings, 'TRANSCRIPTION_CHUNK_MAX_SECONDS', 15.0),
+            getattr(settings, 'TRANSCRIPTION_CHUNK_MIN_SECONDS', 5.0)
+        )
+        metrics.observe('whisper_chunks_per_clip', len(chunks))
+
+        limit = asyncio.Semaphore(getattr(settings, 'TRANSCRIPTION_CHUNK_CONCURRENCY', 4))
+
+        async def transcribe_chunk(chunk_wav):
+            async with limit:
+                return await self.request_transcription(chunk_wav, response_format="verbose_json", deadline=deadline)
+
+        results = await asyncio.gather(*[transcribe_chunk(chunk_wav) for _, chunk_wav in chunks])
+
+        texts = []
+        segments = []
+        detected = Counter()
+        for (offset, chunk_wav), result in zip(chunks, results):
+            text = result.get("text", "").strip()
+            if not text:
+                continue
+            texts.append(text)
+            detected[languages.normalize(result.get("language"), UNKNOWN)] += len(text)
+
+            chunk_segments = result.get("segments") or [
+                {"start": 0.0, "end": wav_duration(chunk_wav) or 0.0, "text": text}
+            ]
+            for segment in chunk_segments:
+                segments.append({
+                    "start": round(offset + segment["start"], 2),
+                    "end": round(offset + segment["end"], 2),
+                    "text": segment["text"].strip()
+                })
+
+        return {
+            "text": " ".join(texts),
+            "language": detected.most_common(1)[0][0] if detected else UNKNOWN,
+            "segments": segments
+        }
+
+    async def transcribe_audio_whisper(self, audio_file, pcm_format=None, deadline=None):
         """Step 1: Transcribe audio using Groq Whisper Turbo"""
         try:
-            if not PYDUB_AVAILABLE:
-                raise Exception("pydub not available - audio processing disabled")
-            
-            # Convert audio to proper format for Whisper
+            audio_file.seek(0)
+            audio_data = audio_file.read()
+
+            # Convert audio to proper format for Whisper (16kHz, mono, wav).
+            # WAV and raw PCM are decoded in-process; only compressed
+            # containers go through ffmpeg.
             try:
-                audio_segment = AudioSegment.from_file(audio_file)
-                # Ensure audio is in correct format (16kHz, mono, wav)
-                audio_segment = audio_segment.set_frame_rate(16000).set_channels(1)
+                wav_data = await self.convert_audio_for_whisper(audio_data, pcm_format)
             except Exception as audio_error:
-                # If audio conversion fails, try to use original file
+                # Whisper reads compressed containers itself, so those can go as
+                # they are; WAV or raw PCM that could not be decoded would not
+                if pcm_format or is_wav(audio_data):
+                    raise
                 print(f"Audio conversion failed, using original: {audio_error}")
-                # Create a simple temporary file copy
-                with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_file:
-                    audio_file.seek(0)
-                    temp_file.write(audio_file.read())
-                    temp_file_path = temp_file.name
-            else:
-                # Create temporary file with converted audio
-                with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_file:
-                    audio_segment.export(temp_file.name, format="wav")
-                    temp_file_path = temp_file.name
-            
-            try:
-                # Prepare the request to Groq Whisper
-                headers = {
-                    "Authorization": f"Bearer {self.groq_api_key}"
-                }
-                
-                with open(temp_file_path, "rb") as audio_file_handle:
-                    files = {
-                        "file": ("audio.wav", audio_file_handle, "audio/wav"),
-                        "model": (None, "whisper-large-v3"),
-                        "response_format": (None, "json"),
-                        "language": (None, "auto")  # Auto-detect language
-                    }
-                    
-                    async with httpx.AsyncClient() as client:
-                        response = await client.post(
-                            f"{self.groq_base_url}/audio/transcriptions",
-                            headers=headers,
-                            files=files,
-                            timeout=30.0
-                        )
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    return {
-                        "text": result.get("text", ""),
-                        "language": result.get("language", "unknown")
-                    }
-                else:
-                    raise Exception(f"Transcription failed: {response.status_code} - {response.text}")
-                    
-            finally:
-                if os.path.exists(temp_file_path):
-                    os.unlink(temp_file_path)
-                
+                wav_data = audio_data
+
+            # Long clips are transcribed as parallel chunks so latency tracks
+            # the longest chunk rather than the whole recording
+            duration = wav_duration(wav_data)
+            if duration and duration > getattr(settings, 'CHUNKED_TRANSCRIPTION_MIN_SECONDS', 25.0):
+                return await self.transcribe_chunked(wav_data, deadline)
+
+            result = await self.request_transcription(wav_data, deadline=deadline)
+            return {
+                "text": result.get("text", ""),
+                "language": languages.normalize(result.get("language"), UNKNOWN)
+            }
+
         except Exception as e:
             raise Exception(f"Whisper transcription failed: {str(e)}")
 
-    async def translate_text_gpt(self, text, source_language, target_language):
-        """Step 2: Translate text using Groq GPT model"""
-        try:
+    async def request_completion(self, messages, max_tokens, pair, priority=PRIORITY_LIVE, timeout=30.0,
+                                 length=0, deadline=None):
+        """POST a chat completion to Groq; returns (content, finish_reason) and records token usage.
+        `length` (estimated input tokens) and the utterance `deadline` steer the model router."""
+        router = get_router('translation')
+        deadline_ms = deadline.remaining_ms() if deadline else None
+        if priority == PRIORITY_LIVE:
+            deadline_ms = tightest(getattr(settings, 'TRANSLATION_DEADLINE_MS', None), deadline_ms)
+
+        async def attempt():
+            model = router.choose(length, deadline_ms)
             headers = {
                 "Authorization": f"Bearer {self.groq_api_key}",
                 "Content-Type": "application/json"
             }
-            
-            # Enhanced prompt for better translation quality
-            prompt = f"""You are a professional conference interpreter. Translate the following {source_language} text to {target_language} with high accuracy and natural flow.
-
-Source text: "{text}"
-
-Requirements:
-- Maintain the speaker's tone and intent
-- Use formal/professional language appropriate for conferences
-- Preserve technical terms and proper nouns
-- Only return the translated text, nothing else
-
-Translation:"""
-            
             data = {
-                "model": "llama-3.1-8b-instant",  # Updated to current model
-                "messages": [
-                    {
-                        "role": "system",
-                        "content": "You are a professional conference interpreter providing accurate, natural translations."
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
+                "model": model,
+                "messages": messages,
                 "temperature": 0.1,
-                "max_tokens": 1000,
+                "max_tokens": max_tokens,
                 "top_p": 1,
                 "stop": None
             }
-            
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    f"{self.groq_base_url}/chat/completions",
-                    headers=headers,
-                    json=data,
-                    timeout=30.0
-                )
-            
-            if response.status_code == 200:
-                result = response.json()
-                translated_text = result['choices'][0]['message']['content'].strip()
-                return translated_text
+
+            breaker = get_breaker('chat/completions')
+            generation = breaker.allow()
+            try:
+                async with get_upstream_gate().slot(priority):
+                    upstream_started()
+                    started = time.perf_counter()
+                    try:
+                        response = await get_upstream_client().post(
+                            f"{self.groq_base_url}/chat/completions",
+                            headers=headers,
+                            json=data,
+                            timeout=timeout
+                        )
+                    except Exception:
+                        router.observe(model, length, 0.0, ok=False)
+                        raise
+                    router.observe(model, length, (time.perf_counter() - started) * 1000.0,
+                                   ok=response.status_code == 200)
+            except asyncio.CancelledError:
+                breaker.release(generation)
+                raise
+            except Exception:
+                breaker.record_failure(generation)
+                raise
+
+            if is_failure_status(response.status_code):
+                breaker.record_failure(generation)
             else:
+                breaker.record_success(generation)
+
+            if response.status_code != 200:
                 raise Exception(f"Translation failed: {response.status_code} - {response.text}")
-                
+            return response.json()
+
+        # Only live requests are hedged; background work can wait out a slow response
+        if priority == PRIORITY_LIVE:
+            result = await hedged(f'translation:{router.bucket(length)}', attempt)
+        else:
+            result = await attempt()
+        usage = result.get('usage') or {}
+        if usage:
+            metrics.increment('translation_prompt_tokens', usage.get('prompt_tokens', 0), pair=pair)
+            metrics.increment('translation_completion_tokens', usage.get('completion_tokens', 0), pair=pair)
+            metrics.observe('translation_completion_budget_used',
+                            usage.get('completion_tokens', 0) / max_tokens, pair=pair)
+        choice = result['choices'][0]
+        return choice['message']['content'].strip(), choice.get('finish_reason')
+
+    async def translate_text_gpt(self, text, source_language, target_language, priority=PRIORITY_LIVE,
+                                 deadline=None):
+        """Step 2: Translate text using Groq GPT model"""
+        if languages.same(source_language, target_language):
+            metrics.increment('translation_skipped', reason='same_language')
+            return text
+        try:
+            messages = translation_messages(text, source_language, target_language)
+            pair = language_pair(source_language, target_language)
+            max_tokens = max_tokens_for(text, source_language, target_language)
+
+            length = estimate_tokens(text)
+            translated_text, finish_reason = await self.request_completion(
+                messages, max_tokens, pair, priority, length=length, deadline=deadline
+            )
+            if finish_reason == 'length':
+                # The estimate was short for this utterance; never show a cut-off translation
+                metrics.increment('translation_truncated', pair=pair)
+                cap = getattr(settings, 'TRANSLATION_MAX_TOKENS_CAP', 1000)
+                if max_tokens < cap:
+                    translated_text, _ = await self.request_completion(
+                        messages, cap, pair, priority, length=length, deadline=deadline
+                    )
+            translation_cache.put(text, pair, translated_text)
+            return translated_text
+
+        except CircuitOpen:
+            raise
         except Exception as e:
             raise Exception(f"GPT translation failed: {str(e)}")
 
+    def fallback_translation(self, text, source_language, target_language):
+        """Degraded-mode text for a listener: a cached translation if there is one, else the original.
+        Returns (text, untranslated)."""
+        cached = translation_cache.get(text, language_pair(source_language, target_language))
+        if cached is not None:
+            return cached, False
+        return text, True
+
+    async def translate_batch_gpt(self, texts, source_language, target_language, priority=PRIORITY_BACKGROUND):
+        """Translate several utterances in one request; falls back to one request each
+        if the model does not return exactly one translation per input"""
+        if languages.same(source_language, target_language):
+            metrics.increment('translation_skipped', len(texts), reason='same_language')
+            return list(texts)
+        if len(texts) == 1:
+            return [await self.translate_text_gpt(texts[0], source_language, target_language, priority)]
+
+        texts_json = json.dumps(texts, ensure_ascii=False)
+        messages = batch_translation_messages(texts_json, source_language, target_language)
+        pair = language_pair(source_language, target_language)
+        max_tokens = max_tokens_for(texts_json, source_language, target_language, cap=4000)
+
+        try:
+            content, finish_reason = await self.request_completion(
+                messages, max_tokens, pair, priority, timeout=60.0, length=estimate_tokens(texts_json)
+            )
+            if finish_reason == 'length':
+                metrics.increment('translation_truncated', pair=pair)
+                raise ValueError('batch translation was cut off')
+
+            # Tolerate a fenced code block around the array
+            content = content[content.find('['):content.rfind(']') + 1]
+            translations = json.loads(content)
+            if (not isinstance(translations, list) or len(translations) != len(texts)
+                    or not all(isinstance(t, str) for t in translations)):
+                raise ValueError('translation count mismatch')
+            return [t.strip() for t in translations]
+
+        except (ValueError, KeyError) as e:
+            print(f"[DEBUG] Batch translation unusable ({e}), translating one by one")
+            return [
+                await self.translate_text_gpt(text, source_language, target_language, priority)
+                for text in texts
+            ]
+
     async def text_to_speech_playai(self, text, target_language, voice_style="professional"):
         """Step 3: Convert translated text to speech using PlayAI TTS"""
         try:
@@ -182,10 +403,10 @@ Translation:"""
             # Step 1: Transcribe audio
             transcription_result = await self.transcribe_audio_whisper(audio_file)
             original_text = transcription_result["text"]
-            detected_language = transcription_result.get("language", source_language)
+            detected_language = languages.normalize(transcription_result.get("language"), source_language)
             
             # Step 2: Translate text if needed
-            if detected_language != target_language:
+            if not languages.same(detected_language, target_language):
                 translated_text = await self.translate_text_gpt(
                     original_text, detected_language, target_language
                 )
@@ -209,22 +430,12 @@ Translation:"""
 
     def get_voice_for_language(self, language, style="professional"):
         """Get appropriate voice settings for each language"""
-        voice_mapping = {
-            "en": "en-US-neural-male",
-            "es": "es-ES-neural-male", 
-            "fr": "fr-FR-neural-male",
-            "de": "de-DE-neural-male",
-            "ru": "ru-RU-neural-male",
-            "zh": "zh-CN-neural-male",
-            "ja": "ja-JP-neural-male",
-            "ko": "ko-KR-neural-male"
-        }
-        return voice_mapping.get(language, "en-US-neural-male")
+        return languages.voice(language)
 
     async def detect_language_from_audio(self, audio_file):
         """Detect language from audio using Whisper"""
         try:
             result = await self.transcribe_audio_whisper(audio_file)
-            return result.get("language", "unknown")
+            return result.get("language", UNKNOWN)
         except Exception as e:
-            return "unknown"
+            return UNKNOWN
@@ -1,3 +1,615 @@
-from django.test import TestCase
+import asyncio
+import os
+import struct
+import sys
+import tempfile
+import time
 
-# Create your tests here.
+import numpy as np
+from django.test import SimpleTestCase
+
+from . import audio_executor
+from .audio import (
+    TARGET_SAMPLE_RATE, WAVE_FORMAT_EXTENSIBLE, WAVE_FORMAT_IEEE_FLOAT, WAVE_FORMAT_PCM, AudioDecodeError,
+    can_decode_natively, choose_upload_codec, convert_for_whisper, encode_wav, find_silence_cuts, parse_wav_header,
+    pcm16_to_wav, resample_poly, split_at_silence, wav_duration
+)
+from .audio_executor import AudioExecutor, AudioExecutorBusy
+from .circuit import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpen
+from .deadline import Deadline, DeadlineExceeded
+from .ffmpeg_pool import DecoderUnavailable, FFmpegPool
+from .hedging import Hedger, upstream_started
+from .languages import UNKNOWN, UnsupportedLanguage, languages
+from .metrics import Histogram, Metrics, metrics
+from .prompts import (
+    batch_translation_messages, estimate_tokens, language_pair, max_tokens_for, translation_messages
+)
+from .routing import ModelRouter
+from .services import VoiceTranslationService
+from .upstream import PriorityGate
+
+
+class LanguageRegistryTests(SimpleTestCase):
+    def test_spellings_normalize_to_code(self):
+        for spelling in ['es', 'es-MX', 'es_ES', 'Spanish', 'spanish', 'Español']:
+            self.assertEqual(languages.normalize(spelling), 'es')
+        self.assertEqual(languages.normalize(UNKNOWN, 'en'), 'en')
+        self.assertEqual(languages.normalize(None, 'en'), 'en')
+
+    def test_require_rejects_unknown_languages(self):
+        self.assertEqual(languages.require('pt-BR'), 'pt')
+        # normalize passes them through; require is for values that get stored
+        self.assertEqual(languages.normalize('Klingon'), 'klingon')
+        with self.assertRaises(UnsupportedLanguage):
+            languages.require('Klingon')
+        with self.assertRaises(UnsupportedLanguage):
+            languages.require('')
+
+
+def wav_bytes(fmt_chunk, pcm, extra_chunks=b'', data_size=None):
+    data_size = len(pcm) if data_size is None else data_size
+    body = (b'WAVE' + b'fmt ' + struct.pack('<I', len(fmt_chunk)) + fmt_chunk + extra_chunks
+            + b'data' + struct.pack('<I', data_size) + pcm)
+    return b'RIFF' + struct.pack('<I', len(body)) + body
+
+
+def pcm_fmt(channels=1, sample_rate=16000, bits=16, format_tag=WAVE_FORMAT_PCM):
+    block_align = channels * bits // 8
+    return struct.pack('<HHIIHH', format_tag, channels, sample_rate, sample_rate * block_align, block_align, bits)
+
+
+def tone(frequency, sample_rate, seconds=1.0):
+    t = np.arange(int(sample_rate * seconds)) / sample_rate
+    return (0.5 * np.sin(2 * np.pi * frequency * t)).astype(np.float32)
+
+
+class WavHeaderTests(SimpleTestCase):
+    def test_pcm_header(self):
+        pcm = b'\x01\x00' * 100
+        fmt = parse_wav_header(wav_bytes(pcm_fmt(channels=2, sample_rate=44100), pcm))
+        self.assertEqual((fmt['channels'], fmt['sample_rate'], fmt['bits_per_sample']), (2, 44100, 16))
+        self.assertEqual(fmt['data_size'], len(pcm))
+        self.assertEqual(fmt['data_offset'], 44)
+
+    def test_odd_sized_chunk_before_data_is_padded(self):
+        data = wav_bytes(pcm_fmt(), b'\x00\x00' * 10, extra_chunks=b'LIST' + struct.pack('<I', 3) + b'abc\x00')
+        self.assertEqual(parse_wav_header(data)['data_size'], 20)
+
+    def test_streaming_header_without_data_size(self):
+        pcm = b'\x00\x00' * 50
+        self.assertEqual(parse_wav_header(wav_bytes(pcm_fmt(), pcm, data_size=0))['data_size'], 100)
+        self.assertEqual(parse_wav_header(wav_bytes(pcm_fmt(), pcm, data_size=0xFFFFFFFF))['data_size'], 100)
+
+    def test_extensible_format_uses_subformat(self):
+        fmt_chunk = (pcm_fmt(bits=32, format_tag=WAVE_FORMAT_EXTENSIBLE)
+                     + struct.pack('<HHI', 22, 32, 4) + struct.pack('<H', WAVE_FORMAT_IEEE_FLOAT) + b'\x00' * 14)
+        fmt = parse_wav_header(wav_bytes(fmt_chunk, b'\x00' * 16))
+        self.assertEqual(fmt['format_tag'], WAVE_FORMAT_IEEE_FLOAT)
+
+    def test_pcm16_wrapped_as_mono_wav(self):
+        pcm = b'\x01\x00\xff\xff' * 80
+        wav = pcm16_to_wav(pcm, TARGET_SAMPLE_RATE)
+        fmt = parse_wav_header(wav)
+        self.assertEqual((fmt['format_tag'], fmt['channels'], fmt['sample_rate'], fmt['bits_per_sample']),
+                         (WAVE_FORMAT_PCM, 1, TARGET_SAMPLE_RATE, 16))
+        self.assertEqual(wav[fmt['data_offset']:fmt['data_offset'] + fmt['data_size']], pcm)
+        self.assertAlmostEqual(wav_duration(wav), 160 / TARGET_SAMPLE_RATE)
+
+    def test_not_wav(self):
+        self.assertIsNone(parse_wav_header(b'OggS' + b'\x00' * 40))
+        with self.assertRaises(AudioDecodeError):
+            parse_wav_header(b'RIFF\x00\x00\x00\x00WAVE')
+
+    def test_zero_channels_or_sample_rate_rejected(self):
+        for fmt_chunk in (pcm_fmt(channels=0), pcm_fmt(sample_rate=0)):
+            data = wav_bytes(fmt_chunk, b'\x00\x00' * 10)
+            with self.assertRaises(AudioDecodeError):
+                parse_wav_header(data)
+            self.assertFalse(can_decode_natively(data))
+            self.assertIsNone(wav_duration(data))
+
+    def test_raw_pcm_needs_a_layout(self):
+        for layout in ({'channels': 0, 'sample_rate': 48000}, {'channels': 1, 'sample_rate': 0},
+                       {'channels': 'two', 'sample_rate': 48000}):
+            with self.assertRaises(AudioDecodeError):
+                convert_for_whisper(b'\x00\x00' * 480, {'format': 'pcm_s16le', **layout})
+
+
+class ResampleTests(SimpleTestCase):
+    def dominant_frequency(self, samples, sample_rate):
+        spectrum = np.abs(np.fft.rfft(samples))
+        return np.argmax(spectrum) * sample_rate / len(samples)
+
+    def test_length_and_pitch_preserved(self):
+        for rate in (48000, 44100, 8000):
+            resampled = resample_poly(tone(440, rate), rate, TARGET_SAMPLE_RATE)
+            self.assertEqual(len(resampled), TARGET_SAMPLE_RATE)
+            self.assertAlmostEqual(self.dominant_frequency(resampled, TARGET_SAMPLE_RATE), 440, delta=2)
+
+    def test_content_above_new_nyquist_removed(self):
+        resampled = resample_poly(tone(12000, 48000), 48000, TARGET_SAMPLE_RATE)
+        self.assertLess(np.abs(resampled[100:-100]).max(), 0.01)
+
+    def test_invalid_rate(self):
+        with self.assertRaises(ValueError):
+            resample_poly(tone(440, 16000), 0, TARGET_SAMPLE_RATE)
+
+    def test_convert_stereo_wav(self):
+        left = (tone(440, 48000) * 32767).astype('<i2')
+        stereo = np.stack([left, left], axis=1).tobytes()
+        converted = convert_for_whisper(wav_bytes(pcm_fmt(channels=2, sample_rate=48000), stereo))
+        fmt = parse_wav_header(converted)
+        self.assertEqual((fmt['channels'], fmt['sample_rate']), (1, TARGET_SAMPLE_RATE))
+        self.assertAlmostEqual(wav_duration(converted), 1.0, places=3)
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def test_opens_after_threshold_and_closes_after_probe(self):
+        breaker = CircuitBreaker('test', failure_threshold=2, reset_timeout=0.0)
+        for _ in range(2):
+            breaker.record_failure(breaker.allow())
+        self.assertEqual(breaker.state, OPEN)
+
+        probe = breaker.allow()
+        self.assertEqual(breaker.state, HALF_OPEN)
+        with self.assertRaises(CircuitOpen):
+            breaker.allow()
+        breaker.record_success(probe)
+        self.assertEqual(breaker.state, CLOSED)
+
+    def test_failed_probe_opens_again(self):
+        breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=0.0)
+        breaker.record_failure(breaker.allow())
+        breaker.record_failure(breaker.allow())
+        self.assertEqual(breaker.state, OPEN)
+
+    def test_released_probe_can_be_claimed_again(self):
+        breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=0.0)
+        breaker.record_failure(breaker.allow())
+        probe = breaker.allow()
+        breaker.release(probe)
+        breaker.record_success(breaker.allow())
+        self.assertEqual(breaker.state, CLOSED)
+
+    def test_stale_outcomes_are_ignored(self):
+        breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=60.0)
+        slow = breaker.allow()
+        breaker.record_failure(breaker.allow())
+        self.assertEqual(breaker.state, OPEN)
+
+        # A call admitted before the circuit opened does not close it
+        breaker.record_success(slow)
+        self.assertEqual(breaker.state, OPEN)
+        with self.assertRaises(CircuitOpen):
+            breaker.allow()
+
+        breaker.reset_timeout = 0.0
+        probe = breaker.allow()
+        breaker.record_failure(slow)
+        self.assertEqual(breaker.state, HALF_OPEN)
+        breaker.record_success(probe)
+        self.assertEqual(breaker.state, CLOSED)
+
+
+class HedgerTests(SimpleTestCase):
+    def test_hedge_wins_when_primary_is_cancelled(self):
+        hedger = Hedger(min_samples=1, min_delay_ms=10.0)
+        hedger.observe('key', 10.0)
+        calls = []
+
+        async def attempt():
+            calls.append(len(calls))
+            upstream_started()
+            if len(calls) == 1:
+                await asyncio.sleep(0.05)
+                raise asyncio.CancelledError()
+            await asyncio.sleep(0.1)
+            return 'hedge'
+
+        self.assertEqual(asyncio.run(hedger.run('key', attempt)), 'hedge')
+        self.assertEqual(len(calls), 2)
+
+    def test_time_queued_for_a_slot_does_not_trigger_a_hedge(self):
+        hedger = Hedger(min_samples=1, min_delay_ms=20.0)
+        hedger.observe('key', 20.0)
+        calls = []
+
+        async def attempt():
+            calls.append(len(calls))
+            # Waits well past the hedge delay for a gate slot, then answers quickly
+            await asyncio.sleep(0.1)
+            upstream_started()
+            await asyncio.sleep(0.005)
+            return 'primary'
+
+        self.assertEqual(asyncio.run(hedger.run('key', attempt)), 'primary')
+        self.assertEqual(len(calls), 1)
+        # Only the upstream part was recorded
+        self.assertLess(max(hedger._latencies['key'].recent), 50.0)
+
+
+class ModelRouterTests(SimpleTestCase):
+    def test_failing_model_gets_one_probe_at_a_time(self):
+        router = ModelRouter('test', [('primary', None), ('fallback', None)], [10], probe_interval=60.0)
+        for _ in range(5):
+            router.observe('primary', 1, 0.0, ok=False)
+        self.assertEqual(router.choose(1), 'fallback')
+
+        router._stats['primary'].last_used -= 60.0
+        self.assertEqual(router.choose(1), 'primary')
+        # The probe has not come back yet: no second one
+        self.assertEqual(router.choose(1), 'fallback')
+
+
+class PriorityGateTests(SimpleTestCase):
+    def test_cancelled_release_gives_the_slot_back(self):
+        async def main():
+            gate = PriorityGate(limit=1)
+            await gate.acquire()
+            # Hold the lock so the release has to wait for it, then cancel the releasing task
+            await gate._condition.acquire()
+            releasing = asyncio.ensure_future(gate.release())
+            await asyncio.sleep(0)
+            releasing.cancel()
+            await asyncio.sleep(0)
+            gate._condition.release()
+
+            self.assertEqual(gate.in_flight, 0)
+            await asyncio.wait_for(gate.acquire(), 1)
+            self.assertEqual(gate.in_flight, 1)
+        asyncio.run(main())
+
+    def test_waiter_is_woken_by_release(self):
+        async def main():
+            gate = PriorityGate(limit=1)
+            await gate.acquire()
+            waiting = asyncio.ensure_future(gate.acquire())
+            await asyncio.sleep(0)
+            self.assertFalse(waiting.done())
+            await gate.release()
+            await asyncio.wait_for(waiting, 1)
+        asyncio.run(main())
+
+
+class DeadlineTests(SimpleTestCase):
+    def test_stage_past_the_budget_is_cancelled(self):
+        cancelled = []
+
+        async def slow():
+            try:
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        deadline = Deadline(20)
+        with self.assertRaises(DeadlineExceeded) as raised:
+            asyncio.run(deadline.run(slow(), 'transcription'))
+        self.assertEqual(raised.exception.stage, 'transcription')
+        self.assertEqual(cancelled, [True])
+        self.assertTrue(deadline.expired)
+
+    def test_run_each_keeps_what_finished_in_time(self):
+        async def after(seconds, value):
+            await asyncio.sleep(seconds)
+            return value
+
+        async def fails():
+            raise ValueError('bad')
+
+        deadline = Deadline(50)
+        results = asyncio.run(deadline.run_each(
+            {'es': after(0, 'hola'), 'fr': after(1, 'bonjour'), 'de': fails()}, 'translation'
+        ))
+        self.assertEqual(results['es'], 'hola')
+        self.assertIsInstance(results['fr'], DeadlineExceeded)
+        self.assertIsInstance(results['de'], ValueError)
+
+
+# Stands in for ffmpeg: upper-cases stdin, fails on b'fail' and hangs on b'hang'
+FAKE_FFMPEG = '''#!{python}
+import sys, time
+data = sys.stdin.buffer.read()
+if data == b'fail':
+    sys.stderr.write('invalid data found')
+    sys.exit(1)
+if data == b'hang':
+    time.sleep(10)
+sys.stdout.buffer.write(data.upper())
+'''
+
+
+class FakeFFmpegMixin:
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.binary = os.path.join(cls.directory.name, 'ffmpeg')
+        with open(cls.binary, 'w') as script:
+            script.write(FAKE_FFMPEG.format(python=sys.executable))
+        os.chmod(cls.binary, 0o755)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+        super().tearDownClass()
+
+
+class FFmpegPoolTests(FakeFFmpegMixin, SimpleTestCase):
+
+    def run_pool(self, main, **options):
+        async def wrapper():
+            pool = FFmpegPool([], ffmpeg_binary=self.binary, **options)
+            try:
+                return await main(pool)
+            finally:
+                await pool.close()
+        return asyncio.run(wrapper())
+
+    def test_output_and_spares_replenished(self):
+        async def main(pool):
+            self.assertEqual(await pool.process(b'clip'), b'CLIP')
+            self.assertEqual(await pool.process(b'next'), b'NEXT')
+            await asyncio.sleep(0.2)
+            return pool.health_check()
+        report = self.run_pool(main, size=1)
+        self.assertEqual(report['completed'], 2)
+        self.assertEqual(report['spares'], 1)
+        # One per clip plus the spare waiting for the next one
+        self.assertEqual(report['spawned'], 3)
+
+    def test_nonzero_exit_reports_stderr(self):
+        async def main(pool):
+            with self.assertRaisesRegex(AudioDecodeError, 'invalid data found'):
+                await pool.process(b'fail')
+            return pool.stats
+        self.assertEqual(self.run_pool(main)['failed'], 1)
+
+    def test_timeout_kills_the_process(self):
+        async def main(pool):
+            with self.assertRaisesRegex(AudioDecodeError, 'timed out'):
+                await pool.process(b'hang')
+            return pool.stats
+        self.assertEqual(self.run_pool(main, timeout=0.5)['failed'], 1)
+
+    def test_full_queue_rejected(self):
+        async def main(pool):
+            hanging = asyncio.ensure_future(pool.process(b'hang'))
+            await asyncio.sleep(0)
+            with self.assertRaises(DecoderUnavailable):
+                await pool.process(b'clip')
+            with self.assertRaises(AudioDecodeError):
+                await hanging
+            return pool.stats
+        self.assertEqual(self.run_pool(main, max_queue=1, timeout=0.5)['rejected'], 1)
+
+    def test_missing_binary(self):
+        async def main():
+            pool = FFmpegPool([], ffmpeg_binary=os.path.join(self.directory.name, 'missing'))
+            with self.assertRaises(DecoderUnavailable):
+                await pool.process(b'clip')
+        asyncio.run(main())
+
+    def test_closed_pool_rejects(self):
+        async def main(pool):
+            await pool.close()
+            with self.assertRaises(DecoderUnavailable):
+                await pool.process(b'clip')
+        self.run_pool(main)
+
+
+class AudioExecutorTests(SimpleTestCase):
+    def run_executor(self, main, **options):
+        executor = AudioExecutor(**options)
+        try:
+            return asyncio.run(main(executor))
+        finally:
+            executor.shutdown()
+
+    def test_converts_in_a_worker_process(self):
+        pcm = (tone(440, 48000) * 32767).astype('<i2').tobytes()
+
+        async def main(executor):
+            return await executor.run(convert_for_whisper, wav_bytes(pcm_fmt(sample_rate=48000), pcm))
+        converted = self.run_executor(main, max_workers=1)
+        self.assertEqual(parse_wav_header(converted)['sample_rate'], TARGET_SAMPLE_RATE)
+        self.assertAlmostEqual(wav_duration(converted), 1.0, places=3)
+
+    def test_decode_error_propagates(self):
+        layout = {'format': 'pcm_s16le', 'channels': 0, 'sample_rate': 48000}
+
+        async def main(executor):
+            with self.assertRaises(AudioDecodeError):
+                await executor.run(convert_for_whisper, b'\x00\x00', layout)
+        self.run_executor(main, max_workers=1)
+
+    def test_full_queue_rejected(self):
+        async def main(executor):
+            with self.assertRaises(AudioExecutorBusy):
+                await executor.run(wav_duration, b'')
+            return executor.stats
+        self.assertEqual(self.run_executor(main, max_workers=0, max_pending=0)['rejected'], 1)
+
+    def test_timeout(self):
+        async def main(executor):
+            with self.assertRaisesRegex(AudioDecodeError, 'timed out'):
+                await executor.run(time.sleep, 1)
+            return executor.stats
+        self.assertEqual(self.run_executor(main, max_workers=0, timeout=0.05)['timed_out'], 1)
+
+    def test_crashed_worker_replaced(self):
+        async def main(executor):
+            with self.assertRaisesRegex(AudioDecodeError, 'crashed'):
+                await executor.run(os._exit, 1)
+            self.assertEqual(await executor.run(abs, -3), 3)
+            return executor.stats
+        stats = self.run_executor(main, max_workers=1)
+        self.assertEqual((stats['restarted'], stats['completed']), (1, 1))
+
+
+class UploadCodecTests(FakeFFmpegMixin, SimpleTestCase):
+    policy = [(2.0, 'wav'), (None, 'flac')]
+
+    def setUp(self):
+        metrics.reset()
+
+    def test_policy_picks_codec_by_duration(self):
+        self.assertEqual(choose_upload_codec(1.0, self.policy), 'wav')
+        self.assertEqual(choose_upload_codec(2.5, self.policy), 'flac')
+        self.assertEqual(choose_upload_codec(2.5, [(2.0, 'flac')]), 'wav')
+        self.assertEqual(choose_upload_codec(None, self.policy), 'wav')
+
+    def encode(self, seconds):
+        wav = encode_wav(tone(440, TARGET_SAMPLE_RATE, seconds), TARGET_SAMPLE_RATE)
+        return wav, asyncio.run(VoiceTranslationService().encode_for_upload(wav))
+
+    def test_long_clip_encoded_and_measured(self):
+        with self.settings(WHISPER_UPLOAD_CODECS=self.policy, FFMPEG_BINARY=self.binary):
+            wav, (upload, codec) = self.encode(3)
+        self.assertEqual((upload, codec), (wav.upper(), 'flac'))
+        self.assertEqual(metrics.histogram('whisper_upload_bytes', codec='flac').max, len(wav))
+        self.assertEqual(metrics.histogram('whisper_upload_encode_ms', codec='flac').count, 1)
+
+    def test_short_clip_stays_wav(self):
+        with self.settings(WHISPER_UPLOAD_CODECS=self.policy, FFMPEG_BINARY=self.binary):
+            wav, (upload, codec) = self.encode(1)
+        self.assertEqual((upload, codec), (wav, 'wav'))
+        self.assertIsNone(metrics.histogram('whisper_upload_encode_ms', codec='flac'))
+
+    def test_failed_encode_falls_back_to_wav(self):
+        missing = os.path.join(self.directory.name, 'missing')
+        with self.settings(WHISPER_UPLOAD_CODECS=self.policy, FFMPEG_BINARY=missing):
+            wav, (upload, codec) = self.encode(3)
+        self.assertEqual((upload, codec), (wav, 'wav'))
+        self.assertEqual(metrics.histogram('whisper_upload_ratio', codec='wav').max, 1.0)
+
+
+class MetricsTests(SimpleTestCase):
+    def test_histogram_percentiles_over_window(self):
+        histogram = Histogram(window=100)
+        for value in range(1, 201):
+            histogram.observe(value)
+        snapshot = histogram.snapshot()
+        self.assertEqual((snapshot['count'], snapshot['min'], snapshot['max']), (200, 1, 200))
+        self.assertEqual(snapshot['mean'], 100.5)
+        # Percentiles only cover the most recent 100 samples
+        self.assertEqual((snapshot['p50'], snapshot['p99']), (151, 199))
+        self.assertIsNone(Histogram().percentile(50))
+
+    def test_snapshot_renders_labels(self):
+        registry = Metrics()
+        registry.increment('requests', codec='flac', model='turbo')
+        registry.increment('requests', codec='flac', model='turbo')
+        with registry.timer('encode_ms'):
+            pass
+        snapshot = registry.snapshot()
+        self.assertEqual(snapshot['counters'], {'requests{codec=flac,model=turbo}': 2})
+        self.assertEqual(snapshot['histograms']['encode_ms']['count'], 1)
+
+
+def speech(pattern, sample_rate=TARGET_SAMPLE_RATE):
+    """Tone bursts separated by silence, from [(seconds, audible), ...]"""
+    return np.concatenate([
+        tone(440, sample_rate, seconds) if audible else np.zeros(int(sample_rate * seconds), dtype=np.float32)
+        for seconds, audible in pattern
+    ])
+
+
+class SilenceSplitTests(SimpleTestCase):
+    def test_cuts_land_in_pauses(self):
+        samples = speech([(4, True), (0.6, False), (4, True), (0.6, False), (4, True)])
+        cuts = find_silence_cuts(samples, TARGET_SAMPLE_RATE, max_chunk_seconds=6, min_chunk_seconds=2)
+        self.assertEqual(len(cuts), 2)
+        for cut, pause_start in zip(cuts, (4.0, 8.6)):
+            self.assertGreaterEqual(cut / TARGET_SAMPLE_RATE, pause_start)
+            self.assertLessEqual(cut / TARGET_SAMPLE_RATE, pause_start + 0.6)
+
+    def test_continuous_speech_still_bounded(self):
+        samples = speech([(20, True)])
+        cuts = find_silence_cuts(samples, TARGET_SAMPLE_RATE, max_chunk_seconds=6, min_chunk_seconds=2)
+        bounds = [0] + cuts + [len(samples)]
+        self.assertTrue(all(end - start <= 6 * TARGET_SAMPLE_RATE for start, end in zip(bounds, bounds[1:])))
+
+    def test_split_offsets_cover_the_clip(self):
+        wav = encode_wav(speech([(4, True), (0.6, False), (4, True)]), TARGET_SAMPLE_RATE)
+        chunks = split_at_silence(wav, 6, 2)
+        self.assertEqual(len(chunks), 2)
+        self.assertEqual(chunks[0][0], 0.0)
+        self.assertAlmostEqual(chunks[1][0], wav_duration(chunks[0][1]))
+        self.assertAlmostEqual(sum(wav_duration(chunk) for _, chunk in chunks), wav_duration(wav))
+
+    def test_short_clip_not_split(self):
+        wav = encode_wav(speech([(3, True)]), TARGET_SAMPLE_RATE)
+        self.assertEqual(split_at_silence(wav, 6, 2), [(0.0, wav)])
+
+
+class ChunkedTranscriptionTests(SimpleTestCase):
+    def setUp(self):
+        # Split in a thread rather than a worker process
+        self.executor = audio_executor._executor
+        audio_executor._executor = AudioExecutor(max_workers=0)
+
+    def tearDown(self):
+        audio_executor._executor = self.executor
+
+    def test_chunks_stitched_in_order(self):
+        wav = encode_wav(speech([(4, True), (0.6, False), (4, True), (0.6, False), (4, True)]), TARGET_SAMPLE_RATE)
+        replies = [
+            {'text': ' Hola a todos. ', 'language': 'spanish',
+             'segments': [{'start': 0.5, 'end': 3.5, 'text': ' Hola a todos.'}]},
+            {'text': '', 'language': 'english'},
+            {'text': 'Adiós.', 'language': 'es'},
+        ]
+        service = VoiceTranslationService()
+        requests = []
+
+        async def request_transcription(chunk_wav, response_format='json', deadline=None):
+            index = len(requests)
+            requests.append(response_format)
+            # Finish in reverse order; the stitched result must not depend on it
+            await asyncio.sleep(0.01 * (len(replies) - index))
+            return replies[index]
+
+        service.request_transcription = request_transcription
+        with self.settings(TRANSCRIPTION_CHUNK_MAX_SECONDS=6, TRANSCRIPTION_CHUNK_MIN_SECONDS=2):
+            result = asyncio.run(service.transcribe_chunked(wav))
+
+        self.assertEqual(requests, ['verbose_json'] * 3)
+        self.assertEqual(result['text'], 'Hola a todos. Adiós.')
+        self.assertEqual(result['language'], 'es')
+        self.assertEqual(result['segments'][0], {'start': 0.5, 'end': 3.5, 'text': 'Hola a todos.'})
+        # A chunk without segments becomes one segment, shifted by its offset
+        last = result['segments'][1]
+        self.assertEqual(last['text'], 'Adiós.')
+        self.assertGreaterEqual(last['start'], 8.6)
+        self.assertAlmostEqual(last['end'], wav_duration(wav), places=2)
+
+
+class PromptTests(SimpleTestCase):
+    def test_system_prompt_shared_by_every_pair(self):
+        spanish = translation_messages('Hola', 'spanish', 'fr')
+        korean = translation_messages('안녕하세요', 'ko', 'en-US')
+        self.assertEqual(spanish[0], korean[0])
+        self.assertEqual(spanish[1], {'role': 'user', 'content': 'Spanish -> French\nHola'})
+        batch = batch_translation_messages('["Hola"]', 'es', 'fr')
+        self.assertEqual(batch[0], spanish[0])
+        self.assertTrue(batch[1]['content'].endswith('\n["Hola"]'))
+
+    def test_language_pair_uses_codes(self):
+        self.assertEqual(language_pair('Español', 'fr_FR'), 'es-fr')
+        self.assertEqual(language_pair(None, 'en'), f'{UNKNOWN}-en')
+
+    def test_token_estimate_counts_bytes(self):
+        self.assertEqual(estimate_tokens('hello'), 2)
+        self.assertEqual(estimate_tokens('日本語'), 3)
+        self.assertEqual(estimate_tokens(''), 0)
+
+    def test_max_tokens_scaled_by_target_language(self):
+        text = 'x' * 300
+        with self.settings(TRANSLATION_TOKEN_HEADROOM=1.5, TRANSLATION_MAX_TOKENS_FLOOR=16,
+                           TRANSLATION_MAX_TOKENS_CAP=1000):
+            self.assertEqual(max_tokens_for(text, 'en', 'en'), 150)
+            self.assertEqual(max_tokens_for(text, 'en', 'hi'), 360)
+            self.assertEqual(max_tokens_for(text, 'hi', 'en'), 63)
+            self.assertEqual(max_tokens_for(text, 'en', 'hi', cap=200), 200)
+            self.assertEqual(max_tokens_for('Hi', 'en', 'es'), 16)
@@ -0,0 +1,36 @@
+import threading
+from collections import OrderedDict
+
+
+class TranslationCache:
+    """LRU cache of recent translations, keyed by language pair and text.
+
+    Short conference phrases ("thank you", "can you hear me?") repeat a lot;
+    when the translation endpoint is down a cached translation is a better
+    fallback than the untranslated original.
+    """
+
+    def __init__(self, size=2048):
+        self.size = size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def _key(text, pair):
+        return pair, ' '.join(text.split()).lower()
+
+    def get(self, text, pair):
+        key = self._key(text, pair)
+        with self._lock:
+            translation = self._entries.get(key)
+            if translation is not None:
+                self._entries.move_to_end(key)
+            return translation
+
+    def put(self, text, pair, translation):
+        key = self._key(text, pair)
+        with self._lock:
+            self._entries[key] = translation
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
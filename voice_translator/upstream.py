@@ -0,0 +1,152 @@
+import asyncio
+import weakref
+
+from django.conf import settings
+
+PRIORITY_LIVE = 'live'
+PRIORITY_BACKGROUND = 'background'
+
+
+class PriorityGate:
+    """Concurrency limit on upstream API calls that favours live traffic.
+
+    Live requests may use every slot. Background requests (catch-up
+    translation and the like) are capped at `background_limit` in flight and
+    only start when no live request is waiting, so they soak up spare
+    capacity without delaying anyone's live translation.
+    """
+
+    def __init__(self, limit=8, background_limit=2):
+        self.limit = limit
+        self.background_limit = min(background_limit, limit)
+        self._condition = asyncio.Condition()
+        self._in_flight = {PRIORITY_LIVE: 0, PRIORITY_BACKGROUND: 0}
+        self._live_waiting = 0
+
+    @property
+    def in_flight(self):
+        return sum(self._in_flight.values())
+
+    def _can_start(self, priority):
+        if self.in_flight >= self.limit:
+            return False
+        if priority == PRIORITY_BACKGROUND:
+            return self._live_waiting == 0 and self._in_flight[PRIORITY_BACKGROUND] < self.background_limit
+        return True
+
+    async def acquire(self, priority=PRIORITY_LIVE):
+        async with self._condition:
+            if priority == PRIORITY_LIVE:
+                self._live_waiting += 1
+            try:
+                await self._condition.wait_for(lambda: self._can_start(priority))
+            finally:
+                if priority == PRIORITY_LIVE:
+                    self._live_waiting -= 1
+                    # Background work may have been held back for this waiter
+                    self._condition.notify_all()
+            self._in_flight[priority] += 1
+
+    async def release(self, priority=PRIORITY_LIVE):
+        # Give the slot back before the first await: a caller cancelled while
+        # waiting for the lock (a hedge loser, a superseded utterance) must not keep it
+        self._in_flight[priority] -= 1
+        await asyncio.shield(self._wake())
+
+    async def _wake(self):
+        async with self._condition:
+            self._condition.notify_all()
+
+    def slot(self, priority=PRIORITY_LIVE):
+        return _Slot(self, priority)
+
+    def stats(self):
+        return {
+            'limit': self.limit,
+            'live': self._in_flight[PRIORITY_LIVE],
+            'background': self._in_flight[PRIORITY_BACKGROUND],
+            'live_waiting': self._live_waiting,
+        }
+
+
+class _Slot:
+    def __init__(self, gate, priority):
+        self.gate = gate
+        self.priority = priority
+
+    async def __aenter__(self):
+        await self.gate.acquire(self.priority)
+
+    async def __aexit__(self, *exc_info):
+        await self.gate.release(self.priority)
+
+
+# asyncio primitives belong to one loop, so keep one gate per loop
+_gates = weakref.WeakKeyDictionary()
+
+
+def get_upstream_gate():
+    loop = asyncio.get_running_loop()
+    gate = _gates.get(loop)
+    if gate is None:
+        gate = _gates[loop] = PriorityGate(
+            limit=getattr(settings, 'UPSTREAM_CONCURRENCY', 8),
+            background_limit=getattr(settings, 'UPSTREAM_BACKGROUND_CONCURRENCY', 2)
+        )
+    return gate
+
+
+# httpx pulls in httpcore and anyio, so it is imported on first use; clients,
+# like the gate, belong to one loop
+_clients = weakref.WeakKeyDictionary()
+
+# Builds the transport of new clients from their connection limits; session
+# recording wraps the network with it and replay replaces the network
+_transport_factory = None
+
+
+def set_upstream_transport(factory):
+    """Create upstream clients with `factory(limits)` as their transport; None restores
+    plain httpx. Clients already open keep their transport until closed."""
+    global _transport_factory
+    _transport_factory = factory
+
+
+def get_upstream_client():
+    """This loop's pooled HTTP client, so upstream requests reuse warm TLS connections"""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        import httpx
+
+        limits = httpx.Limits(
+            # The gate already bounds concurrency; hedges may briefly exceed it
+            max_connections=None,
+            max_keepalive_connections=getattr(settings, 'UPSTREAM_CONCURRENCY', 8),
+            keepalive_expiry=getattr(settings, 'UPSTREAM_KEEPALIVE_EXPIRY', 60.0)
+        )
+        transport = _transport_factory(limits) if _transport_factory else None
+        client = _clients[loop] = httpx.AsyncClient(limits=limits, transport=transport)
+    return client
+
+
+async def close_upstream_client():
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+async def prewarm_upstream(url, headers=None, connections=2, timeout=5.0):
+    """Open `connections` keep-alive connections to the upstream host, TLS handshake
+    included, so the first utterances do not pay for them; returns how many succeeded"""
+    client = get_upstream_client()
+
+    async def touch():
+        response = await client.get(url, headers=headers, timeout=timeout)
+        await response.aread()
+
+    results = await asyncio.gather(*(touch() for _ in range(connections)), return_exceptions=True)
+    failures = [result for result in results if isinstance(result, Exception)]
+    if failures:
+        print(f"[STARTUP] Could not pre-warm upstream connection to {url}: {failures[0]!r}")
+    return connections - len(failures)
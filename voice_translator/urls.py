@@ -6,5 +6,6 @@ app_name = 'voice_translator'
 urlpatterns = [
     path('languages/', views.LanguageListView.as_view(), name='language-list'),
     path('health/', views.health_check, name='health-check'),
+    path('metrics/', views.metrics_snapshot, name='metrics'),
     path('test-translate/', views.test_translation, name='test-translate'),
 ]
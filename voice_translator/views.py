@@ -7,6 +7,10 @@ import asyncio
 from .models import Language
 from .serializers import LanguageSerializer
 from .services import VoiceTranslationService
+from .metrics import metrics
+from .circuit import circuits_snapshot
+from .hedging import get_hedger
+from .routing import routers_snapshot
 
 
 class LanguageListView(generics.ListAPIView):
@@ -23,6 +27,17 @@ def health_check(request):
     })
 
 
+@api_view(['GET'])
+def metrics_snapshot(request):
+    """In-process pipeline metrics for this worker"""
+    return Response({
+        **metrics.snapshot(),
+        'routers': routers_snapshot(),
+        'circuits': circuits_snapshot(),
+        'hedging': get_hedger().stats() if get_hedger() else None,
+    })
+
+
 @api_view(['POST'])
 def test_translation(request):
     """Test endpoint for translation using real Groq API"""